@@ -0,0 +1,78 @@
+"""
+Бенчмарк журнала обновлений (update_journal.py): во что обходится вебхуку
+запись обновления на диск перед ответом 200.
+
+Одновременно --concurrency «вебхуков» пишут обновления типичного размера,
+каждое затем отмечается обработанным (контрольная точка). Для каждого режима
+печатаются пропускная способность, задержка append (p50/p99) и число fsync:
+    fsync   — групповой fdatasync, как в бою
+    nofsync — только запись в файл (переживает падение процесса, но не ОС)
+
+    python -m benchmarks.bench_journal --updates 20000 --concurrency 1,16,64
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+
+from update_journal import UpdateJournal
+
+# Типичное текстовое сообщение в теле вебхука, около 400 байт
+SAMPLE_UPDATE = (
+    '{"update_id": %d, "message": {"message_id": 1, "date": 1700000000, '
+    '"chat": {"id": 100500, "type": "private", "first_name": "Test"}, '
+    '"from": {"id": 100500, "is_bot": false, "first_name": "Test", "language_code": "ru"}, '
+    '"text": "/save %s", "entities": [{"type": "bot_command", "offset": 0, "length": 5}]}}'
+)
+
+
+async def run(updates: int, concurrency: int, fsync: bool, segment_bytes: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        journal = UpdateJournal(directory, segment_bytes=segment_bytes, fsync=fsync)
+        journal.open()
+        latencies = []
+        counter = iter(range(1, updates + 1))
+
+        async def webhook() -> None:
+            for update_id in counter:
+                payload = (SAMPLE_UPDATE % (update_id, "x" * 200)).encode()
+                started = time.perf_counter()
+                await journal.append(update_id, payload)
+                latencies.append(time.perf_counter() - started)
+                journal.complete(update_id)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(webhook() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        stats = journal.stats()
+        await journal.close()
+
+    latencies.sort()
+    return {
+        "mode": "fsync" if fsync else "nofsync",
+        "concurrency": concurrency,
+        "updates_per_s": round(updates / elapsed),
+        "append_ms_p50": round(latencies[len(latencies) // 2] * 1000, 3),
+        "append_ms_p99": round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+        "fsyncs": stats["fsyncs"],
+        "updates_per_fsync": round(updates / stats["fsyncs"], 1) if stats["fsyncs"] else None,
+        "segments_compacted": stats["compacted"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--concurrency", default="1,16,64", help="одновременных вебхуков, через запятую")
+    parser.add_argument("--segment-bytes", type=int, default=4 * 1024 * 1024)
+    args = parser.parse_args()
+
+    for fsync in (True, False):
+        for concurrency in (int(value) for value in args.concurrency.split(",")):
+            result = asyncio.run(run(args.updates, concurrency, fsync, args.segment_bytes))
+            print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Бенчмарк режима polling (main.py --mode polling, poller.py) на локальной
+заглушке Bot API: заглушка заранее получает --updates обновлений (та же смесь
+/save, /fetch, /status и echo, что в load_test), бот забирает их getUpdates
+и отвечает; замеряется время до последнего ответа.
+
+Каждый размер пачки (--limits) запускается в отдельном процессе (конфигурация
+bot_app читается при импорте). POLLING_LIMIT=1 — прежний прием по одному
+обновлению за запрос; 100 — максимальные пачки, обрабатываемые одновременно.
+--api-latency имитирует сетевой путь до api.telegram.org.
+
+    python -m benchmarks.bench_polling --updates 2000 --limits 1,100 --api-latency 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_storage import BENCH_CHAT_BASE, purge
+from benchmarks.fake_bot_api import FakeBotAPI
+from benchmarks.load_test import DEFAULT_MIX, build_stream
+from migrate import run_migrations
+
+
+async def child(args: argparse.Namespace) -> None:
+    """Один прогон в этом процессе; печатает результат JSON-строкой."""
+    replied = asyncio.Event()
+    replies = 0
+
+    def on_send(chat_id: int, text: str, sent_at: float) -> None:
+        nonlocal replies
+        replies += 1
+        if replies >= args.updates:
+            replied.set()
+
+    fake_api = FakeBotAPI(latency=args.api_latency / 1000, on_send=on_send)
+    base_url = await fake_api.start(port=args.api_port)
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "123456:POLLING-BENCH",
+        "TELEGRAM_API_BASE_URL": base_url,
+        "DATABASE_URL": args.db_url,
+        "DB_MIGRATE_ON_STARTUP": "0",
+        "UPDATE_MODE": args.mode,
+        "POLLING_LIMIT": str(args.limit),
+        "POLLING_TIMEOUT": "5",
+        "POLLING_OFFSET_FILE": args.offset_file,
+        "JOURNAL_DIR": args.journal_dir,
+        "OUTBOUND_GLOBAL_RATE": "1000000",
+        "OUTBOUND_CHAT_RATE": "1000000",
+        "OUTBOUND_CHAT_BURST": "1000000",
+        "FLOOD_RATE": "0",
+        # Окно дедупликации в /tmp переживает процесс: следующий прогон с теми же update_id
+        # получил бы одни дубли. Бенчмарку хватает окна в памяти своего процесса
+        "UPDATE_DEDUP_SHM_PATH": "",
+    })
+    import bot_app  # импорт после настройки окружения: конфигурация читается при импорте
+
+    random.seed(args.seed)
+    for _, body in build_stream(args.updates, args.chats, args.mix):
+        fake_api.push_update(json.loads(body))
+
+    started = time.perf_counter()
+    polling = asyncio.create_task(bot_app.run_polling())
+    try:
+        await asyncio.wait_for(replied.wait(), args.reply_timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - started
+    poller = bot_app.primary_bot().poller
+    stats = poller.stats()
+    poller.stop()
+    await polling
+    await fake_api.stop()
+
+    print(json.dumps({
+        "limit": args.limit,
+        "mode": args.mode,
+        "updates": args.updates,
+        "replies": replies,
+        "elapsed_s": round(elapsed, 2),
+        "updates_per_s": round(replies / elapsed, 1),
+        "get_updates_calls": fake_api.calls.get("getUpdates", 0),
+        "avg_batch": stats["avg_batch"],
+    }, ensure_ascii=False))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default="sqlite:///./bench_load.db")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--limits", default="1,100", help="размеры пачек getUpdates, через запятую")
+    parser.add_argument("--mode", choices=("inline", "queue"), default="inline", help="UPDATE_MODE бота")
+    parser.add_argument("--api-latency", type=float, default=20.0, help="задержка ответов заглушки, мс")
+    parser.add_argument("--reply-timeout", type=float, default=120.0)
+    parser.add_argument("--api-port", type=int, default=8084)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--limit", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--offset-file", help=argparse.SUPPRESS)
+    parser.add_argument("--journal-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(child(args))
+        return
+
+    # Схему готовит «мастер», как on_starting в gunicorn.conf.py
+    asyncio.run(run_migrations(args.db_url))
+    for limit in (int(value) for value in args.limits.split(",")):
+        with tempfile.TemporaryDirectory() as directory:
+            command = [
+                sys.executable, "-m", "benchmarks.bench_polling", "--child", "--limit", str(limit),
+                "--db-url", args.db_url, "--updates", str(args.updates), "--chats", str(args.chats),
+                "--mix", args.mix, "--mode", args.mode, "--api-latency", str(args.api_latency),
+                "--reply-timeout", str(args.reply_timeout), "--api-port", str(args.api_port),
+                "--seed", str(args.seed), "--offset-file", os.path.join(directory, "offset"),
+                "--journal-dir", os.path.join(directory, "journal"),
+            ]
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            print(output.strip().splitlines()[-1])
+        asyncio.run(purge(args.db_url, BENCH_CHAT_BASE - args.chats, BENCH_CHAT_BASE))
+
+
+if __name__ == "__main__":
+    main()
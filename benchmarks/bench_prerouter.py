@@ -0,0 +1,103 @@
+"""
+Микробенчмарк CPU на одно обновление: текущий путь вебхука
+(json + Update.de_json + Application.process_update) против PreRouter
+(orjson + отбрасывание по сырому dict + прямой вызов команды).
+
+Обработчики заменены пустыми, сеть не используется:
+    python -m benchmarks.bench_prerouter --updates 20000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from telegram import Update, User
+from telegram.ext import Application, CommandHandler, MessageHandler, filters
+
+from pre_router import DROP, PreRouter, loads
+
+BOT_USERNAME = "bench_bot"
+
+
+def message(text: str, command_length: int = 0) -> dict:
+    payload = {
+        "message_id": 1,
+        "date": 1700000000,
+        "chat": {"id": random.randrange(1, 10_000), "type": "private", "first_name": "Bench"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Bench", "username": "bench_user", "language_code": "ru"},
+        "text": text,
+    }
+    if command_length:
+        payload["entities"] = [{"type": "bot_command", "offset": 0, "length": command_length}]
+    return payload
+
+
+def synthetic_stream(count: int) -> list[bytes]:
+    """Смесь обновлений: половина не интересна ни одному обработчику."""
+    kinds = [
+        lambda: {"message": message("/save заметка для бенчмарка", 5)},
+        lambda: {"message": message("/fetch 5", 6)},
+        lambda: {"message": message("обычный текст для echo")},
+        lambda: {"edited_message": {**message("исправленный текст"), "edit_date": 1700000001}},
+        lambda: {"channel_post": {**message("пост в канале"), "chat": {"id": -100, "type": "channel", "title": "c"}}},
+        lambda: {"message_reaction": {
+            "chat": {"id": 1, "type": "private"}, "message_id": 1, "date": 1700000000,
+            "old_reaction": [], "new_reaction": [{"type": "emoji", "emoji": "👍"}],
+        }},
+    ]
+    return [json.dumps({"update_id": i, **random.choice(kinds)()}).encode() for i in range(count)]
+
+
+def build_application() -> Application:
+    async def noop(update, context):
+        pass
+
+    application = Application.builder().token("1:bench").updater(None).build()
+    for command in ("start", "save", "fetch", "status"):
+        application.add_handler(CommandHandler(command, noop, filters=filters.UpdateType.MESSAGE))
+    application.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.TEXT & ~filters.COMMAND, noop))
+    # Имитируем initialize() без сетевого getMe
+    application.bot._bot_user = User(id=1, is_bot=True, first_name="Bench", username=BOT_USERNAME)
+    application._initialized = True
+    return application
+
+
+async def legacy_path(application: Application, body: bytes) -> None:
+    update = Update.de_json(json.loads(body), application.bot)
+    await application.process_update(update)
+
+
+async def pre_router_path(application: Application, router: PreRouter, body: bytes) -> None:
+    data = loads(body)
+    if router.classify(data) == DROP:
+        return
+    await router.process(Update.de_json(data, application.bot))
+
+
+async def measure(name: str, stream: list[bytes], run) -> float:
+    started = time.process_time()
+    for body in stream:
+        await run(body)
+    per_update = (time.process_time() - started) / len(stream) * 1e6
+    print(f"{name:>12}: {per_update:8.1f} мкс CPU на обновление")
+    return per_update
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=20000)
+    args = parser.parse_args()
+
+    random.seed(1)
+    stream = synthetic_stream(args.updates)
+    application = build_application()
+    router = PreRouter(application, ("message",), BOT_USERNAME)
+
+    legacy = await measure("legacy", stream, lambda body: legacy_path(application, body))
+    routed = await measure("pre_router", stream, lambda body: pre_router_path(application, router, body))
+    print(f"Ускорение: x{legacy / routed:.2f}, {router.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
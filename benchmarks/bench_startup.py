@@ -0,0 +1,108 @@
+"""
+Бенчмарк холодного старта воркера: сколько проходит от startup_event до готовности.
+
+Каждый сценарий запускается в отдельном процессе (конфигурация bot_app читается
+при импорте), бот направлен на заглушку Bot API с задержкой --api-latency,
+имитирующей сетевой путь до api.telegram.org:
+    serial   — как раньше: миграции в воркере, затем getMe, последовательно
+    cold     — миграции уже применены мастером, БД и бот прогреваются одновременно, кэша профиля нет
+    warm     — то же, профиль бота из кэша (обычный рестарт воркера)
+
+    python -m benchmarks.bench_startup --db-url sqlite:///./bench_startup.db --api-latency 150
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_bot_api import FakeBotAPI
+from migrate import run_migrations
+
+SCENARIOS = ("serial", "cold", "warm")
+
+
+async def child(args: argparse.Namespace) -> None:
+    """Один старт воркера в этом процессе; печатает длительность в мс."""
+    fake_api = FakeBotAPI(latency=args.api_latency / 1000)
+    base_url = await fake_api.start(port=args.api_port)
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "123456:STARTUP-BENCH",
+        "TELEGRAM_API_BASE_URL": base_url,
+        "DATABASE_URL": args.db_url,
+        "BOT_IDENTITY_CACHE": args.identity_cache,
+        "DB_MIGRATE_ON_STARTUP": "1" if args.scenario == "serial" else "0",
+        # Окно дедупликации в /tmp переживает процесс: следующий прогон с теми же update_id
+        # получил бы одни дубли. Бенчмарку хватает окна в памяти своего процесса
+        "UPDATE_DEDUP_SHM_PATH": "",
+    })
+    import bot_app  # импорт после настройки окружения: конфигурация читается при импорте
+
+    started = time.perf_counter()
+    if args.scenario == "serial":
+        await bot_app.initialize_database()
+        await bot_app.initialize_bot()
+        elapsed = time.perf_counter() - started
+    else:
+        await bot_app.startup_event()
+        elapsed = time.perf_counter() - started
+        assert bot_app.worker_ready.is_set()
+    print(json.dumps({"elapsed_ms": round(elapsed * 1000, 1), "get_me_calls": fake_api.calls.get("getMe", 0)}))
+
+    if args.scenario != "serial":
+        await bot_app.shutdown_event()
+    await fake_api.stop()
+
+
+def run_child(args: argparse.Namespace, scenario: str, identity_cache: str) -> dict:
+    command = [
+        sys.executable, "-m", "benchmarks.bench_startup", "--child", "--scenario", scenario,
+        "--db-url", args.db_url, "--api-latency", str(args.api_latency), "--api-port", str(args.api_port),
+        "--identity-cache", identity_cache,
+    ]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default="sqlite:///./bench_startup.db")
+    parser.add_argument("--api-latency", type=float, default=150.0, help="задержка getMe заглушки, мс")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--api-port", type=int, default=8083)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--scenario", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--identity-cache", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(child(args))
+        return
+
+    # Схему один раз готовит «мастер»: так же, как on_starting в gunicorn.conf.py
+    asyncio.run(run_migrations(args.db_url))
+    with tempfile.TemporaryDirectory() as directory:
+        for scenario in SCENARIOS:
+            results = []
+            for run in range(args.runs):
+                identity_cache = os.path.join(directory, f"identity-{scenario}-{run}.json")
+                if scenario == "warm":
+                    # Кэш профиля оставил предыдущий запуск воркера
+                    run_child(args, "cold", identity_cache)
+                results.append(run_child(args, scenario, identity_cache))
+            timings = sorted(result["elapsed_ms"] for result in results)
+            print(json.dumps({
+                "scenario": scenario,
+                "api_latency_ms": args.api_latency,
+                "median_ms": round(statistics.median(timings), 1),
+                "max_ms": timings[-1],
+                "get_me_calls": results[-1]["get_me_calls"],
+            }, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Локальная заглушка Telegram Bot API для нагрузочных тестов.
+
+Отвечает на getMe, getUpdates, sendMessage и sendDocument, записывает все отправленные
+сообщения, умеет добавлять задержку и отвечать 429 (RetryAfter) на каждый N-й вызов.
+Обновления для getUpdates (режим polling) добавляются через push_update.
+Бот направляется на заглушку через TELEGRAM_API_BASE_URL=http://host:port/bot
+"""
+import asyncio
+import email.parser
+import email.policy
+import json
+import time
+from collections import deque
+from typing import Callable, Optional
+from urllib.parse import parse_qsl
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+BOT_USER = {"id": 100000001, "is_bot": True, "first_name": "Fake", "username": "fake_load_bot"}
+
+
+class FakeBotAPI:
+    """
+    Заглушка Bot API.
+
+    `latency` — задержка каждого sendMessage (и getMe, getUpdates) в секундах, `rate_limit_every` —
+    каждый N-й sendMessage получает 429 с `retry_after` секундами (0 — никогда).
+    `on_send(chat_id, text, t)` вызывается на каждое успешно принятое сообщение.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        rate_limit_every: int = 0,
+        retry_after: int = 1,
+        on_send: Optional[Callable[[int, str, float], None]] = None,
+    ):
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.on_send = on_send
+        self.sent: list[tuple[int, str, float]] = []
+        # (chat_id, имя файла, содержимое) принятых sendDocument
+        self.documents: list[tuple[int, str, bytes]] = []
+        self.calls: dict[str, int] = {}
+        self.rate_limited = 0
+        self._message_id = 0
+        # Неподтвержденные обновления для getUpdates
+        self.updates: deque = deque()
+        self._update_id = 0
+        self._update_arrived = asyncio.Event()
+        self._server: Optional[uvicorn.Server] = None
+        self._task: Optional[asyncio.Task] = None
+        self.app = Starlette(routes=[Route("/bot{token}/{method}", self.handle, methods=["GET", "POST"])])
+
+    async def _params(self, request: Request) -> dict:
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("application/json"):
+            return await request.json()
+        if content_type.startswith("multipart/form-data"):
+            return self._multipart(content_type, await request.body())
+        if not request.headers.get("content-type", "").startswith("application/x-www-form-urlencoded"):
+            return {}
+        # PTB передает параметры формой, сложные значения закодированы в JSON
+        params = {}
+        for key, value in parse_qsl((await request.body()).decode()):
+            try:
+                params[key] = json.loads(value)
+            except (TypeError, ValueError):
+                params[key] = value
+        return params
+
+    @staticmethod
+    def _multipart(content_type: str, body: bytes) -> dict:
+        """Разбирает multipart-тело (отправка файлов) без python-multipart: файлы — (имя, байты)."""
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            payload = part.get_payload(decode=True)
+            if part.get_filename():
+                params[name] = (part.get_filename(), payload)
+            else:
+                params[name] = payload.decode()
+        return params
+
+    async def handle(self, request: Request) -> JSONResponse:
+        method = request.path_params["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = await self._params(request)
+
+        if method == "getMe":
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return JSONResponse({"ok": True, "result": BOT_USER})
+        if method == "getUpdates":
+            return await self.get_updates(params)
+        if method == "sendMessage":
+            return await self.send_message(params)
+        if method == "sendDocument":
+            return self.send_document(params)
+        return JSONResponse({"ok": True, "result": True})
+
+    def push_update(self, update: dict) -> int:
+        """Добавляет обновление для getUpdates; update_id назначается по порядку. Возвращает его."""
+        self._update_id += 1
+        self.updates.append({**update, "update_id": self._update_id})
+        self._update_arrived.set()
+        return self._update_id
+
+    async def get_updates(self, params: dict) -> JSONResponse:
+        """getUpdates как в Telegram: offset подтверждает все обновления до него, timeout — long polling."""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        offset = int(params.get("offset") or 0)
+        while self.updates and self.updates[0]["update_id"] < offset:
+            self.updates.popleft()
+
+        timeout = float(params.get("timeout") or 0)
+        if not self.updates and timeout:
+            self._update_arrived.clear()
+            try:
+                await asyncio.wait_for(self._update_arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or 100)
+        return JSONResponse({"ok": True, "result": [self.updates[i] for i in range(min(limit, len(self.updates)))]})
+
+    async def send_message(self, params: dict) -> JSONResponse:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.rate_limit_every and self.calls["sendMessage"] % self.rate_limit_every == 0:
+            self.rate_limited += 1
+            return JSONResponse(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                },
+                status_code=429,
+            )
+
+        chat_id = int(params["chat_id"])
+        text = str(params.get("text", ""))
+        self.record(chat_id, text)
+        self._message_id += 1
+        return JSONResponse({
+            "ok": True,
+            "result": {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": text,
+            },
+        })
+
+    def send_document(self, params: dict) -> JSONResponse:
+        chat_id = int(params["chat_id"])
+        filename, content = params["document"]
+        self.documents.append((chat_id, filename, content))
+        self.record(chat_id, str(params.get("caption", "")))
+        self._message_id += 1
+        return JSONResponse({
+            "ok": True,
+            "result": {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "document": {"file_id": f"doc{self._message_id}", "file_unique_id": f"u{self._message_id}", "file_name": filename},
+            },
+        })
+
+    def record(self, chat_id: int, text: str) -> None:
+        """Учитывает доставленное сообщение (в том числе из тела ответа вебхука)."""
+        now = time.perf_counter()
+        self.sent.append((chat_id, text, now))
+        if self.on_send:
+            self.on_send(chat_id, text, now)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> str:
+        """Запускает заглушку в текущем event loop и возвращает base_url для бота."""
+        config = uvicorn.Config(self.app, host=host, port=port, log_level="warning", lifespan="off")
+        self._server = uvicorn.Server(config)
+        self._task = asyncio.create_task(self._server.serve())
+        while not self._server.started:
+            await asyncio.sleep(0.01)
+        return f"http://{host}:{port}/bot"
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.should_exit = True
+            await self._task
@@ -1,14 +1,42 @@
+import hmac
 import logging
 import os
 import asyncio
+import signal
+import threading
+from functools import partial
 from dotenv import load_dotenv
-from telegram import Update, Request # Импортируем Request для пользовательских настроек таймаута
+from telegram import Update
+from telegram.error import NetworkError
+from telegram.request import HTTPXRequest # Пул HTTP-соединений с пользовательскими таймаутами
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters
 from fastapi import FastAPI, Request as FastAPIRequest
-from starlette.responses import JSONResponse
-from databases import Database # Асинхронная библиотека для работы с базами данных
+from starlette.responses import JSONResponse, Response
+from update_queue import UpdateQueue
+from update_journal import UpdateJournal
+from poller import UpdatePoller
+from bots import BotRuntime, bot_id_of, per_bot_path, webhook_secret
+from config import (
+    BOT_TOKENS, DB_POOL_MAX_SIZE, HANDLED_UPDATE_TYPES, TELEGRAM_API_BASE_URL, UPDATE_MODE, UPDATE_WORKERS, WEBHOOK_SECRET,
+)
+from dispatcher import SharedUpdateIdWindow, UpdateDispatcher, DUPLICATE, REJECTED
+from write_buffer import SaveBuffer, SaveRetryQueue
+from records import FETCH_MAX_LIMIT, SEARCH_MAX_OFFSET, SEARCH_PAGE_SIZE, parse_fetch_args, parse_search_args
+from storage import SEARCH_CANDIDATES, Storage, create_storage, database_url_from_env
+from retention import RetentionJob
+from db_guard import CLOSED, CircuitBreaker, DatabaseUnavailable, guard_storage, probe_while_open
+from exporter import MAX_DOCUMENT_BYTES, ChatExporter, export_filename, parse_export_args
+from record_cache import RecordCache, make_generations
+from bot_identity import CachedIdentityBot
+from outbound import OutboundSender, WebhookReply, webhook_reply
+from pre_router import PreRouter, DROP, FLOOD_WARNING, LIMITED, loads
+from flood_control import FloodControl, SharedFloodBuckets, parse_costs
+from profiler import ProfilerBusy, SamplingProfiler, SlowUpdateLog, collapse
+import metrics
+from metrics import COMMAND_ERRORS_TOTAL, LAST_SAVE_TIMESTAMP, STARTUP_SECONDS, UPDATES_TOTAL, observe_stage
 import datetime
 import json
+import time
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -23,185 +51,549 @@ logging.basicConfig(
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("httpcore").setLevel(logging.WARNING)
 
+# --- Режим Приема Обновлений ---
+# webhook: Telegram присылает обновления на /webhook (gunicorn, set_webhook.py).
+# polling: main.py сам забирает их getUpdates — для окружений без публичного URL.
+# Переключение: BOT_MODE или `python main.py --mode polling`.
+BOT_MODE = os.getenv("BOT_MODE", "webhook")
+# Обновлений за один getUpdates (максимум Telegram — 100) и сколько Telegram держит
+# запрос, пока новых обновлений нет (long polling)
+POLLING_LIMIT = int(os.getenv("POLLING_LIMIT", "100"))
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", "50"))
+# Файл со следующим offset: после рестарта уже обработанные обновления не повторяются
+POLLING_OFFSET_FILE = os.getenv("POLLING_OFFSET_FILE", "./polling_offset")
+
+# --- Исходящие Запросы к Bot API ---
+# Глобальный лимит Telegram ~30 сообщений/с, в один чат — около 1 сообщения/с.
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+# Одновременных запросов к Bot API = размер пула HTTP-соединений
+OUTBOUND_CONCURRENCY = int(os.getenv("OUTBOUND_CONCURRENCY", "16"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+# Возвращать единственный ответ обработчика прямо в теле ответа вебхука
+# (только для UPDATE_MODE=inline: в режиме очереди ответ на вебхук уже отправлен)
+WEBHOOK_REPLY_INLINE = os.getenv("WEBHOOK_REPLY_INLINE", "0") == "1"
+
+# --- Боты ---
+# Токены (BOT_TOKENS), WEBHOOK_SECRET и адрес Bot API — в config.py, общем с set_webhook.py
+
 # --- Настройка Сетевого Таймаута ---
 # Устанавливаем таймаут 20 секунд (вместо стандартных ~5 секунд)
 # Это должно решить проблему с TimedOut.
-CUSTOM_REQUEST = Request(
+# Один клиент на всех ботов процесса: соединения с api.telegram.org переиспользуются
+CUSTOM_REQUEST = HTTPXRequest(
+    connection_pool_size=OUTBOUND_CONCURRENCY * max(len(BOT_TOKENS), 1),
     connect_timeout=20.0,
     read_timeout=20.0,
     write_timeout=20.0,
+    http_version="1.1",
 )
 
+# --- Старт Воркера ---
+# Профиль бота (getMe) кэшируется в файле: рестарт воркеров не ходит за ним в сеть
+BOT_IDENTITY_CACHE = os.getenv("BOT_IDENTITY_CACHE", "/tmp/telegram_bot_identity.json")
+BOT_IDENTITY_TTL = float(os.getenv("BOT_IDENTITY_TTL", "86400"))
+# Миграции применяет мастер gunicorn (gunicorn.conf.py) и выставляет здесь 0;
+# при запуске без gunicorn (uvicorn, тесты) воркер применяет их сам
+DB_MIGRATE_ON_STARTUP = os.getenv("DB_MIGRATE_ON_STARTUP", "1") == "1"
+# Бюджет времени старта воркера, секунды: превышение попадает в лог и метрику bot_startup_seconds
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET", "1"))
+# Сколько startup_event ждет готовности, прежде чем отдать управление uvicorn
+# (дольше нельзя: gunicorn убьет молчащий воркер по timeout), и пауза между попытками
+STARTUP_WAIT = float(os.getenv("STARTUP_WAIT", "15"))
+STARTUP_RETRY_INTERVAL = float(os.getenv("STARTUP_RETRY_INTERVAL", "2"))
+
+# --- Режим Приема Обновлений ---
+# UPDATE_MODE (inline или queue) и UPDATE_WORKERS — в config.py: от них зависит
+# max_connections вебхука в set_webhook.py
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+# Сколько вебхук ждет свободного места в заполненной очереди, прежде чем вернуть 503
+UPDATE_ENQUEUE_TIMEOUT = float(os.getenv("UPDATE_ENQUEUE_TIMEOUT", "0.05"))
+# Сколько shutdown_event ждет обработки уже принятых обновлений
+UPDATE_DRAIN_TIMEOUT = float(os.getenv("UPDATE_DRAIN_TIMEOUT", "25"))
+# Сколько последних update_id помнит дедупликатор повторных доставок
+UPDATE_DEDUP_WINDOW = int(os.getenv("UPDATE_DEDUP_WINDOW", "65536"))
+# Окно update_id в mmap-файле (файл на бота: <путь>.<bot_id>), общем для воркеров хоста:
+# повторная доставка может прийти в любой воркер. Пустое значение — окно в каждом воркере.
+# Файл переживает рестарты воркеров и деплои (пока жив /tmp контейнера) и очищается только
+# после суток без обновлений. Поэтому все, что шлет одни и те же update_id повторно
+# (бенчмарки, тесты против заглушки Bot API), должно задавать пустой или свой путь.
+UPDATE_DEDUP_SHM_PATH = os.getenv("UPDATE_DEDUP_SHM_PATH", "/tmp/telegram_bot_updates.seen")
+# Журнал принятых обновлений (update_journal.py) для режима queue: вебхук отвечает 200
+# только после записи обновления на диск, а принятое, но не обработанное до падения
+# воркера обрабатывается повторно при следующем старте. В режиме inline 200 уходит
+# после обработки, и недоставленное Telegram повторит сам. Пустой JOURNAL_DIR отключает
+# журнал, JOURNAL_FSYNC=0 — запись без fsync (переживет падение процесса, но не ОС).
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", "./journal")
+JOURNAL_FSYNC = os.getenv("JOURNAL_FSYNC", "1") == "1"
+JOURNAL_SEGMENT_BYTES = int(os.getenv("JOURNAL_SEGMENT_BYTES", str(4 * 1024 * 1024)))
+
+# --- Ограничение Флуда ---
+# Поканальный token bucket на входе: FLOOD_RATE токенов в секунду, не больше FLOOD_BURST
+# подряд (FLOOD_RATE=0 отключает). Стоимость обновления — FLOOD_COSTS по имени команды,
+# text — обычные сообщения (echo), остальное стоит 1.
+FLOOD_RATE = float(os.getenv("FLOOD_RATE", "1"))
+FLOOD_BURST = float(os.getenv("FLOOD_BURST", "10"))
+FLOOD_COSTS = parse_costs(os.getenv("FLOOD_COSTS", "fetch=3,search=3,export=5,restore=5,status=2"))
+# Через сколько секунд тишины ведро чата забывается
+FLOOD_IDLE_TTL = float(os.getenv("FLOOD_IDLE_TTL", "600"))
+# Ведра в mmap-файле (файл на бота: <путь>.<bot_id>), общем для воркеров хоста: обновления
+# чата приходят в любой воркер, и с ведром в каждом лимит был бы в WEB_CONCURRENCY раз выше.
+# Пустое значение — ведра в памяти каждого воркера, лимиты действуют на воркер.
+FLOOD_SHM_PATH = os.getenv("FLOOD_SHM_PATH", "/tmp/telegram_bot_flood.buckets")
+# Ячеек в файле ведер: с запасом больше чатов, активных за FLOOD_IDLE_TTL
+FLOOD_SHM_SLOTS = int(os.getenv("FLOOD_SHM_SLOTS", "65536"))
+
 # --- Настройка Базы Данных ---
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    DB_USER = os.getenv("POSTGRES_USER", "user")
-    DB_PASSWORD = os.getenv("POSTGRES_PASSWORD", "password")
-    DB_NAME = os.getenv("POSTGRES_DB", "mydb")
-    # Используем имя сервиса 'db' из docker-compose для хоста
-    DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@db:5432/{DB_NAME}"
-    logging.info(f"Используется DATABASE_URL по умолчанию: {DATABASE_URL}")
+DATABASE_URL = database_url_from_env()
+# Небольшой инсталляции Postgres не нужен: DATABASE_URL=sqlite:///./data/bot.db
+# включает SQLite в режиме WAL с отдельным потоком-писателем (см. storage.py).
+# Потоков-читателей SQLite на воркер
+SQLITE_READERS = int(os.getenv("SQLITE_READERS", "4"))
+# Сколько самых новых совпадений ранжирует /search в SQLite: больше — глубже поиск,
+# но дороже запрос (~10 мс на 500 для частого слова). Не меньше 206, иначе
+# последние страницы до SEARCH_MAX_OFFSET окажутся пустыми.
+SQLITE_SEARCH_CANDIDATES = int(os.getenv("SQLITE_SEARCH_CANDIDATES", str(SEARCH_CANDIDATES)))
+
+# --- Пул Соединений и Защита БД ---
+# DB_POOL_MAX_SIZE — в config.py. DB_STATEMENT_CACHE_SIZE=0 нужен за pgbouncer.
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+# Дедлайн одного обращения к БД, включая ожидание соединения из пула (0 — без дедлайна)
+DB_QUERY_TIMEOUT = float(os.getenv("DB_QUERY_TIMEOUT", "5"))
+# Автомат размыкается после DB_BREAKER_FAILURES ошибок недоступности подряд
+# и пробует БД снова через DB_BREAKER_RESET секунд
+DB_BREAKER_FAILURES = int(os.getenv("DB_BREAKER_FAILURES", "5"))
+DB_BREAKER_RESET = float(os.getenv("DB_BREAKER_RESET", "10"))
+# Сколько /save воркер держит в памяти до повторной записи, пока БД недоступна
+SAVE_RETRY_MAX_ROWS = int(os.getenv("SAVE_RETRY_MAX_ROWS", "10000"))
+
+# --- Пакетная Запись /save (write-behind) ---
+# SAVE_BATCH_ROWS=0 отключает буфер: каждая команда /save пишет свой INSERT.
+SAVE_BATCH_ROWS = int(os.getenv("SAVE_BATCH_ROWS", "0"))
+SAVE_BATCH_MS = float(os.getenv("SAVE_BATCH_MS", "20"))
+# values — многострочный INSERT, copy — COPY через asyncpg
+SAVE_BATCH_METHOD = os.getenv("SAVE_BATCH_METHOD", "values")
+# Тексты /save от TEXT_BLOB_MIN_BYTES байт хранятся сжатыми и один раз на одинаковое
+# содержимое (text_blobs.py); 0 — все тексты в data_text, как раньше
+TEXT_BLOB_MIN_BYTES = int(os.getenv("TEXT_BLOB_MIN_BYTES", "0"))
+
+storage: Storage = create_storage(
+    DATABASE_URL,
+    save_method=SAVE_BATCH_METHOD,
+    blob_min_bytes=TEXT_BLOB_MIN_BYTES,
+    sqlite_readers=SQLITE_READERS,
+    sqlite_search_candidates=SQLITE_SEARCH_CANDIDATES,
+    pool_min_size=DB_POOL_MIN_SIZE,
+    pool_max_size=DB_POOL_MAX_SIZE,
+    statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+    command_timeout=DB_QUERY_TIMEOUT or None,
+)
+db_breaker = CircuitBreaker(failure_threshold=DB_BREAKER_FAILURES, reset_timeout=DB_BREAKER_RESET)
+save_retry: SaveRetryQueue = None
+
+save_buffer: SaveBuffer = None
+
+# --- Кэш /fetch ---
+# FETCH_CACHE_SIZE=0 отключает кэш. Бэкенд поколений определяет, где видна инвалидация:
+# local — только в этом воркере, shm — во всех воркерах хоста (mmap-файл), redis — везде.
+FETCH_CACHE_SIZE = int(os.getenv("FETCH_CACHE_SIZE", "0"))
+FETCH_CACHE_TTL = float(os.getenv("FETCH_CACHE_TTL", "30"))
+FETCH_CACHE_BACKEND = os.getenv("FETCH_CACHE_BACKEND", "shm")
+FETCH_CACHE_SHM_PATH = os.getenv("FETCH_CACHE_SHM_PATH", "/tmp/telegram_bot_fetch_cache.gen")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+record_cache: RecordCache = None
 
-database = Database(DATABASE_URL)
-last_status = {"status": "Система запущена"} # Глобальный статус для команды /status
+# --- Секции и Архив user_data ---
+# user_data секционирована по месяцам; секции создаются на PARTITION_MONTHS_AHEAD месяцев вперед.
+# RETENTION_MONTHS=0 отключает архивирование: иначе месяцы старше этого срока
+# выгружаются в ARCHIVE_DIR файлами JSONL + gzip и удаляются из базы.
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "2"))
+RETENTION_MONTHS = int(os.getenv("RETENTION_MONTHS", "0"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./archive")
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+# Telegram user id администраторов через запятую: им доступна команда /restore
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+
+retention_job: RetentionJob = None
+
+# --- Выгрузка /export ---
+# Записей в одной порции чтения и сколько выгрузок воркер делает одновременно
+# (на чат — не больше одной на все воркеры). EXPORT_DIR — каталог временных файлов
+# и блокировок чатов, общий для воркеров хоста.
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+EXPORT_MAX_JOBS = int(os.getenv("EXPORT_MAX_JOBS", "2"))
+EXPORT_DIR = os.getenv("EXPORT_DIR") or None
+
+exporter: ChatExporter = None
+
+# --- Диагностика Воркера ---
+# ADMIN_TOKEN включает /debug/profile и /debug/slow-updates (заголовок Authorization: Bearer <токен>).
+# Обновления, обработанные дольше SLOW_UPDATE_MS, попадают в буфер на SLOW_UPDATE_BUFFER
+# записей (0 отключает буфер). Оба эндпоинта отвечают за тот воркер, который принял запрос.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+SLOW_UPDATE_MS = float(os.getenv("SLOW_UPDATE_MS", "1000"))
+SLOW_UPDATE_BUFFER = int(os.getenv("SLOW_UPDATE_BUFFER", "100"))
+
+profiler = SamplingProfiler()
+slow_updates = SlowUpdateLog(threshold=SLOW_UPDATE_MS / 1000, size=SLOW_UPDATE_BUFFER)
 
 async def initialize_database():
-    """Подключение к БД и создание таблицы."""
-    logging.info("Инициализация базы данных: Подключение...")
+    """
+    Подключение к БД: пул открывает DB_POOL_MIN_SIZE соединений сразу.
 
-    try:
-        await database.connect()
-    except Exception as e:
-        logging.critical(f"❌ Ошибка подключения к БД: {e}")
-        raise ConnectionError(f"Не удалось подключиться к базе данных: {e}")
-
-    CREATE_TABLE_QUERY = """
-    CREATE TABLE IF NOT EXISTS user_data (
-        id SERIAL PRIMARY KEY,
-        chat_id BIGINT NOT NULL,
-        username VARCHAR(255),
-        data_text TEXT NOT NULL,
-        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-    );
+    Миграции (migrations.py) применяются здесь, только если их не применил мастер gunicorn.
     """
-    await database.execute(CREATE_TABLE_QUERY)
-    logging.info("База данных готова. Таблица 'user_data' создана.")
+    logging.info("Инициализация базы данных: Подключение...")
+
+    if not storage.is_connected:
+        try:
+            await storage.connect()
+        except Exception as e:
+            logging.critical(f"❌ Ошибка подключения к БД: {e}")
+            raise ConnectionError(f"Не удалось подключиться к базе данных: {e}")
+
+    if not DB_MIGRATE_ON_STARTUP:
+        logging.info(f"База данных готова ({storage.dialect}). Схему подготовил мастер-процесс.")
+        return
+
+    applied = await storage.migrate()
+    # Секция текущего месяца должна существовать до первой записи
+    await storage.ensure_partitions(PARTITION_MONTHS_AHEAD)
+    logging.info(f"База данных готова ({storage.dialect}). Новых миграций: {len(applied)}.")
 
 
 # --- Обработчики Команд ---
 
+# bot_id -> компоненты бота; первый — основной бот (/webhook без id)
+bots: dict[str, BotRuntime] = {}
+
+
+def runtime_for(update: Update) -> BotRuntime:
+    """Компоненты бота, получившего обновление."""
+    return bots[bot_id_of(update.get_bot().token)]
+
+
+def primary_bot() -> BotRuntime:
+    return next(iter(bots.values()))
+
+
+async def send_reply(update: Update, text: str, **kwargs) -> None:
+    """Отправляет ответ в чат обновления через планировщик исходящих сообщений его бота."""
+    await runtime_for(update).outbound.send_message(update.effective_chat.id, text, **kwargs)
+
+
+DB_UNAVAILABLE_REPLY = "⚠️ База данных временно недоступна, попробуйте позже."
+
+async def reply_db_unavailable(update: Update, command: str, error: DatabaseUnavailable) -> None:
+    """Короткий ответ «попробуйте позже», когда БД не ответила или автомат разомкнут."""
+    logging.warning(f"⚠️ /{command} без БД (Chat ID: {update.effective_chat.id}): {error}")
+    COMMAND_ERRORS_TOTAL.labels(command).inc()
+    try:
+        await send_reply(update, DB_UNAVAILABLE_REPLY)
+    except Exception as send_error:
+        logging.error(f"❌ Не удалось отправить сообщение об ошибке (Chat ID: {update.effective_chat.id}): {send_error}")
+
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отправляет приветственное сообщение при команде /start."""
     if update.effective_chat:
         welcome_message = "Добро пожаловать! Я Telegram бот, готовый сохранять данные в PostgreSQL."
-        await update.effective_chat.send_message(welcome_message)
+        await send_reply(update, welcome_message)
 
 async def save_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обрабатывает /save <данные>: сохраняет данные в БД."""
-    global last_status
-
     if not update.effective_chat or not update.effective_user:
         return
 
     if not context.args:
-        await update.effective_chat.send_message("❌ Ошибка: Введите данные. Пример: /save Мои данные")
+        await send_reply(update, "❌ Ошибка: Введите данные. Пример: /save Мои данные")
         return
 
     data_to_save = " ".join(context.args)
     chat_id = update.effective_chat.id
     username = update.effective_user.username if update.effective_user.username else "N/A"
 
-    INSERT_QUERY = """
-    INSERT INTO user_data (chat_id, username, data_text) VALUES (:chat_id, :username, :data_text)
-    """
-
     values = {"chat_id": chat_id, "username": username, "data_text": data_to_save}
 
     try:
-        await database.execute(query=INSERT_QUERY, values=values)
+        if save_buffer:
+            # Ответ уходит только после коммита пачки с этой строкой
+            await save_buffer.add(values)
+        else:
+            await storage.save_record(values)
 
-        last_status = {"status": "Успешно отправлено и сохранено", "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        if record_cache:
+            await record_cache.invalidate(chat_id)
+
+        # Общее для всех воркеров время последнего сохранения (см. metrics.py)
+        LAST_SAVE_TIMESTAMP.set_to_current_time()
 
         # Здесь произошел ваш TimedOut
-        await update.effective_chat.send_message("✅ Успешно отправлено и сохранено!")
+        await send_reply(update, "✅ Успешно отправлено и сохранено!")
         logging.info(f"💾 Данные сохранены (Chat ID: {chat_id}): {data_to_save}")
 
+    except DatabaseUnavailable as e:
+        # Запись, которая точно не дошла до БД, повторим сами, когда БД вернется
+        if e.maybe_applied or not save_retry or not save_retry.add(values):
+            await reply_db_unavailable(update, "save", e)
+            return
+        logging.warning(f"⚠️ БД недоступна, /save поставлен в очередь повтора (Chat ID: {chat_id}): {e}")
+        await send_reply(update, "⏳ База данных временно недоступна: запись сохранится, как только она вернется.")
+
     except Exception as e:
         logging.error(f"❌ Ошибка сохранения в БД или отправки ответа: {e}", exc_info=True)
+        COMMAND_ERRORS_TOTAL.labels("save").inc()
         # Если ответ не отправляется, пытаемся отправить упрощенный
         try:
-            await update.effective_chat.send_message(f"❌ Ошибка: При сохранении данных произошла ошибка.")
-        except:
-            pass # Если и это не сработало, просто логируем.
+            await send_reply(update, f"❌ Ошибка: При сохранении данных произошла ошибка.")
+        except Exception as send_error:
+            # Планировщик уже исчерпал повторы: остается только залогировать
+            logging.error(f"❌ Не удалось отправить сообщение об ошибке (Chat ID: {chat_id}): {send_error}")
 
 
 async def fetch_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обрабатывает /fetch: возвращает последние 5 записей из БД."""
+    """Обрабатывает /fetch [n] [курсор]: возвращает записи этого чата постранично."""
     if not update.effective_chat:
         return
 
-    SELECT_QUERY = """
-    SELECT id, data_text, created_at FROM user_data
-    ORDER BY created_at DESC
-    LIMIT 5;
-    """
+    try:
+        limit, cursor = parse_fetch_args(context.args or [])
+    except ValueError:
+        await send_reply(update, f"❌ Ошибка: Используйте /fetch [n] [курсор], где n от 1 до {FETCH_MAX_LIMIT}.")
+        return
 
     try:
-        records = await database.fetch_all(query=SELECT_QUERY)
+        chat_id = update.effective_chat.id
+        if record_cache:
+            records, next_cursor = await record_cache.get_or_load(
+                chat_id, (limit, cursor), lambda: storage.fetch_page(chat_id, limit, cursor)
+            )
+        else:
+            records, next_cursor = await storage.fetch_page(chat_id, limit, cursor)
 
         if not records:
-            await update.effective_chat.send_message("❌ В базе данных нет записей.")
+            await send_reply(update, "❌ В базе данных нет записей.")
             return
 
-        response_lines = ["🔍 Последние 5 записей:"]
+        response_lines = [f"🔍 Последние {len(records)} записей:"]
 
         for record in records:
             time_str = record['created_at'].strftime("%Y-%m-%d %H:%M:%S")
             line = f"ID: {record['id']}, Текст: {record['data_text']}, Время: {time_str}"
             response_lines.append(line)
 
+        if next_cursor:
+            response_lines.append(f"➡️ Еще: /fetch {limit} {next_cursor}")
+
         # Здесь произошел ваш TimedOut
-        await update.effective_chat.send_message("\n".join(response_lines))
+        await send_reply(update, "\n".join(response_lines))
+
+    except DatabaseUnavailable as e:
+        await reply_db_unavailable(update, "fetch", e)
 
     except Exception as e:
         logging.error(f"❌ Ошибка извлечения из БД или отправки ответа: {e}", exc_info=True)
+        COMMAND_ERRORS_TOTAL.labels("fetch").inc()
         try:
-            await update.effective_chat.send_message(f"❌ Ошибка: При получении данных произошла ошибка.")
-        except:
-            pass
+            await send_reply(update, f"❌ Ошибка: При получении данных произошла ошибка.")
+        except Exception as send_error:
+            logging.error(f"❌ Не удалось отправить сообщение об ошибке (Chat ID: {update.effective_chat.id}): {send_error}")
+
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обрабатывает /search [+смещение] <запрос>: полнотекстовый поиск по записям этого чата."""
+    if not update.effective_chat:
+        return
+
+    try:
+        offset, query = parse_search_args(context.args or [])
+    except ValueError:
+        await send_reply(update, "❌ Ошибка: Введите запрос. Пример: /search список покупок")
+        return
+
+    try:
+        chat_id = update.effective_chat.id
+        records, next_offset = await storage.search(chat_id, query, SEARCH_PAGE_SIZE, offset)
+
+        if not records:
+            await send_reply(update, f"❌ По запросу «{query}» ничего не найдено.")
+            return
+
+        response_lines = [f"🔍 Найдено по запросу «{query}»:"]
+
+        for record in records:
+            time_str = record['created_at'].strftime("%Y-%m-%d %H:%M:%S")
+            line = f"ID: {record['id']}, Текст: {record['data_text']}, Время: {time_str}"
+            response_lines.append(line)
+
+        if next_offset and next_offset <= SEARCH_MAX_OFFSET:
+            response_lines.append(f"➡️ Еще: /search +{next_offset} {query}")
+
+        await send_reply(update, "\n".join(response_lines))
+
+    except DatabaseUnavailable as e:
+        await reply_db_unavailable(update, "search", e)
+
+    except Exception as e:
+        logging.error(f"❌ Ошибка поиска в БД или отправки ответа: {e}", exc_info=True)
+        COMMAND_ERRORS_TOTAL.labels("search").inc()
+        try:
+            await send_reply(update, f"❌ Ошибка: При поиске произошла ошибка.")
+        except Exception as send_error:
+            logging.error(f"❌ Не удалось отправить сообщение об ошибке (Chat ID: {update.effective_chat.id}): {send_error}")
+
+
+# Фоновые восстановления /restore: держим ссылки, чтобы задачи не собрал GC
+restore_tasks: set[asyncio.Task] = set()
+
+async def restore_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обрабатывает /restore <chat_id>: возвращает архивные записи чата (только администраторы)."""
+    if not update.effective_chat or not update.effective_user:
+        return
+
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        await send_reply(update, "❌ Команда доступна только администраторам.")
+        return
+
+    try:
+        chat_id = int(context.args[0]) if context.args else update.effective_chat.id
+    except ValueError:
+        await send_reply(update, "❌ Ошибка: Используйте /restore [chat_id].")
+        return
+
+    async def restore() -> None:
+        try:
+            restored = await retention_job.restore(chat_id)
+            if record_cache:
+                await record_cache.invalidate(chat_id)
+            await send_reply(update, f"♻️ Восстановлено записей чата {chat_id}: {restored}")
+            logging.info(f"♻️ Из архива восстановлено {restored} записей (Chat ID: {chat_id})")
+        except DatabaseUnavailable as e:
+            await reply_db_unavailable(update, "restore", e)
+        except Exception as e:
+            logging.error(f"❌ Ошибка восстановления из архива (Chat ID: {chat_id}): {e}", exc_info=True)
+            COMMAND_ERRORS_TOTAL.labels("restore").inc()
+            await send_reply(update, "❌ Ошибка: При восстановлении из архива произошла ошибка.")
+
+    # Чтение архивов может занять время: вебхук не ждет его завершения
+    await send_reply(update, f"⏳ Восстанавливаю архивные записи чата {chat_id}...")
+    task = asyncio.create_task(restore())
+    restore_tasks.add(task)
+    task.add_done_callback(restore_tasks.discard)
+
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обрабатывает /export [csv|jsonl]: присылает все записи чата сжатым файлом."""
+    if not update.effective_chat:
+        return
+
+    try:
+        fmt = parse_export_args(context.args or [])
+    except ValueError:
+        await send_reply(update, "❌ Ошибка: Используйте /export [csv|jsonl].")
+        return
+
+    chat_id = update.effective_chat.id
+
+    async def deliver(path, rows: int) -> None:
+        if rows == 0:
+            await send_reply(update, "❌ В этом чате пока нет записей.")
+            return
+        if path.stat().st_size > MAX_DOCUMENT_BYTES:
+            await send_reply(update, "❌ Выгрузка больше 50 МБ: Telegram не примет такой файл.")
+            return
+        await runtime_for(update).outbound.call(
+            "send_document", chat_id,
+            document=path, filename=export_filename(chat_id, fmt), caption=f"📦 Записей: {rows}",
+        )
+
+    async def on_error(error: Exception) -> None:
+        if isinstance(error, DatabaseUnavailable):
+            await reply_db_unavailable(update, "export", error)
+            return
+        COMMAND_ERRORS_TOTAL.labels("export").inc()
+        try:
+            await send_reply(update, "❌ Ошибка: При выгрузке записей произошла ошибка.")
+        except Exception as send_error:
+            logging.error(f"❌ Не удалось отправить сообщение об ошибке (Chat ID: {chat_id}): {send_error}")
+
+    # Выгрузка идет фоновой задачей: вебхук и другие обновления ее не ждут
+    if not exporter.start(chat_id, fmt, deliver, on_error):
+        await send_reply(update, "⏳ Выгрузка этого чата уже готовится, дождитесь файла.")
+        return
+    await send_reply(update, "⏳ Готовлю выгрузку, файл придет отдельным сообщением...")
 
 
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обрабатывает /status: возвращает JSON-статус."""
-    global last_status
+    """Обрабатывает /status: возвращает JSON-статус, собранный по всем воркерам."""
     if not update.effective_chat:
         return
 
-    db_status = "Connected" if database.is_connected else "Disconnected"
+    db_status = "Connected" if storage.is_connected else "Disconnected"
 
-    current_status = last_status.copy()
+    current_status = metrics.summary()
+    last_save = current_status.pop("last_save")
+    if last_save:
+        current_status = {
+            "status": "Успешно отправлено и сохранено",
+            "timestamp": datetime.datetime.fromtimestamp(last_save).strftime("%Y-%m-%d %H:%M:%S"),
+            **current_status,
+        }
+    else:
+        current_status = {"status": "Система запущена", **current_status}
     current_status['db_connection'] = db_status
+    runtime = runtime_for(update)
+    if runtime.update_queue:
+        current_status['update_queue'] = runtime.update_queue.stats()
+    current_status['outbound'] = runtime.outbound.stats()
+    if runtime.poller:
+        current_status['polling'] = runtime.poller.stats()
 
     response_json = json.dumps(current_status, ensure_ascii=False, indent=2)
 
     message = f"**Статус данных:**\n```json\n{response_json}\n```"
-    await update.effective_chat.send_message(message, parse_mode='Markdown')
+    await send_reply(update, message, parse_mode='Markdown')
 
 
 async def echo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отвечает пользователю тем же текстом."""
     if update.effective_chat and update.effective_message.text and not update.effective_message.text.startswith('/'):
-        await update.effective_chat.send_message(f"Вы сказали: {update.effective_message.text}")
+        await send_reply(update, f"Вы сказали: {update.effective_message.text}")
 
 # --- Инициализация Telegram Application ---
 
-application: Application = None
+pool_stats_task: asyncio.Task = None
+# Пробы БД, пока автомат разомкнут: иначе не готовый воркер не вернулся бы в строй
+breaker_probe_task: asyncio.Task = None
 
-def setup_bot() -> Application:
+def setup_bot(token: str) -> Application:
     """
-    Создает и настраивает объект Application, используя увеличенный таймаут.
+    Создает и настраивает объект Application бота, используя увеличенный таймаут.
     """
-    token = os.getenv("TELEGRAM_BOT_TOKEN")
-    if not token:
-        logging.critical("TELEGRAM_BOT_TOKEN не найден. Приложение не может быть инициализировано.")
-        raise ValueError("TELEGRAM_BOT_TOKEN не найден в переменных окружения.")
-
-    app = (
-        Application.builder()
-        .token(token)
-        .updater(None)
-        .http_version("1.1")
-        .request(CUSTOM_REQUEST) # FIX: Инъекция пользовательского объекта Request с таймаутом 20с
-        .build()
+    bot = CachedIdentityBot(
+        token,
+        base_url=TELEGRAM_API_BASE_URL,
+        request=CUSTOM_REQUEST, # FIX: Инъекция пользовательского объекта Request с таймаутом 20с (HTTP/1.1 задан в нем)
+        identity_cache=per_bot_path(BOT_IDENTITY_CACHE, token),
+        identity_ttl=BOT_IDENTITY_TTL,
     )
+    app = Application.builder().bot(bot).updater(None).build()
 
     # Добавление обработчиков команд
-    app.add_handler(CommandHandler("start", start_command))
-    app.add_handler(CommandHandler("save", save_command))
-    app.add_handler(CommandHandler("fetch", fetch_command))
-    app.add_handler(CommandHandler("status", status_command))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, echo))
+    # Все обработчики принимают только новые сообщения (HANDLED_UPDATE_TYPES)
+    app.add_handler(CommandHandler("start", start_command, filters=filters.UpdateType.MESSAGE))
+    app.add_handler(CommandHandler("save", save_command, filters=filters.UpdateType.MESSAGE))
+    app.add_handler(CommandHandler("fetch", fetch_command, filters=filters.UpdateType.MESSAGE))
+    app.add_handler(CommandHandler("search", search_command, filters=filters.UpdateType.MESSAGE))
+    app.add_handler(CommandHandler("export", export_command, filters=filters.UpdateType.MESSAGE))
+    app.add_handler(CommandHandler("restore", restore_command, filters=filters.UpdateType.MESSAGE))
+    app.add_handler(CommandHandler("status", status_command, filters=filters.UpdateType.MESSAGE))
+    app.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.TEXT & ~filters.COMMAND, echo))
 
     return app
 
@@ -209,49 +601,533 @@ def setup_bot() -> Application:
 
 start_app = FastAPI(title="Telegram Bot Webhook Receiver")
 
-@start_app.on_event("startup")
-async def startup_event():
-    global application
-    # Инициализация БД и подключение
-    try:
-        await initialize_database()
-    except ConnectionError:
-        logging.critical("Невозможно продолжить без подключения к БД.")
+# Готовность воркера (/ready): выставляется, когда start_worker закончил прогрев
+worker_ready = asyncio.Event()
+startup_task: asyncio.Task = None
+# Длительность этапов старта этого воркера, мс
+startup_timings: dict = {}
+
+async def initialize_bot():
+    """Создает Application ботов и инициализирует их (HTTP-клиент, профиль из кэша или getMe)."""
+    if not BOT_TOKENS:
+        logging.critical("TELEGRAM_BOT_TOKEN не найден. Приложение не может быть инициализировано.")
+        raise ValueError("TELEGRAM_BOT_TOKEN не найден в переменных окружения.")
+    for token in BOT_TOKENS:
+        if bot_id_of(token) not in bots:
+            bots[bot_id_of(token)] = BotRuntime(setup_bot(token), webhook_secret(token, WEBHOOK_SECRET))
+    await asyncio.gather(*(runtime.application.initialize() for runtime in bots.values()))
+
+
+async def timed_phase(name: str, phase) -> None:
+    started = time.perf_counter()
+    await phase
+    startup_timings[f"{name}_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+
+async def warm_up():
+    """Прогревает пул БД и клиент Bot API одновременно: это независимые сетевые операции."""
+    results = await asyncio.gather(
+        timed_phase("database", initialize_database()),
+        timed_phase("bot", initialize_bot()),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+
+async def start_worker():
+    """Прогрев и сборка компонентов воркера; недоступную БД или Bot API повторяет, пока не получится."""
+    global save_buffer, record_cache, pool_stats_task, breaker_probe_task, retention_job, exporter, save_retry
+    started = time.perf_counter()
+    while True:
+        try:
+            await warm_up()
+            break
+        except (ConnectionError, NetworkError) as e:
+            # Ошибки конфигурации (нет токена, токен отклонен) не повторяются: воркер не стартует
+            logging.critical(f"❌ Воркер не готов: {e}. Повтор через {STARTUP_RETRY_INTERVAL}с.")
+            await asyncio.sleep(STARTUP_RETRY_INTERVAL)
+
+    pool_stats_task = asyncio.create_task(metrics.publish_pool_stats(storage))
+    breaker_probe_task = asyncio.create_task(probe_while_open(storage, db_breaker))
+
+    retention_job = RetentionJob(
+        storage,
+        ARCHIVE_DIR,
+        retention_months=RETENTION_MONTHS,
+        months_ahead=PARTITION_MONTHS_AHEAD,
+        interval=RETENTION_INTERVAL,
+    )
+    retention_job.start()
+
+    exporter = ChatExporter(storage, chunk_rows=EXPORT_CHUNK_ROWS, max_jobs=EXPORT_MAX_JOBS, directory=EXPORT_DIR)
+
+    if SAVE_BATCH_ROWS > 0:
+        save_buffer = SaveBuffer(storage, max_rows=SAVE_BATCH_ROWS, max_delay=SAVE_BATCH_MS / 1000)
+
+    if FETCH_CACHE_SIZE > 0:
+        generations = make_generations(FETCH_CACHE_BACKEND, shm_path=FETCH_CACHE_SHM_PATH, redis_url=REDIS_URL)
+        record_cache = RecordCache(max_entries=FETCH_CACHE_SIZE, ttl=FETCH_CACHE_TTL, generations=generations)
+
+    async def invalidate_saved(rows: list[dict]) -> None:
+        if record_cache:
+            for chat_id in {row["chat_id"] for row in rows}:
+                await record_cache.invalidate(chat_id)
+
+    save_retry = SaveRetryQueue(storage, db_breaker, max_rows=SAVE_RETRY_MAX_ROWS, on_saved=invalidate_saved)
+    save_retry.start()
+
+    for runtime in bots.values():
+        await start_bot(runtime)
+
+    total = time.perf_counter() - started
+    startup_timings["total_ms"] = round(total * 1000, 1)
+    startup_timings["identity_from_cache"] = all(
+        runtime.application.bot.identity_from_cache for runtime in bots.values()
+    )
+    STARTUP_SECONDS.set(total)
+    worker_ready.set()
+
+    if total > STARTUP_BUDGET:
+        logging.warning(f"⚠️ Старт воркера занял {total:.2f}с при бюджете {STARTUP_BUDGET}с: {startup_timings}")
+    for runtime in bots.values():
+        if runtime.application.bot.identity_from_cache:
+            # Профиль взят из кэша: обновляем его и открываем соединение с Bot API уже после старта
+            runtime.identity_refresh_task = asyncio.create_task(runtime.application.bot.refresh_identity())
+
+    paths = ", ".join(f"/webhook/{bot_id}" for bot_id in bots)
+    logging.info(f"🔥 Приложение запущено за {total:.2f}с. Ботов: {len(bots)}, вебхуки: /webhook, {paths}.")
+
+
+async def start_bot(runtime: BotRuntime) -> None:
+    """Исходящие лимиты, PreRouter, очередь, журнал и дедупликация одного бота."""
+    application = runtime.application
+    runtime.outbound = OutboundSender(
+        application.bot,
+        global_rate=OUTBOUND_GLOBAL_RATE,
+        chat_rate=OUTBOUND_CHAT_RATE,
+        chat_burst=OUTBOUND_CHAT_BURST,
+        concurrency=OUTBOUND_CONCURRENCY,
+        max_retries=OUTBOUND_MAX_RETRIES,
+    )
+
+    flood = None
+    if FLOOD_RATE > 0:
+        shared = None
+        if FLOOD_SHM_PATH:
+            shared = SharedFloodBuckets(f"{FLOOD_SHM_PATH}.{runtime.bot_id}", slots=FLOOD_SHM_SLOTS)
+        flood = FloodControl(
+            rate=FLOOD_RATE, burst=FLOOD_BURST, costs=FLOOD_COSTS, idle_ttl=FLOOD_IDLE_TTL, shared=shared
+        )
+    runtime.pre_router = PreRouter(application, HANDLED_UPDATE_TYPES, application.bot.username, flood=flood)
+
+    process = runtime.pre_router.process
+    unfinished = {}
+    if UPDATE_MODE == "queue" and JOURNAL_DIR:
+        runtime.update_journal = UpdateJournal(
+            os.path.join(JOURNAL_DIR, runtime.bot_id), segment_bytes=JOURNAL_SEGMENT_BYTES, fsync=JOURNAL_FSYNC
+        )
+        unfinished = await asyncio.to_thread(runtime.update_journal.open)
+        process = runtime.update_journal.wrap(process)
+    # Снаружи журнала: время обработки включает и запись о ее завершении
+    process = slow_updates.wrap(process)
+    if UPDATE_MODE == "queue":
+        runtime.update_queue = UpdateQueue(process, maxsize=UPDATE_QUEUE_SIZE, workers=UPDATE_WORKERS)
+        runtime.update_queue.start()
+
+    # update_id у каждого бота свои: дедупликация тоже
+    window = None
+    if UPDATE_DEDUP_SHM_PATH:
+        window = SharedUpdateIdWindow(f"{UPDATE_DEDUP_SHM_PATH}.{runtime.bot_id}", size=UPDATE_DEDUP_WINDOW)
+    runtime.dispatcher = UpdateDispatcher(
+        process,
+        queue=runtime.update_queue,
+        dedup_window=UPDATE_DEDUP_WINDOW,
+        enqueue_timeout=UPDATE_ENQUEUE_TIMEOUT,
+        window=window,
+    )
+    if unfinished:
+        # В очередь раньше новых вебхуков: воркер еще не принимает запросы
+        runtime.replay_task = asyncio.create_task(replay_journal(runtime, unfinished))
+
+
+async def replay_journal(runtime: BotRuntime, unfinished: dict[int, bytes]) -> None:
+    """Повторно обрабатывает обновления из журнала, принятые до падения воркера, но не обработанные."""
+    for update_id, raw_body in unfinished.items():
+        try:
+            update = Update.de_json(loads(raw_body), runtime.application.bot)
+            while await runtime.dispatcher.dispatch(update, replayed=True) == REJECTED:
+                await asyncio.sleep(max(UPDATE_ENQUEUE_TIMEOUT, 0.05))
+        except Exception as e:
+            logging.error(f"❌ Не удалось повторить update_id={update_id} из журнала: {e}", exc_info=True)
+            runtime.update_journal.complete(update_id)
+        runtime.update_journal.mark_replayed()
+    logging.info(f"Из журнала повторно приняты {len(unfinished)} обновлений.")
+
+
+async def handle_polled_update(runtime: BotRuntime, body: dict) -> None:
+    """
+    Одно обновление из getUpdates: тот же путь, что у /webhook (PreRouter, журнал,
+    UpdateDispatcher). Возвращается, когда обновление обработано или принято в журнал.
+    """
+    slow_updates.begin(runtime.bot_id, body)
+    if runtime.dispatcher.is_duplicate(body.get("update_id")):
+        UPDATES_TOTAL.labels(DUPLICATE).inc()
+        return
+    route = runtime.pre_router.classify(body)
+    if route == DROP:
+        UPDATES_TOTAL.labels("ignored").inc()
         return
+    if route in (LIMITED, FLOOD_WARNING):
+        UPDATES_TOTAL.labels("limited").inc()
+        if route == FLOOD_WARNING:
+            # Ответа вебхука нет: предупреждение уходит обычным исходящим запросом
+            warning = runtime.pre_router.flood_warning(body)
+            await runtime.outbound.call("send_message", warning["chat_id"], text=warning["text"])
+        return
+    with observe_stage("deserialize"):
+        update = Update.de_json(body, runtime.application.bot)
+    slow_updates.handoff(update)
+
+    journaled = False
+    if runtime.update_journal:
+        try:
+            with observe_stage("journal_append"):
+                journaled = await runtime.update_journal.append(update.update_id, json.dumps(body).encode())
+        except OSError as e:
+            # Повторить доставку здесь некому: обрабатываем без журнала
+            logging.error(f"❌ Журнал обновлений недоступен: {e}")
+
+    # Переполненная очередь не повод терять обновление: offset не продвинется, пока оно не принято
+    result = await runtime.dispatcher.dispatch(update)
+    while result == REJECTED:
+        await asyncio.sleep(max(UPDATE_ENQUEUE_TIMEOUT, 0.05))
+        result = await runtime.dispatcher.dispatch(update)
+    UPDATES_TOTAL.labels(result).inc()
+    if result == DUPLICATE:
+        slow_updates.discard(update)
+        if journaled:
+            runtime.update_journal.complete(update.update_id)
+
+
+async def run_polling() -> None:
+    """
+    Режим polling (main.py): один процесс забирает обновления всех ботов getUpdates
+    и обрабатывает каждую пачку одновременно. До SIGINT/SIGTERM.
+    """
+    await startup_event()
+    # Прогрев повторяется, пока БД и Bot API не станут доступны
+    await startup_task
 
-    # Инициализация Telegram Application
-    application = setup_bot()
-    await application.initialize()
+    for runtime in bots.values():
+        # Пока установлен вебхук, getUpdates отвечает 409
+        await runtime.application.bot.delete_webhook()
+        runtime.poller = UpdatePoller(
+            f"{TELEGRAM_API_BASE_URL}{runtime.application.bot.token}/getUpdates",
+            partial(handle_polled_update, runtime),
+            offset_path=per_bot_path(POLLING_OFFSET_FILE, runtime.application.bot.token),
+            limit=POLLING_LIMIT,
+            timeout=POLLING_TIMEOUT,
+            allowed_updates=HANDLED_UPDATE_TYPES,
+        )
 
-    logging.info("🔥 Приложение запущено. Бот готов принимать обновления на /webhook.")
+    def stop_polling() -> None:
+        for runtime in bots.values():
+            runtime.poller.stop()
+
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop_polling)
+    try:
+        results = await asyncio.gather(*(runtime.poller.run() for runtime in bots.values()), return_exceptions=True)
+        for runtime, result in zip(bots.values(), results):
+            # Отклоненный токен останавливает только своего бота
+            if isinstance(result, Exception):
+                logging.critical(f"❌ Polling бота {runtime.bot_id} остановлен: {result}")
+    finally:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signum)
+        for runtime in bots.values():
+            await runtime.poller.close()
+        await shutdown_event()
+
+
+@start_app.on_event("startup")
+async def startup_event():
+    global startup_task
+    metrics.instrument_storage(storage)
+    # Дедлайн и автомат — снаружи: отклоненные автоматом вызовы не попадают в db_query
+    guard_storage(storage, db_breaker, DB_QUERY_TIMEOUT or None)
+
+    # Пока startup_event не вернулся, uvicorn не принимает запросы этим воркером:
+    # при рестарте обновления уходят уже готовым воркерам, а не теряются
+    startup_task = asyncio.create_task(start_worker())
+    try:
+        await asyncio.wait_for(asyncio.shield(startup_task), STARTUP_WAIT)
+    except asyncio.TimeoutError:
+        logging.critical(f"Воркер не готов за {STARTUP_WAIT}с: /ready и /webhook отвечают 503, прогрев продолжается.")
 
 
 @start_app.on_event("shutdown")
 async def shutdown_event():
+    if startup_task and not startup_task.done():
+        startup_task.cancel()
+    for runtime in bots.values():
+        for task in (runtime.replay_task, runtime.identity_refresh_task):
+            if task and not task.done():
+                task.cancel()
+
+    queued = [runtime for runtime in bots.values() if runtime.update_queue]
+    if queued:
+        logging.info("Завершение работы приложения: Обработка оставшихся обновлений...")
+        left_counts = await asyncio.gather(*(runtime.update_queue.drain(UPDATE_DRAIN_TIMEOUT) for runtime in queued))
+        for runtime, left in zip(queued, left_counts):
+            if left and runtime.update_journal:
+                logging.warning(
+                    f"Бот {runtime.bot_id}: не обработано {left} принятых обновлений, "
+                    f"они останутся в журнале до следующего старта."
+                )
+            elif left:
+                logging.error(f"❌ Бот {runtime.bot_id}: не обработано {left} принятых обновлений.")
+
+    for runtime in bots.values():
+        if runtime.update_journal:
+            await runtime.update_journal.close()
+
+    if save_buffer:
+        await save_buffer.close()
+
+    if save_retry:
+        await save_retry.close()
+
+    if pool_stats_task:
+        pool_stats_task.cancel()
+
+    if breaker_probe_task:
+        breaker_probe_task.cancel()
+
+    # Восстановления /restore (в том числе запущенные обновлениями из очереди выше) прерываются
+    # до остановки архива и пула: иначе они упадут посреди транзакции на закрытом пуле.
+    # restore_records пропускает уже вставленные строки, так что /restore можно повторить.
+    for task in restore_tasks:
+        task.cancel()
+    await asyncio.gather(*restore_tasks, return_exceptions=True)
+
+    if retention_job:
+        await retention_job.stop()
+
+    if exporter:
+        await exporter.stop()
+
+    for runtime in bots.values():
+        # Закрывает HTTP-клиент Bot API (он общий, повторное закрытие ничего не делает)
+        await runtime.application.shutdown()
+
     logging.info("Завершение работы приложения: Отключение от БД...")
-    if database.is_connected:
-        await database.disconnect()
+    await storage.disconnect()
 
 
 @start_app.get("/")
 async def health_check():
-    return {"status": "ok", "message": "Бот активен и ждет обновлений на /webhook"}
+    """
+    Состояние воркера. Пока автомат защиты БД не замкнут, отвечает 503 (degraded),
+    чтобы балансировщик или оркестратор уводил трафик с этого воркера.
+    """
+    response = {"status": "ok", "message": "Бот активен и ждет обновлений на /webhook/{bot_id}"}
+    response["startup"] = startup_timings
+    response["storage"] = storage.stats()
+    response["db_breaker"] = db_breaker.stats()
+    pool = storage.pool_stats()
+    if pool:
+        # Доля занятых соединений от максимума пула: около 1 — запросы ждут соединения
+        response["db_pool"] = {**pool, "saturation": round(pool["busy"] / pool["max"], 2)}
+    if save_retry:
+        response["save_retry"] = save_retry.stats()
+    if save_buffer:
+        response["save_buffer"] = save_buffer.stats()
+    if record_cache:
+        response["fetch_cache"] = record_cache.stats()
+    if retention_job:
+        response["retention"] = retention_job.stats()
+    if exporter:
+        response["export"] = exporter.stats()
+    response["bots"] = {bot_id: runtime.stats() for bot_id, runtime in bots.items()}
+    response["slow_updates"] = slow_updates.stats()
+    if not worker_is_ready():
+        response["status"] = "degraded"
+        return JSONResponse(status_code=503, content=response)
+    return response
+
+
+def worker_is_ready() -> bool:
+    return worker_ready.is_set() and db_breaker.state == CLOSED and storage.is_connected
+
+
+@start_app.get("/live")
+async def liveness():
+    """Liveness: процесс и event loop отвечают. Не зависит от БД и Bot API — перезапуск их не починит."""
+    return {"status": "alive"}
+
+
+@start_app.get("/ready")
+async def readiness():
+    """Readiness: воркер прогрет, БД подключена и автомат замкнут — можно слать обновления."""
+    if not worker_is_ready():
+        return JSONResponse(
+            status_code=503,
+            content={"status": "not_ready", "startup": startup_timings, "db_breaker": db_breaker.state},
+        )
+    return {"status": "ready", "startup": startup_timings}
+
+
+@start_app.get("/metrics")
+async def metrics_endpoint():
+    """Метрики Prometheus, суммированные по всем воркерам gunicorn."""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
+def is_admin_request(request: FastAPIRequest) -> bool:
+    """Запрос несет ADMIN_TOKEN в заголовке Authorization: Bearer. Без ADMIN_TOKEN — никто."""
+    if not ADMIN_TOKEN:
+        return False
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+@start_app.get("/debug/profile")
+async def profile_endpoint(request: FastAPIRequest, seconds: float = 10.0, interval_ms: float = 10.0, threads: str = "loop"):
+    """
+    Сэмплирует стеки этого воркера `seconds` секунд и возвращает их в свернутом
+    формате flamegraph.pl / speedscope. threads=loop — только поток event loop,
+    all — еще и потоки SQLite, to_thread и т.п. Воркер продолжает обслуживать запросы.
+    """
+    if not is_admin_request(request):
+        return JSONResponse(status_code=403, content={"status": "forbidden"})
+    if not 0 < seconds <= PROFILE_MAX_SECONDS or interval_ms < 1 or threads not in ("loop", "all"):
+        return JSONResponse(status_code=400, content={"status": "bad_request", "max_seconds": PROFILE_MAX_SECONDS})
+
+    # Обработчик выполняется в потоке event loop: его и профилируем
+    loop_thread = threading.get_ident() if threads == "loop" else None
+    try:
+        stacks, samples = await asyncio.to_thread(profiler.run, seconds, interval_ms / 1000, loop_thread)
+    except ProfilerBusy:
+        return JSONResponse(status_code=409, content={"status": "profiler_busy"})
+    return Response(
+        content=collapse(stacks),
+        media_type="text/plain",
+        headers={"X-Worker-Pid": str(os.getpid()), "X-Profile-Samples": str(samples)},
+    )
+
+
+@start_app.get("/debug/slow-updates")
+async def slow_updates_endpoint(request: FastAPIRequest):
+    """Медленные обновления этого воркера (новые сначала): сырое обновление, этапы и обработчик."""
+    if not is_admin_request(request):
+        return JSONResponse(status_code=403, content={"status": "forbidden"})
+    return {"pid": os.getpid(), **slow_updates.stats(), "updates": slow_updates.records()}
 
 
 @start_app.post("/webhook")
 async def telegram_webhook(request: FastAPIRequest):
-    global application
-    if not application:
-        logging.error("Telegram Application не инициализирован.")
-        return JSONResponse(status_code=200, content={"status": "error", "message": "Service not ready"})
+    """Вебхук основного бота: адрес, под которым бот был зарегистрирован до /webhook/{bot_id}."""
+    if not worker_ready.is_set():
+        return not_ready_response()
+    return await receive_update(primary_bot(), request)
+
+
+@start_app.post("/webhook/{bot_id}")
+async def bot_webhook(bot_id: str, request: FastAPIRequest):
+    if not worker_ready.is_set():
+        return not_ready_response()
+    runtime = bots.get(bot_id)
+    if runtime is None:
+        return JSONResponse(status_code=404, content={"status": "unknown_bot"})
+    return await receive_update(runtime, request)
+
+
+def not_ready_response() -> JSONResponse:
+    # Не 2xx: Telegram доставит обновление повторно, когда воркер прогреется
+    logging.error("Воркер еще не готов, обновление отклонено.")
+    return JSONResponse(status_code=503, content={"status": "not_ready"}, headers={"Retry-After": "1"})
 
+
+async def receive_update(runtime: BotRuntime, request: FastAPIRequest) -> JSONResponse:
+    """Прием обновления бота `runtime` из вебхука."""
+    if not runtime.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token")):
+        logging.warning(f"Вебхук бота {runtime.bot_id} без верного secret_token отклонен.")
+        return JSONResponse(status_code=403, content={"status": "forbidden"})
+
+    pre_router, dispatcher, update_journal = runtime.pre_router, runtime.dispatcher, runtime.update_journal
     try:
-        body = await request.json()
-        update = Update.de_json(body, application.bot)
-        await application.process_update(update)
+        raw_body = await request.body()
+        slow_updates.begin(runtime.bot_id, raw_body)
+        with observe_stage("json_parse"):
+            body = loads(raw_body)
+        if dispatcher.is_duplicate(body.get("update_id")):
+            # До ограничения флуда: повтор Telegram не тратит лимит чата
+            UPDATES_TOTAL.labels(DUPLICATE).inc()
+            return JSONResponse(status_code=200, content={"status": "duplicate"})
+        route = pre_router.classify(body)
+        if route == DROP:
+            # Ни один обработчик это обновление не примет: Update.de_json не нужен
+            UPDATES_TOTAL.labels("ignored").inc()
+            return JSONResponse(status_code=200, content={"status": "ignored"})
+        if route in (LIMITED, FLOOD_WARNING):
+            # Флуд чата отбрасывается до разбора, БД и исходящих запросов. Единственное
+            # предупреждение уходит в теле ответа вебхука: Telegram отправит его сам
+            UPDATES_TOTAL.labels("limited").inc()
+            if route == FLOOD_WARNING:
+                return JSONResponse(status_code=200, content=pre_router.flood_warning(body))
+            return JSONResponse(status_code=200, content={"status": "limited"})
+        with observe_stage("deserialize"):
+            update = Update.de_json(body, runtime.application.bot)
+        slow_updates.handoff(update)
+
+        journaled = False
+        if update_journal:
+            try:
+                with observe_stage("journal_append"):
+                    journaled = await update_journal.append(update.update_id, raw_body)
+            except OSError as e:
+                # Без записи в журнал подтверждать нельзя: Telegram доставит обновление повторно
+                logging.error(f"❌ Журнал обновлений недоступен: {e}")
+                UPDATES_TOTAL.labels("error").inc()
+                slow_updates.discard(update)
+                return JSONResponse(status_code=503, content={"status": "journal_unavailable"}, headers={"Retry-After": "1"})
+
+        slot = None
+        if WEBHOOK_REPLY_INLINE and not runtime.update_queue:
+            slot = WebhookReply()
+            token = webhook_reply.set(slot)
+        try:
+            result = await dispatcher.dispatch(update)
+        finally:
+            if slot:
+                # Ответы, отправленные после завершения обработчика, идут обычным путем
+                slot.closed = True
+                webhook_reply.reset(token)
+
+        UPDATES_TOTAL.labels(result).inc()
+        if result in (DUPLICATE, REJECTED):
+            slow_updates.discard(update)
+        if journaled and result in (DUPLICATE, REJECTED):
+            # Эта запись журнала обработки не дождется: дубль уже обработан, отклоненное придет снова
+            update_journal.complete(update.update_id)
+        if result == REJECTED:
+            # Очередь переполнена: не 2xx, чтобы Telegram доставил обновление повторно позже
+            logging.warning(f"Очередь обновлений заполнена, update_id={update.update_id} отклонен.")
+            return JSONResponse(status_code=503, content={"status": "busy"}, headers={"Retry-After": "1"})
+        if result == DUPLICATE:
+            return JSONResponse(status_code=200, content={"status": "duplicate"})
+        if slot and slot.payload():
+            # Telegram выполнит этот sendMessage сам: исходящий запрос не нужен
+            return JSONResponse(status_code=200, content=slot.payload())
         # Всегда возвращаем 200 OK быстро
         return JSONResponse(status_code=200, content={"status": "ok"})
 
     except Exception as e:
         logging.error(f"❌ Ошибка при обработке вебхука: {e}", exc_info=True)
+        UPDATES_TOTAL.labels("error").inc()
         return JSONResponse(status_code=200, content={"status": "internal_error", "message": "Update processed with error."})
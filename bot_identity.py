@@ -0,0 +1,80 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from telegram import User
+from telegram.ext import ExtBot
+
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class CachedIdentityBot(ExtBot):
+    """
+    ExtBot, который берет профиль бота (результат getMe) из файла-кэша.
+
+    Application.initialize вызывает getMe на каждом старте воркера, то есть
+    4 сетевых запроса к Bot API на каждый рестарт gunicorn. Если в кэше есть
+    свежий профиль для этого же токена (не старше `identity_ttl` секунд),
+    первый get_me отвечает из кэша; refresh_identity обновляет его в фоне.
+    """
+
+    def __init__(self, *args: Any, identity_cache: str, identity_ttl: float = 86400.0, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        # Публичные атрибуты объектов PTB заморожены: состояние хранится в приватных
+        self._identity_cache = Path(identity_cache)
+        self._identity_ttl = identity_ttl
+        self._identity_from_cache = False
+
+    @property
+    def identity_from_cache(self) -> bool:
+        """Профиль бота сейчас взят из кэша, а не из сетевого getMe."""
+        return self._identity_from_cache
+
+    def _load_identity(self) -> Optional[dict]:
+        try:
+            cached = json.loads(self._identity_cache.read_text())
+        except (OSError, ValueError):
+            return None
+        if cached.get("token_hash") != _token_hash(self.token):
+            return None
+        if time.time() - cached.get("fetched_at", 0) > self._identity_ttl:
+            return None
+        return cached.get("user")
+
+    def _store_identity(self, user: User) -> None:
+        payload = {"token_hash": _token_hash(self.token), "fetched_at": time.time(), "user": user.to_dict()}
+        temporary = self._identity_cache.with_name(f"{self._identity_cache.name}.{os.getpid()}.tmp")
+        try:
+            temporary.write_text(json.dumps(payload, ensure_ascii=False))
+            # Воркеры пишут кэш одновременно: переименование атомарно
+            os.replace(temporary, self._identity_cache)
+        except OSError as e:
+            logging.warning(f"Не удалось записать кэш профиля бота {self._identity_cache}: {e}")
+
+    async def get_me(self, *args: Any, **kwargs: Any) -> User:
+        if self._bot_user is None:
+            cached = self._load_identity()
+            if cached:
+                # Bot.bot отдает именно этот атрибут: его же заполняет сетевой get_me
+                self._bot_user = User.de_json(cached, self)
+                self._identity_from_cache = True
+                return self._bot_user
+        user = await super().get_me(*args, **kwargs)
+        self._store_identity(user)
+        return user
+
+    async def refresh_identity(self) -> None:
+        """Сетевой getMe в фоне: обновляет кэш и заодно открывает соединение с Bot API."""
+        try:
+            await super().get_me()
+        except Exception as e:
+            logging.warning(f"Не удалось обновить профиль бота (getMe): {e}")
+            return
+        self._store_identity(self._bot_user)
+        self._identity_from_cache = False
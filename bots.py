@@ -0,0 +1,103 @@
+import hashlib
+import hmac
+import os
+from pathlib import Path
+from typing import Optional
+
+from telegram.ext import Application
+
+from dispatcher import UpdateDispatcher
+from outbound import OutboundSender
+from poller import UpdatePoller
+from pre_router import PreRouter
+from update_journal import UpdateJournal
+from update_queue import UpdateQueue
+
+# Telegram принимает max_connections вебхука от 1 до 100
+MAX_WEBHOOK_CONNECTIONS = 100
+
+
+def bot_id_of(token: str) -> str:
+    """Числовой id бота — часть токена до ":". Он публичный и задает адрес /webhook/{bot_id}."""
+    return token.split(":", 1)[0]
+
+
+def load_tokens() -> list[str]:
+    """Токены из TELEGRAM_BOT_TOKEN и TELEGRAM_BOT_TOKENS (через запятую) без повторов; первый — основной бот."""
+    tokens = []
+    for token in [os.getenv("TELEGRAM_BOT_TOKEN", ""), *os.getenv("TELEGRAM_BOT_TOKENS", "").split(",")]:
+        token = token.strip()
+        if token and bot_id_of(token) not in {bot_id_of(known) for known in tokens}:
+            tokens.append(token)
+    return tokens
+
+
+def per_bot_path(path: str, token: str) -> str:
+    """Свой файл для каждого бота: /tmp/identity.json -> /tmp/identity.<bot_id>.json."""
+    original = Path(path)
+    return str(original.with_name(f"{original.stem}.{bot_id_of(token)}{original.suffix}"))
+
+
+def webhook_secret(token: str, secret: str) -> Optional[str]:
+    """
+    secret_token вебхука бота: HMAC общего секрета и id бота (None, если секрет не задан).
+
+    Telegram присылает его в заголовке X-Telegram-Bot-Api-Secret-Token; у каждого
+    бота он свой, так что утечка одного не открывает вебхуки остальных.
+    """
+    if not secret:
+        return None
+    return hmac.new(secret.encode(), bot_id_of(token).encode(), hashlib.sha256).hexdigest()
+
+
+def webhook_max_connections(
+    workers: int, update_mode: str, update_workers: int, db_pool_max_size: int, bots: int = 1
+) -> int:
+    """
+    Сколько одновременных запросов вебхука Telegram может держать к одному боту.
+
+    inline: запрос занят все время обработки, а одновременно обрабатывать воркер
+    может не больше, чем у него соединений с БД. queue: запрос лишь кладет
+    обновление в очередь, а разбирают ее UPDATE_WORKERS задач — больше
+    соединений только переполнили бы очередь. Емкость делится между ботами.
+    """
+    per_worker = update_workers if update_mode == "queue" else db_pool_max_size
+    capacity = workers * per_worker // max(bots, 1)
+    return max(1, min(MAX_WEBHOOK_CONNECTIONS, capacity))
+
+
+class BotRuntime:
+    """
+    Компоненты одного бота в воркере: Application (токен, обработчики), исходящие
+    лимиты, PreRouter с ограничением флуда, дедупликация, очередь и журнал.
+    У каждого бота они свои: лимиты Telegram и update_id у ботов независимы.
+    Пул БД и HTTP-клиент Bot API общие для всех ботов процесса.
+    """
+
+    def __init__(self, application: Application, secret_token: Optional[str] = None):
+        self.application = application
+        self.bot_id = bot_id_of(application.bot.token)
+        self.secret_token = secret_token
+        self.outbound: Optional[OutboundSender] = None
+        self.pre_router: Optional[PreRouter] = None
+        self.update_queue: Optional[UpdateQueue] = None
+        self.update_journal: Optional[UpdateJournal] = None
+        self.dispatcher: Optional[UpdateDispatcher] = None
+        self.poller: Optional[UpdatePoller] = None
+        self.replay_task = None
+        self.identity_refresh_task = None
+
+    def verify_secret(self, header: Optional[str]) -> bool:
+        """Пришел ли вебхук от Telegram: заголовок совпадает с secret_token бота."""
+        if not self.secret_token:
+            return True
+        return hmac.compare_digest((header or "").encode(), self.secret_token.encode())
+
+    def stats(self) -> dict:
+        # Профиль бота известен только после initialize: имя берем у PreRouter
+        stats = {"username": self.pre_router.bot_username if self.pre_router else None}
+        for name in ("outbound", "pre_router", "update_queue", "update_journal", "dispatcher", "poller"):
+            component = getattr(self, name)
+            if component:
+                stats[name] = component.stats()
+        return stats
@@ -0,0 +1,39 @@
+import os
+
+from dotenv import load_dotenv
+
+from bots import load_tokens
+
+# Настройки, которые читают и бот (bot_app.py), и set_webhook.py. Модуль без побочных
+# эффектов: импорт не настраивает логирование и не создает хранилище и клиентов Bot API.
+
+load_dotenv()
+
+# --- Боты ---
+# Один процесс обслуживает несколько ботов: TELEGRAM_BOT_TOKEN (основной) и
+# TELEGRAM_BOT_TOKENS через запятую. Каждый бот принимает вебхуки на /webhook/{bot_id}
+# (bot_id — число до ":" в токене), основной — еще и на /webhook. Пул БД и HTTP-клиент
+# Bot API общие; лимиты, очередь, дедупликация и журнал у каждого бота свои.
+BOT_TOKENS = load_tokens()
+# Общий секрет вебхуков: бот получает от него свой secret_token (set_webhook.py передает
+# его Telegram), и запрос без верного X-Telegram-Bot-Api-Secret-Token отклоняется
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Адрес Bot API: локальный Bot API сервер или заглушка из benchmarks/fake_bot_api.py
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
+
+# Типы обновлений, которые принимают обработчики из bot_app.setup_bot.
+# Правки, посты каналов, реакции и прочее отбрасываются еще до Update.de_json.
+HANDLED_UPDATE_TYPES = ("message",)
+
+# --- Режим Приема Обновлений ---
+# inline: обновление обрабатывается прямо внутри запроса вебхука.
+# queue: вебхук кладет обновление в ограниченную очередь и сразу отвечает 200,
+#        а пул фоновых воркеров разбирает очередь.
+UPDATE_MODE = os.getenv("UPDATE_MODE", "inline")
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+
+# --- Пул Соединений ---
+# Размер пула — на каждый воркер gunicorn: 4 воркера x DB_POOL_MAX_SIZE не должны
+# превышать max_connections PostgreSQL. От него зависит и max_connections вебхука.
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
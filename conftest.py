@@ -3,6 +3,8 @@ import os
 from databases import Database
 import pytest_asyncio
 
+from storage import PostgresStorage, create_storage
+
 # Get database URL from environment variable
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
@@ -14,7 +16,7 @@ if not DATABASE_URL:
 @pytest_asyncio.fixture(scope="function")
 async def db_connection():
     """
-    Establishes an asynchronous database connection pool, creates the table,
+    Establishes an asynchronous database connection pool, migrates the schema,
     and handles cleanup for each test function.
     """
     if not DATABASE_URL:
@@ -29,17 +31,11 @@ async def db_connection():
 
     # --- Setup Phase (Before Test) ---
 
-    # 1. Create the necessary table
-    CREATE_TABLE_QUERY = """
-    CREATE TABLE IF NOT EXISTS user_data (
-        id SERIAL PRIMARY KEY,
-        chat_id BIGINT NOT NULL,
-        username VARCHAR(255),
-        data_text TEXT NOT NULL,
-        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-    );
-    """
-    await database.execute(CREATE_TABLE_QUERY)
+    # 1. Build the schema exactly as the bot does (migrations.py): queries in
+    # records.py rely on columns and tables added by later migrations
+    storage = PostgresStorage(database)
+    await storage.connect()
+    await storage.migrate()
 
     # 2. Clean up any existing data before test run
     await database.execute("DELETE FROM user_data;")
@@ -47,8 +43,21 @@ async def db_connection():
     yield database
 
     # --- Teardown Phase (After Test) ---
-    # Drop the table and disconnect the pool
-    await database.execute("DROP TABLE user_data;")
+    # Drop the schema (partitions and the id sequence go with user_data) and disconnect the pool
+    await database.execute("DROP TABLE IF EXISTS user_data, text_blobs, schema_migrations CASCADE;")
     await database.disconnect()
 
 # NOTE: The separate cleanup_db_data fixture is no longer needed.
+
+
+# SQLite Storage Fixture (Function Scope)
+@pytest_asyncio.fixture
+async def sqlite_storage(tmp_path):
+    """
+    A migrated SQLiteStorage in a fresh file under tmp_path; no server needed.
+    """
+    storage = create_storage(f"sqlite:///{tmp_path / 'bot.db'}")
+    await storage.connect()
+    await storage.migrate()
+    yield storage
+    await storage.disconnect()
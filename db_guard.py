@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from metrics import DB_BREAKER_OPEN, DB_UNAVAILABLE_TOTAL
+from storage import Storage
+
+try:
+    import asyncpg
+
+    # Ошибки, после которых БД считается недоступной, а не отвергшей конкретный запрос
+    _ASYNCPG_ERRORS: tuple = (
+        asyncpg.PostgresConnectionError,
+        asyncpg.InterfaceError,
+        asyncpg.CannotConnectNowError,
+        asyncpg.TooManyConnectionsError,
+        asyncpg.QueryCanceledError,
+        asyncpg.AdminShutdownError,
+    )
+except ImportError:
+    _ASYNCPG_ERRORS = ()
+
+UNAVAILABLE_ERRORS = (asyncio.TimeoutError, OSError, *_ASYNCPG_ERRORS)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class DatabaseUnavailable(ConnectionError):
+    """
+    БД не ответила: запрос отклонен автоматом или упал по сети или дедлайну.
+
+    `maybe_applied` — запрос мог успеть выполниться (истек дедлайн уже
+    отправленного запроса), поэтому повторять запись вслепую нельзя.
+    """
+
+    def __init__(self, message: str, maybe_applied: bool = False):
+        super().__init__(message)
+        self.maybe_applied = maybe_applied
+
+
+class CircuitBreaker:
+    """
+    Автомат защиты БД для одного воркера.
+
+    После `failure_threshold` ошибок недоступности подряд размыкается: запросы
+    сразу получают DatabaseUnavailable, не занимая пул и не дожидаясь дедлайна.
+    Через `reset_timeout` секунд пропускает один пробный запрос (half_open):
+    успех замыкает цепь, ошибка снова размыкает ее.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+        # Метрики
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Можно ли сейчас обращаться к БД. В half_open пропускает ровно один запрос."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self._reset_timeout:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        return False
+
+    def retry_in(self) -> float:
+        """Через сколько секунд автомат пропустит следующий запрос."""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._reset_timeout - (time.monotonic() - self._opened_at))
+
+    def release_probe(self) -> None:
+        """Пробный запрос отменен без ответа БД: следующий вызов сможет попробовать снова."""
+        self._probing = False
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._probing = False
+        if self.state != CLOSED:
+            logging.info("✅ БД снова отвечает: автомат замкнут.")
+            self.state = CLOSED
+            DB_BREAKER_OPEN.set(0)
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probing = False
+        if self.state == HALF_OPEN or self._failures >= self._failure_threshold:
+            if self.state != OPEN:
+                logging.error(f"❌ БД недоступна ({self._failures} ошибок подряд): автомат разомкнут.")
+                self.opened += 1
+                DB_BREAKER_OPEN.set(1)
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "retry_in": round(self.retry_in(), 1),
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+def guard_storage(storage: Storage, breaker: CircuitBreaker, timeout: Optional[float]) -> None:
+    """
+    Оборачивает методы Storage, обращающиеся к БД: дедлайн `timeout` секунд на вызов
+    (вместе с ожиданием соединения из пула) и автомат `breaker`.
+
+    Ошибки недоступности превращаются в DatabaseUnavailable; прочие ошибки (например,
+    нарушение ограничения) означают, что БД ответила, и автомат их не учитывает.
+    """
+    for name in storage.QUERY_METHODS:
+        original = getattr(storage, name)
+
+        async def guarded(*args, _original=original, **kwargs):
+            if not breaker.allow():
+                DB_UNAVAILABLE_TOTAL.labels("rejected").inc()
+                raise DatabaseUnavailable("автомат защиты БД разомкнут")
+            try:
+                result = await asyncio.wait_for(_original(*args, **kwargs), timeout)
+            except asyncio.TimeoutError as e:
+                breaker.record_failure()
+                DB_UNAVAILABLE_TOTAL.labels("timeout").inc()
+                raise DatabaseUnavailable(f"запрос к БД дольше {timeout}с", maybe_applied=True) from e
+            except UNAVAILABLE_ERRORS as e:
+                breaker.record_failure()
+                DB_UNAVAILABLE_TOTAL.labels("connection").inc()
+                raise DatabaseUnavailable(f"БД недоступна: {e}") from e
+            except asyncio.CancelledError:
+                breaker.release_probe()
+                raise
+            except Exception:
+                breaker.record_success()
+                raise
+            breaker.record_success()
+            return result
+
+        setattr(storage, name, guarded)
+
+
+async def probe_while_open(storage: Storage, breaker: CircuitBreaker, interval: float = 1.0) -> None:
+    """
+    Фоновая задача: пока автомат не замкнут, сама проверяет БД через storage.ping.
+
+    Автомат переходит в half_open только при очередном обращении к БД, а воркер
+    с разомкнутым автоматом не готов (/ready отвечает 503), и балансировщик уводит
+    с него трафик. Без пробы обращений больше не будет, и воркер не вернется
+    даже после восстановления БД. Пробует не чаще, чем пропускает автомат.
+    """
+    while True:
+        await asyncio.sleep(max(breaker.retry_in(), interval))
+        if breaker.state == CLOSED:
+            continue
+        try:
+            await storage.ping()
+        except DatabaseUnavailable:
+            pass  # автомат снова разомкнут или проба уже идет: попробуем позже
+        except Exception as e:
+            logging.error(f"❌ Ошибка пробного запроса к БД: {e}")
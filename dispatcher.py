@@ -0,0 +1,242 @@
+import asyncio
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from update_queue import UpdateQueue
+
+# Результаты UpdateDispatcher.dispatch
+PROCESSED = "processed"
+ACCEPTED = "accepted"
+DUPLICATE = "duplicate"
+REJECTED = "rejected"
+
+
+class UpdateIdWindow:
+    """
+    Компактная память о недавних update_id: скользящее окно на битовой карте.
+
+    Telegram выдает update_id по возрастанию, поэтому повторная доставка всегда
+    попадает в окно последних `size` идентификаторов. На окно в 65536 id
+    уходит 8 КБ памяти независимо от нагрузки.
+    """
+
+    def __init__(self, size: int = 65536):
+        self._size = size
+        self._bits = bytearray((size + 7) // 8)
+        self._high: Optional[int] = None
+
+    def _get(self, update_id: int) -> bool:
+        pos = update_id % self._size
+        return bool(self._bits[pos >> 3] & (1 << (pos & 7)))
+
+    def _set(self, update_id: int, value: bool) -> None:
+        pos = update_id % self._size
+        if value:
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        else:
+            self._bits[pos >> 3] &= ~(1 << (pos & 7)) & 0xFF
+
+    def seen(self, update_id: int) -> bool:
+        """
+        Отмечает update_id и возвращает True, если он уже встречался.
+
+        Идентификаторы старше окна считаются уже виденными.
+        """
+        if self._high is None:
+            self._high = update_id
+        elif update_id > self._high:
+            # Сдвигаем окно: освобождаем биты для новых идентификаторов
+            if update_id - self._high >= self._size:
+                self._bits[:] = bytes(len(self._bits))
+            else:
+                for i in range(self._high + 1, update_id + 1):
+                    self._set(i, False)
+            self._high = update_id
+        elif update_id <= self._high - self._size:
+            return True
+        elif self._get(update_id):
+            return True
+
+        self._set(update_id, True)
+        return False
+
+    def contains(self, update_id: int) -> bool:
+        """Встречался ли update_id, как в seen, но без отметки."""
+        if self._high is None or update_id > self._high:
+            return False
+        if update_id <= self._high - self._size:
+            return True
+        return self._get(update_id)
+
+    def forget(self, update_id: int) -> None:
+        """Снимает отметку, чтобы повторная доставка была обработана."""
+        if self._high is not None and self._high - self._size < update_id <= self._high:
+            self._set(update_id, False)
+
+
+class SharedUpdateIdWindow(UpdateIdWindow):
+    """
+    UpdateIdWindow в mmap-файле, общем для всех gunicorn-воркеров хоста (как
+    SharedFileGenerations в record_cache.py). Повторная доставка приходит новым
+    соединением и попадает в любой воркер, поэтому окно одно на бота.
+
+    Файл — заголовок (последний update_id, время последней отметки, размер окна)
+    и битовая карта; seen и forget выполняются под блокировкой файла. Файл
+    переживает рестарты и деплои, поэтому повторы из журнала идут с replayed=True,
+    а источник одних и тех же update_id (бенчмарк) должен брать свой файл. Окно,
+    простоявшее дольше `idle_reset` секунд, очищается: после недели без
+    обновлений Telegram начинает update_id со случайного числа, и старый
+    последний id отбрасывал бы все новые как «старше окна».
+    """
+
+    _HEADER = struct.Struct("<qdq")
+
+    def __init__(self, path: str, size: int = 65536, idle_reset: float = 86400.0):
+        self._size = size
+        self._idle_reset = idle_reset
+        length = self._HEADER.size + (size + 7) // 8
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < length:
+            os.ftruncate(self._fd, length)
+        self._map = mmap.mmap(self._fd, length)
+        self._bits = memoryview(self._map)[self._HEADER.size:]
+
+    @property
+    def _high(self) -> Optional[int]:
+        high = self._HEADER.unpack_from(self._map)[0]
+        return None if high < 0 else high
+
+    @_high.setter
+    def _high(self, value: Optional[int]) -> None:
+        self._HEADER.pack_into(self._map, 0, -1 if value is None else value, time.time(), self._size)
+
+    def _reset_if_stale(self) -> None:
+        _, touched_at, size = self._HEADER.unpack_from(self._map)
+        # Новый файл (нули), другой размер окна или долгий простой
+        if size != self._size or time.time() - touched_at > self._idle_reset:
+            self._bits[:] = bytes(len(self._bits))
+            self._high = None
+
+    def _touch(self) -> None:
+        # Время отметки обновляется и для дублей: окно живо
+        high = self._HEADER.unpack_from(self._map)[0]
+        self._HEADER.pack_into(self._map, 0, high, time.time(), self._size)
+
+    def seen(self, update_id: int) -> bool:
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            self._reset_if_stale()
+            duplicate = super().seen(update_id)
+            self._touch()
+            return duplicate
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def contains(self, update_id: int) -> bool:
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            self._reset_if_stale()
+            return super().contains(update_id)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def forget(self, update_id: int) -> None:
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            super().forget(update_id)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+
+class UpdateDispatcher:
+    """
+    Прослойка между Update.de_json и обработчиками.
+
+    Отбрасывает повторно доставленные обновления и обрабатывает обновления
+    одного чата строго по очереди, а разных чатов — параллельно.
+    С очередью (`queue`) обновления раскладываются по полосам chat_id,
+    без нее — обрабатываются в запросе вебхука под блокировкой чата.
+
+    `window` — окно update_id, общее для воркеров (SharedUpdateIdWindow); без него
+    у диспетчера свое окно на `dedup_window` id, и дубли ловятся только в этом
+    процессе. Порядок внутри чата соблюдается в пределах одного воркера.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[Any], Awaitable[None]],
+        queue: Optional[UpdateQueue] = None,
+        dedup_window: int = 65536,
+        enqueue_timeout: float = 0.0,
+        window: Optional[UpdateIdWindow] = None,
+    ):
+        self._process = process
+        self._queue = queue
+        self._enqueue_timeout = enqueue_timeout
+        self._seen = window or UpdateIdWindow(dedup_window)
+        # chat_id -> [lock, число ожидающих]; запись удаляется, когда чат простаивает
+        self._chat_locks: dict[Hashable, list] = {}
+        self.duplicates = 0
+
+    @staticmethod
+    def chat_key(update: Any) -> Optional[Hashable]:
+        chat = update.effective_chat
+        return chat.id if chat else None
+
+    def is_duplicate(self, update_id: Optional[int]) -> bool:
+        """
+        Повторная ли это доставка, по сырому update_id и без отметки (ее ставит dispatch).
+
+        Вызывается до ограничения флуда, чтобы повторы Telegram не тратили лимит чата
+        и не вызывали ложное предупреждение. Найденный дубль учитывается в stats.
+        """
+        if update_id is not None and self._seen.contains(update_id):
+            self.duplicates += 1
+            return True
+        return False
+
+    async def dispatch(self, update: Any, replayed: bool = False) -> str:
+        """
+        Передает обновление на обработку. Возвращает одну из констант модуля.
+
+        `replayed` — повтор из журнала: его update_id уже отмечен в общем окне
+        до падения воркера, и дублем он не считается.
+        """
+        if self._seen.seen(update.update_id) and not replayed:
+            self.duplicates += 1
+            logging.info(f"Повторная доставка update_id={update.update_id} пропущена.")
+            return DUPLICATE
+
+        key = self.chat_key(update)
+
+        if self._queue:
+            if await self._queue.put(update, timeout=self._enqueue_timeout, key=key):
+                return ACCEPTED
+            # Обновление не принято: Telegram доставит его снова, и его нельзя считать дублем
+            self._seen.forget(update.update_id)
+            return REJECTED
+
+        if key is None:
+            await self._process(update)
+            return PROCESSED
+
+        entry = self._chat_locks.get(key)
+        if entry is None:
+            entry = self._chat_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._process(update)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chat_locks[key]
+        return PROCESSED
+
+    def stats(self) -> dict:
+        return {"duplicates": self.duplicates, "active_chats": len(self._chat_locks)}
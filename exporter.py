@@ -0,0 +1,193 @@
+import asyncio
+import csv
+import datetime
+import fcntl
+import gzip
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from storage import Storage
+
+EXPORT_FORMATS = ("csv", "jsonl")
+# Порядок колонок в файле выгрузки
+EXPORT_FIELDS = ("id", "created_at", "username", "data_text")
+# Bot API принимает от бота документы до 50 МБ
+MAX_DOCUMENT_BYTES = 50 * 1024 * 1024
+
+
+def parse_export_args(args: list[str]) -> str:
+    """Разбирает аргументы /export [csv|jsonl]. Бросает ValueError на неверном вводе."""
+    if not args:
+        return EXPORT_FORMATS[0]
+    fmt = args[0].lower()
+    if len(args) > 1 or fmt not in EXPORT_FORMATS:
+        raise ValueError(f"формат: {' или '.join(EXPORT_FORMATS)}")
+    return fmt
+
+
+def export_filename(chat_id: int, fmt: str) -> str:
+    """Имя документа, которое видит пользователь."""
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d-%H%M%S")
+    return f"export-{chat_id}-{stamp}.{fmt}.gz"
+
+
+def _export_row(record: dict) -> dict:
+    return {
+        "id": record["id"],
+        "created_at": record["created_at"].isoformat(),
+        "username": record["username"],
+        "data_text": record["data_text"],
+    }
+
+
+class _CSVEncoder:
+    def __init__(self, output):
+        self._writer = csv.DictWriter(output, fieldnames=EXPORT_FIELDS)
+        self._writer.writeheader()
+
+    def write(self, records: list[dict]) -> None:
+        self._writer.writerows(_export_row(record) for record in records)
+
+
+class _JSONLinesEncoder:
+    def __init__(self, output):
+        self._output = output
+
+    def write(self, records: list[dict]) -> None:
+        for record in records:
+            self._output.write(json.dumps(_export_row(record), ensure_ascii=False))
+            self._output.write("\n")
+
+
+ENCODERS = {"csv": _CSVEncoder, "jsonl": _JSONLinesEncoder}
+
+
+class ChatExporter:
+    """
+    Фоновая выгрузка /export записей чата в сжатый файл.
+
+    Записи читаются порциями по `chunk_rows` через keyset-курсор и сразу
+    кодируются в gzip-файл во временном каталоге, так что в памяти живет
+    только одна порция, сколько бы записей ни было в чате. Кодирование и
+    сжатие идут в потоках, не занимая event loop. На чат — не больше одной
+    выгрузки на весь хост: выгрузка держит flock файла чата в `directory`
+    (как RetentionJob), и его видят все воркеры gunicorn. На воркер — не больше
+    `max_jobs` выгрузок одновременно (остальные ждут).
+    """
+
+    def __init__(self, storage: Storage, chunk_rows: int = 1000, max_jobs: int = 2, directory: Optional[str] = None):
+        self._storage = storage
+        self._chunk_rows = chunk_rows
+        self._slots = asyncio.Semaphore(max_jobs)
+        self._directory = directory
+        self._tasks: dict[int, asyncio.Task] = {}
+
+        # Метрики
+        self.finished = 0
+        self.failed = 0
+        self.exported_rows = 0
+
+    def busy(self, chat_id: int) -> bool:
+        return chat_id in self._tasks
+
+    def _try_lock(self, chat_id: int) -> Optional[int]:
+        directory = Path(self._directory or tempfile.gettempdir()) / ".export-locks"
+        directory.mkdir(parents=True, exist_ok=True)
+        fd = os.open(directory / f"{chat_id}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def start(
+        self,
+        chat_id: int,
+        fmt: str,
+        deliver: Callable[[Path, int], Awaitable[None]],
+        on_error: Callable[[Exception], Awaitable[None]],
+    ) -> bool:
+        """
+        Запускает выгрузку чата в фоне. Возвращает False, если она уже идет
+        в этом или другом воркере.
+
+        `deliver(path, rows)` отправляет готовый файл; после него файл удаляется.
+        `on_error(error)` вызывается, если выгрузка или отправка не удалась.
+        """
+        if fmt not in ENCODERS:
+            raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+        if self.busy(chat_id):
+            return False
+        fd = self._try_lock(chat_id)
+        if fd is None:
+            return False
+        task = asyncio.create_task(self._run(chat_id, fmt, deliver, on_error))
+        self._tasks[chat_id] = task
+
+        def finished(_) -> None:
+            self._tasks.pop(chat_id, None)
+            os.close(fd)  # снимает блокировку чата
+
+        task.add_done_callback(finished)
+        return True
+
+    async def _run(self, chat_id: int, fmt: str, deliver, on_error) -> None:
+        path = None
+        try:
+            async with self._slots:
+                fd, name = await asyncio.to_thread(
+                    tempfile.mkstemp, prefix=f"export-{chat_id}-", suffix=f".{fmt}.gz", dir=self._directory
+                )
+                os.close(fd)
+                path = Path(name)
+                rows = await self.export(chat_id, fmt, path)
+            await deliver(path, rows)
+            self.finished += 1
+            self.exported_rows += rows
+            logging.info(f"📦 Выгружено {rows} записей в {fmt} (Chat ID: {chat_id})")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"❌ Ошибка выгрузки /export (Chat ID: {chat_id}): {e}", exc_info=True)
+            await on_error(e)
+        finally:
+            if path is not None:
+                await asyncio.to_thread(path.unlink, missing_ok=True)
+
+    async def export(self, chat_id: int, fmt: str, path: Path) -> int:
+        """Пишет все записи чата в `path` (gzip) и возвращает их число."""
+        output = await asyncio.to_thread(gzip.open, path, "wt", encoding="utf-8", newline="")
+        rows = 0
+        try:
+            encoder = await asyncio.to_thread(ENCODERS[fmt], output)
+            cursor = None
+            while True:
+                records, cursor = await self._storage.export_page(chat_id, self._chunk_rows, cursor)
+                if records:
+                    await asyncio.to_thread(encoder.write, records)
+                    rows += len(records)
+                if cursor is None:
+                    return rows
+        finally:
+            await asyncio.to_thread(output.close)
+
+    async def stop(self) -> None:
+        """Отменяет незавершенные выгрузки (остановка воркера)."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self._tasks),
+            "finished": self.finished,
+            "failed": self.failed,
+            "exported_rows": self.exported_rows,
+        }
@@ -0,0 +1,214 @@
+import fcntl
+import mmap
+import os
+import struct
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from metrics import FLOOD_LIMITED_TOTAL
+from outbound import TokenBucket
+
+# Решения FloodControl.admit
+ALLOW = "allow"
+WARN = "warn"
+LIMIT = "limit"
+
+# Ключ стоимости для обычного текста (echo); команды — по имени без "/"
+TEXT_KEY = "text"
+
+WARNING_TEXT = "🚫 Слишком много сообщений. Подождите немного: пока лишние сообщения пропускаются."
+
+
+def parse_costs(spec: str) -> dict[str, float]:
+    """Разбирает стоимости вида "fetch=3,search=3,text=1". Бросает ValueError на неверном вводе."""
+    costs = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        key, _, cost = part.partition("=")
+        costs[key.strip().lstrip("/").lower()] = float(cost)
+    return costs
+
+
+class _ChatBucket(TokenBucket):
+    # warned: этому чату уже отправлено предупреждение в текущем эпизоде флуда
+    __slots__ = ("warned",)
+
+    def __init__(self, rate: float, capacity: float):
+        super().__init__(rate, capacity)
+        self.warned = False
+
+
+class SharedFloodBuckets:
+    """
+    Ведра FloodControl в mmap-файле, общем для всех gunicorn-воркеров хоста (как
+    SharedUpdateIdWindow в dispatcher.py): обновления одного чата приходят в разные
+    воркеры, и без общего ведра каждый пропускал бы свой полный лимит.
+
+    Файл — `slots` ячеек (chat_id, токены, время пополнения, было ли предупреждение).
+    Чат ищется в `probes` ячейках подряд от chat_id % slots; если его там нет,
+    занимает свободную (пустую или простоявшую дольше idle_ttl) или самую давнюю —
+    как вытеснение по max_chats. Время — time.monotonic, общее для процессов хоста;
+    ячейка со временем из будущего (файл пережил перезагрузку) считается пустой.
+    Чтение и запись ячейки — под блокировкой файла.
+    """
+
+    _SLOT = struct.Struct("<qddq")
+
+    def __init__(self, path: str, slots: int = 65536, probes: int = 4):
+        self._slots = slots
+        self._probes = min(probes, slots)
+        length = self._SLOT.size * slots
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < length:
+            os.ftruncate(self._fd, length)
+        self._map = mmap.mmap(self._fd, length)
+        self.evicted = 0
+
+    def _find(self, chat_id: int, now: float, idle_ttl: float) -> tuple[int, Optional[tuple]]:
+        """Ячейка чата и ее содержимое; None — ячейку занимает новое ведро."""
+        start = chat_id % self._slots
+        free = oldest = None
+        oldest_updated = 0.0
+        for i in range(self._probes):
+            offset = (start + i) % self._slots * self._SLOT.size
+            slot = self._SLOT.unpack_from(self._map, offset)
+            updated = slot[2]
+            stale = updated == 0 or updated > now or now - updated >= idle_ttl
+            if slot[0] == chat_id and not stale:
+                return offset, slot
+            if stale:
+                if free is None:
+                    free = offset
+            elif oldest is None or updated < oldest_updated:
+                oldest, oldest_updated = offset, updated
+        if free is None:
+            free = oldest
+            self.evicted += 1
+        return free, None
+
+    @contextmanager
+    def bucket(self, chat_id: int, rate: float, burst: float, idle_ttl: float) -> Iterator["_ChatBucket"]:
+        """Ведро чата на время блока; изменения записываются в файл на выходе."""
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            offset, slot = self._find(chat_id, time.monotonic(), idle_ttl)
+            bucket = _ChatBucket(rate, burst)
+            if slot is not None:
+                _, bucket.tokens, bucket.updated, warned = slot
+                bucket.warned = bool(warned)
+            yield bucket
+            self._SLOT.pack_into(self._map, offset, chat_id, bucket.tokens, bucket.updated, int(bucket.warned))
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+
+class FloodControl:
+    """
+    Поканальное ограничение входящих обновлений (token bucket на чат).
+
+    Каждое обновление стоит `costs[ключ]` токенов (по умолчанию `default_cost`),
+    ведро чата пополняется на `rate` токенов в секунду до `burst`. Обновление
+    сверх лимита отбрасывается; первое такое в эпизоде флуда получает решение
+    WARN (одно предупреждение пользователю), остальные — LIMIT молча.
+
+    Ведра лежат в OrderedDict в порядке последнего обращения. Чат, молчавший
+    дольше `idle_ttl`, удаляется: за это время его ведро все равно наполнилось
+    бы до краев, так что удаление ничего не меняет.
+
+    `shared` — ведра в файле, общем для воркеров (SharedFloodBuckets); без него
+    ведра в памяти процесса, и лимиты действуют на воркер.
+    """
+
+    def __init__(
+        self,
+        rate: float = 1.0,
+        burst: float = 10.0,
+        costs: Optional[dict[str, float]] = None,
+        default_cost: float = 1.0,
+        idle_ttl: float = 600.0,
+        max_chats: int = 100_000,
+        shared: Optional[SharedFloodBuckets] = None,
+    ):
+        costs = costs or {}
+        if max([default_cost, *costs.values()]) > burst:
+            raise ValueError(f"Стоимость обновления больше burst={burst}: такое обновление не пройдет никогда")
+        self._rate = rate
+        self._burst = burst
+        self._costs = costs
+        self._default_cost = default_cost
+        # Раньше, чем ведро наполнится, удалять его нельзя: чат получил бы лишние токены
+        self._idle_ttl = max(idle_ttl, burst / rate)
+        self._max_chats = max_chats
+        self._buckets: OrderedDict[int, _ChatBucket] = OrderedDict()
+        self._shared = shared
+
+        # Метрики: счетчики срабатываний по ключам нужны для подбора стоимостей
+        self.allowed = 0
+        self.warned = 0
+        self.limited = 0
+        self.expired = 0
+        self.hits: dict[str, int] = {}
+
+    def cost(self, key: str) -> float:
+        return self._costs.get(key, self._default_cost)
+
+    def _expire(self, now: float) -> None:
+        buckets = self._buckets
+        while buckets:
+            chat_id, bucket = next(iter(buckets.items()))
+            if now - bucket.updated < self._idle_ttl:
+                break
+            del buckets[chat_id]
+            self.expired += 1
+
+    def admit(self, chat_id: int, key: str) -> str:
+        """Решает, пропустить ли обновление чата: ALLOW, WARN или LIMIT."""
+        if self._shared is not None:
+            with self._shared.bucket(chat_id, self._rate, self._burst, self._idle_ttl) as bucket:
+                return self._take(bucket, key)
+
+        now = time.monotonic()
+        self._expire(now)
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = _ChatBucket(self._rate, self._burst)
+            if len(self._buckets) > self._max_chats:
+                # Защита памяти от потока новых чатов: вытесняем самый давний
+                self._buckets.popitem(last=False)
+                self.expired += 1
+        else:
+            self._buckets.move_to_end(chat_id)
+        return self._take(bucket, key)
+
+    def _take(self, bucket: _ChatBucket, key: str) -> str:
+        cost = self.cost(key)
+        if bucket.try_take(cost):
+            # Новый эпизод флуда (и новое предупреждение) — только после того, как чат затих
+            # и ведро наполнилось; иначе каждый пополненный токен давал бы еще одно предупреждение
+            if bucket.warned and bucket.tokens + cost >= self._burst:
+                bucket.warned = False
+            self.allowed += 1
+            return ALLOW
+
+        self.hits[key] = self.hits.get(key, 0) + 1
+        if not bucket.warned:
+            bucket.warned = True
+            self.warned += 1
+            FLOOD_LIMITED_TOTAL.labels(key, WARN).inc()
+            return WARN
+        self.limited += 1
+        FLOOD_LIMITED_TOTAL.labels(key, LIMIT).inc()
+        return LIMIT
+
+    def stats(self) -> dict:
+        return {
+            "chats": len(self._buckets),
+            "allowed": self.allowed,
+            "warned": self.warned,
+            "limited": self.limited,
+            "expired": self.expired + (self._shared.evicted if self._shared else 0),
+            "hits": dict(self.hits),
+        }
@@ -0,0 +1,37 @@
+import asyncio
+import logging
+import os
+import shutil
+
+from prometheus_client import multiprocess
+
+# Каталог, в который воркеры пишут метрики Prometheus (см. metrics.py)
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+
+def on_starting(server):
+    """Очищает метрики предыдущего запуска и один раз готовит схему БД до старта воркеров."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+        os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+    from dotenv import load_dotenv
+
+    from migrate import run_migrations
+    from storage import database_url_from_env
+
+    load_dotenv()
+    try:
+        asyncio.run(run_migrations(database_url_from_env(), int(os.getenv("PARTITION_MONTHS_AHEAD", "2"))))
+    except Exception as e:
+        # БД еще недоступна: миграции применит первый воркер, который до нее дозвонится
+        logging.error(f"❌ Миграции в мастер-процессе не применены: {e}")
+        return
+    # Воркеры наследуют окружение мастера и пропускают миграции при старте
+    os.environ["DB_MIGRATE_ON_STARTUP"] = "0"
+
+
+def child_exit(server, worker):
+    """Убирает живые gauge-метрики завершившегося воркера из общей суммы."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(worker.pid)
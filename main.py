@@ -1,25 +1,42 @@
+import argparse
+import asyncio
+import os
+
 import uvicorn
-from bot_app import app
+
 
 def start_application():
     """
-    Запускает приложение FastAPI с помощью Uvicorn.
+    Запускает бота в одном процессе в выбранном режиме приема обновлений.
 
-    Для запуска приложения bot_app.py мы используем Uvicorn.
-    Параметр 'reload=True' полезен для разработки, так как он
-    перезагружает сервер при изменении кода.
+    webhook — приложение FastAPI (bot_app:start_app) под Uvicorn: Telegram
+    присылает обновления на /webhook. В бою вместо этого используется
+    gunicorn с несколькими воркерами (см. docker-compose.yml).
+    polling — бот сам забирает обновления getUpdates: не нужен публичный URL.
+    Режим по умолчанию берется из BOT_MODE.
     """
+    parser = argparse.ArgumentParser(description="Запуск Telegram-бота")
+    parser.add_argument("--mode", choices=("webhook", "polling"), default=os.getenv("BOT_MODE", "webhook"))
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--reload", action="store_true", help="перезапуск при изменении кода (только для разработки)")
+    args = parser.parse_args()
+
+    if args.mode == "polling":
+        import bot_app  # конфигурация читается при импорте
+
+        print("Запуск в режиме polling (getUpdates)...")
+        asyncio.run(bot_app.run_polling())
+        return
+
     print("Подготовка к запуску Uvicorn...")
-    uvicorn.run(
-        "bot_app:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True  # Перезагрузка при изменениях кода (только для разработки)
-    )
+    uvicorn.run("bot_app:start_app", host=args.host, port=args.port, reload=args.reload)
+
 
 if __name__ == "__main__":
     start_application()
 
 # Инструкция по запуску:
-# 1. Установите зависимости: pip install fastapi uvicorn sqlalchemy pydantic
-# 2. Запустите этот файл: python main.py
+# 1. Установите зависимости: pip install -r requirements.txt
+# 2. Вебхук: python main.py (адрес вебхука регистрирует set_webhook.py)
+#    Без публичного URL: python main.py --mode polling
@@ -0,0 +1,152 @@
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+from profiler import record_stage
+from storage import Storage
+
+# Метрики Prometheus. Если задан PROMETHEUS_MULTIPROC_DIR (gunicorn с несколькими
+# воркерами), каждый воркер пишет значения в свои mmap-файлы в этом каталоге,
+# а /metrics и /status любого воркера показывают сумму по всем воркерам.
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Этапы: json_parse, journal_append, deserialize, handler, db_query, outbound_send
+STAGE_SECONDS = Histogram(
+    "bot_stage_seconds",
+    "Длительность этапов обработки обновления",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0),
+)
+UPDATES_TOTAL = Counter("bot_updates_total", "Обновления вебхука по результату приема", ["result"])
+COMMANDS_TOTAL = Counter("bot_commands_total", "Обработанные команды и сообщения", ["command"])
+COMMAND_ERRORS_TOTAL = Counter("bot_command_errors_total", "Ошибки обработки команд", ["command"])
+# action: warn (отброшено с предупреждением), limit (отброшено молча)
+FLOOD_LIMITED_TOTAL = Counter(
+    "bot_flood_limited_total", "Обновления, отброшенные поканальным ограничением", ["command", "action"]
+)
+JOURNAL_PENDING = Gauge(
+    "bot_journal_pending", "Принятые, но еще не обработанные обновления в журнале", multiprocess_mode="livesum"
+)
+JOURNAL_REPLAYED_TOTAL = Counter(
+    "bot_journal_replayed_total", "Обновления, повторно обработанные из журнала после перезапуска"
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "bot_db_pool_connections", "Соединения пула БД по состоянию", ["state"], multiprocess_mode="livesum"
+)
+DB_BREAKER_OPEN = Gauge(
+    "bot_db_breaker_open", "Воркеры с разомкнутым автоматом защиты БД", multiprocess_mode="livesum"
+)
+# reason: rejected (автомат разомкнут), timeout (дедлайн запроса), connection (сеть, пул)
+DB_UNAVAILABLE_TOTAL = Counter("bot_db_unavailable_total", "Запросы к БД, не получившие ответа", ["reason"])
+STARTUP_SECONDS = Gauge(
+    "bot_startup_seconds", "Длительность старта воркера до готовности", multiprocess_mode="max"
+)
+LAST_SAVE_TIMESTAMP = Gauge(
+    "bot_last_save_timestamp_seconds", "Время последнего успешного /save (unix)", multiprocess_mode="max"
+)
+
+
+@contextmanager
+def observe_stage(stage: str):
+    """Засекает длительность этапа и пишет ее в гистограмму bot_stage_seconds и трассу обновления."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        record_stage(stage, elapsed)
+
+
+def instrument_storage(storage: Storage) -> None:
+    """Оборачивает методы Storage, обращающиеся к БД, чтобы каждый вызов попадал в этап db_query."""
+    for name in storage.QUERY_METHODS:
+        original = getattr(storage, name)
+
+        async def timed(*args, _original=original, **kwargs):
+            with observe_stage("db_query"):
+                return await _original(*args, **kwargs)
+
+        setattr(storage, name, timed)
+
+
+async def publish_pool_stats(storage: Storage, interval: float = 5.0) -> None:
+    """Фоновая задача: периодически выгружает состояние пула в метрики."""
+    while True:
+        stats = storage.pool_stats()
+        if stats:
+            for state, value in stats.items():
+                DB_POOL_CONNECTIONS.labels(state).set(value)
+        await asyncio.sleep(interval)
+
+
+def _registry() -> CollectorRegistry:
+    if not MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render() -> tuple[bytes, str]:
+    """Текст метрик для /metrics и его content type."""
+    return generate_latest(_registry()), CONTENT_TYPE_LATEST
+
+
+def summary() -> dict:
+    """Сводка метрик по всем воркерам для команды /status."""
+    commands: dict[str, int] = {}
+    errors: dict[str, int] = {}
+    updates: dict[str, int] = {}
+    db_pool: dict[str, int] = {}
+    stage_sum: dict[str, float] = {}
+    stage_count: dict[str, float] = {}
+    stage_buckets: dict[str, list] = {}
+    last_save = None
+
+    for metric in _registry().collect():
+        for sample in metric.samples:
+            labels = sample.labels
+            if sample.name == "bot_commands_total":
+                commands[labels["command"]] = int(sample.value)
+            elif sample.name == "bot_command_errors_total":
+                errors[labels["command"]] = int(sample.value)
+            elif sample.name == "bot_updates_total":
+                updates[labels["result"]] = int(sample.value)
+            elif sample.name == "bot_db_pool_connections":
+                db_pool[labels["state"]] = int(sample.value)
+            elif sample.name == "bot_last_save_timestamp_seconds" and sample.value:
+                last_save = sample.value
+            elif sample.name == "bot_stage_seconds_sum":
+                stage_sum[labels["stage"]] = sample.value
+            elif sample.name == "bot_stage_seconds_count":
+                stage_count[labels["stage"]] = sample.value
+            elif sample.name == "bot_stage_seconds_bucket":
+                stage_buckets.setdefault(labels["stage"], []).append((float(labels["le"]), sample.value))
+
+    stages = {}
+    for stage, count in stage_count.items():
+        if not count:
+            continue
+        # p95 по гистограмме: верхняя граница первого бакета, покрывшего 95% наблюдений
+        p95 = next(le for le, value in sorted(stage_buckets[stage]) if value >= count * 0.95)
+        stages[stage] = {
+            "count": int(count),
+            "avg_ms": round(stage_sum[stage] / count * 1000, 2),
+            "p95_ms": round(p95 * 1000, 2) if p95 != float("inf") else None,
+        }
+
+    return {
+        "updates": updates,
+        "commands": commands,
+        "errors": errors,
+        "stages": stages,
+        "db_pool": db_pool,
+        "last_save": last_save,
+    }
+
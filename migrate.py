@@ -0,0 +1,43 @@
+"""
+Однократная подготовка схемы до старта воркеров: миграции (migrations.py)
+и месячные секции user_data на PARTITION_MONTHS_AHEAD месяцев вперед.
+
+Gunicorn вызывает run_migrations из мастер-процесса (gunicorn.conf.py,
+on_starting), поэтому воркеры только подключаются к уже готовой базе.
+Можно запускать и отдельным шагом деплоя:
+    python migrate.py
+"""
+import asyncio
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+
+from storage import create_storage, database_url_from_env
+
+
+async def run_migrations(url: str, months_ahead: int = 2) -> list[int]:
+    """Применяет недостающие миграции и создает секции. Возвращает версии примененных миграций."""
+    storage = create_storage(url)
+    await storage.connect()
+    try:
+        applied = await storage.migrate()
+        await storage.ensure_partitions(months_ahead)
+        return applied
+    finally:
+        await storage.disconnect()
+
+
+def main() -> None:
+    load_dotenv()
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    started = time.perf_counter()
+    applied = asyncio.run(
+        run_migrations(database_url_from_env(), int(os.getenv("PARTITION_MONTHS_AHEAD", "2")))
+    )
+    logging.info(f"Схема готова за {time.perf_counter() - started:.2f}с. Новых миграций: {len(applied)}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+from records import CREATE_FETCH_INDEX_QUERY
+
+# Общая схема для PostgreSQL и SQLite. Каждая миграция — (версия, имя, {диалект: [SQL, ...]}).
+# Версии только растут; примененные записываются в schema_migrations,
+# поэтому повторный запуск (рестарт, несколько воркеров) ничего не меняет.
+# Существующие базы без schema_migrations подхватываются благодаря IF NOT EXISTS.
+
+CREATE_MIGRATIONS_TABLE = {
+    "postgresql": """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+    "sqlite": """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TEXT DEFAULT (datetime('now'))
+    );
+    """,
+}
+
+MIGRATIONS = [
+    (1, "create_user_data", {
+        "postgresql": ["""
+        CREATE TABLE IF NOT EXISTS user_data (
+            id SERIAL PRIMARY KEY,
+            chat_id BIGINT NOT NULL,
+            username VARCHAR(255),
+            data_text TEXT NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+        """],
+        # created_at хранится текстом 'YYYY-MM-DD HH:MM:SS.ffffff' в UTC: строки этого
+        # формата сравниваются так же, как время, и индекс /fetch работает без изменений
+        "sqlite": ["""
+        CREATE TABLE IF NOT EXISTS user_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            username VARCHAR(255),
+            data_text TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+        );
+        """],
+    }),
+    (2, "user_data_fetch_index", {
+        "postgresql": [CREATE_FETCH_INDEX_QUERY],
+        "sqlite": [CREATE_FETCH_INDEX_QUERY],
+    }),
+    # Полнотекстовый поиск /search. Конфигурация simple (без стемминга): заметки
+    # бывают на разных языках, а одинаковое поведение двух бэкендов важнее морфологии.
+    (3, "user_data_search", {
+        # btree_gin позволяет держать chat_id и tsvector в одном GIN-индексе:
+        # поиск сразу ограничен чатом, а не фильтрует совпадения всей таблицы
+        "postgresql": [
+            "CREATE EXTENSION IF NOT EXISTS btree_gin;",
+            """
+            ALTER TABLE user_data ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (to_tsvector('simple', data_text)) STORED;
+            """,
+            "CREATE INDEX IF NOT EXISTS user_data_search_idx ON user_data USING GIN (chat_id, search_vector);",
+        ],
+        # Бесконтентная FTS5-таблица (rowid = user_data.id). Колонка chat хранит токен
+        # чата, чтобы ограничение чатом тоже проверялось индексом; синхронизация — триггерами.
+        "sqlite": [
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS user_data_fts USING fts5(
+                chat, data_text, content='', tokenize='unicode61 remove_diacritics 2'
+            );
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS user_data_fts_insert AFTER INSERT ON user_data BEGIN
+                INSERT INTO user_data_fts (rowid, chat, data_text)
+                VALUES (new.id, 'c' || replace(new.chat_id, '-', 'n'), new.data_text);
+            END;
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS user_data_fts_delete AFTER DELETE ON user_data BEGIN
+                INSERT INTO user_data_fts (user_data_fts, rowid, chat, data_text)
+                VALUES ('delete', old.id, 'c' || replace(old.chat_id, '-', 'n'), old.data_text);
+            END;
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS user_data_fts_update AFTER UPDATE OF chat_id, data_text ON user_data BEGIN
+                INSERT INTO user_data_fts (user_data_fts, rowid, chat, data_text)
+                VALUES ('delete', old.id, 'c' || replace(old.chat_id, '-', 'n'), old.data_text);
+                INSERT INTO user_data_fts (rowid, chat, data_text)
+                VALUES (new.id, 'c' || replace(new.chat_id, '-', 'n'), new.data_text);
+            END;
+            """,
+            """
+            INSERT INTO user_data_fts (rowid, chat, data_text)
+            SELECT id, 'c' || replace(chat_id, '-', 'n'), data_text FROM user_data;
+            """,
+        ],
+    }),
+    # user_data секционируется по месяцам created_at. Существующая таблица целиком
+    # становится секцией user_data_legacy (MINVALUE .. начало следующего месяца) без
+    # копирования строк; новые месячные секции создает Storage.ensure_partitions.
+    # DEFAULT-секция принимает восстановленные из архива строки (см. retention.py).
+    (4, "user_data_monthly_partitions", {
+        "postgresql": ["""
+        DO $$
+        DECLARE
+            legacy_until timestamptz := (date_trunc('month', now() AT TIME ZONE 'UTC') + interval '1 month') AT TIME ZONE 'UTC';
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'user_data'::regclass) THEN
+                RETURN;
+            END IF;
+
+            ALTER TABLE user_data RENAME TO user_data_legacy;
+            ALTER TABLE user_data_legacy RENAME CONSTRAINT user_data_pkey TO user_data_legacy_pkey;
+            ALTER INDEX IF EXISTS user_data_chat_created_idx RENAME TO user_data_legacy_chat_created_idx;
+            ALTER INDEX IF EXISTS user_data_search_idx RENAME TO user_data_legacy_search_idx;
+            UPDATE user_data_legacy SET created_at = now() WHERE created_at IS NULL;
+            ALTER TABLE user_data_legacy ALTER COLUMN created_at SET NOT NULL;
+
+            CREATE TABLE user_data (
+                id INTEGER NOT NULL DEFAULT nextval('user_data_id_seq'),
+                chat_id BIGINT NOT NULL,
+                username VARCHAR(255),
+                data_text TEXT NOT NULL,
+                created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                search_vector tsvector GENERATED ALWAYS AS (to_tsvector('simple', data_text)) STORED,
+                PRIMARY KEY (id, created_at)
+            ) PARTITION BY RANGE (created_at);
+            ALTER SEQUENCE user_data_id_seq OWNED BY user_data.id;
+            ALTER TABLE user_data_legacy ALTER COLUMN id DROP DEFAULT;
+
+            CREATE INDEX user_data_chat_created_idx ON user_data (chat_id, created_at DESC, id DESC);
+            CREATE INDEX user_data_search_idx ON user_data USING GIN (chat_id, search_vector);
+
+            EXECUTE format(
+                'ALTER TABLE user_data ATTACH PARTITION user_data_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+                legacy_until
+            );
+            CREATE TABLE user_data_default PARTITION OF user_data DEFAULT;
+        END $$;
+        """],
+        # В SQLite секций нет: архивирование выбирает строки месяца по индексу created_at,
+        # а восстановленные из архива строки помечены, чтобы не выгружать их снова
+        "sqlite": [
+            "CREATE INDEX IF NOT EXISTS user_data_created_idx ON user_data (created_at);",
+            "CREATE TABLE IF NOT EXISTS user_data_restored (id INTEGER PRIMARY KEY);",
+        ],
+    }),
+    # Длинные тексты хранятся один раз, сжатыми, по SHA-256 (text_blobs.py): строка
+    # user_data ссылается на blob через blob_hash, а ее data_text пуст. Полнотекстовый
+    # индекс blob'а тоже один на все его копии.
+    (5, "text_blobs", {
+        "postgresql": [
+            """
+            CREATE TABLE IF NOT EXISTS text_blobs (
+                hash BYTEA PRIMARY KEY,
+                codec SMALLINT NOT NULL,
+                size INTEGER NOT NULL,
+                data BYTEA NOT NULL,
+                search_vector tsvector NOT NULL
+            );
+            """,
+            # Данные уже сжаты: TOAST не тратит время на вторую попытку сжатия
+            "ALTER TABLE text_blobs ALTER COLUMN data SET STORAGE EXTERNAL;",
+            "CREATE INDEX IF NOT EXISTS text_blobs_search_idx ON text_blobs USING GIN (search_vector);",
+            "ALTER TABLE user_data ADD COLUMN IF NOT EXISTS blob_hash BYTEA;",
+            # Поиск по blob'ам внутри чата и сборка blob'ов, на которые больше никто не ссылается
+            "CREATE INDEX IF NOT EXISTS user_data_blob_idx ON user_data (blob_hash, chat_id) WHERE blob_hash IS NOT NULL;",
+        ],
+        # Строка blob'а в text_blobs_fts имеет rowid blob'а
+        "sqlite": [
+            """
+            CREATE TABLE IF NOT EXISTS text_blobs (
+                hash BLOB NOT NULL UNIQUE,
+                codec INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                data BLOB NOT NULL
+            );
+            """,
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS text_blobs_fts USING fts5(
+                data_text, content='', tokenize='unicode61 remove_diacritics 2'
+            );
+            """,
+            "ALTER TABLE user_data ADD COLUMN blob_hash BLOB;",
+            "CREATE INDEX IF NOT EXISTS user_data_blob_idx ON user_data (blob_hash, chat_id) WHERE blob_hash IS NOT NULL;",
+        ],
+    }),
+]
@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from telegram import Bot
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from metrics import observe_stage
+from profiler import record_stage
+
+
+class TokenBucket:
+    """
+    Token bucket: `rate` токенов в секунду, не более `capacity` подряд.
+
+    `reserve` сразу забирает токен (баланс может уйти в минус) и возвращает,
+    сколько секунд нужно подождать, чтобы уложиться в лимит.
+    """
+
+    # Ведер по одному на чат бывают сотни тысяч: без __dict__ каждое в несколько раз меньше
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= cost
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def try_take(self, cost: float = 1.0) -> bool:
+        """Забирает токен, только если он есть сейчас."""
+        self._refill(time.monotonic())
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def block_for(self, seconds: float) -> None:
+        """Опустошает ведро так, чтобы следующий токен появился через `seconds`."""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class WebhookReply:
+    """
+    Слот для единственного ответа, который можно вернуть прямо в теле ответа на вебхук.
+
+    Telegram выполняет один вызов Bot API, переданный в теле ответа, поэтому
+    отдельный исходящий HTTPS-запрос не нужен. Результат такого вызова боту
+    не сообщается, так что слот используется только для простых текстовых ответов.
+    """
+
+    def __init__(self):
+        self.pending: Optional[tuple[int, str, dict]] = None
+        self.closed = False
+
+    def payload(self) -> Optional[dict]:
+        """Тело ответа вебхука с вызовом sendMessage или None, если ответа нет."""
+        if self.pending is None:
+            return None
+        chat_id, text, kwargs = self.pending
+        return {"method": "sendMessage", "chat_id": chat_id, "text": text, **kwargs}
+
+
+# Слот ответа для обновления, которое сейчас обрабатывается в запросе вебхука
+webhook_reply: ContextVar[Optional[WebhookReply]] = ContextVar("webhook_reply", default=None)
+
+
+class OutboundSender:
+    """
+    Центральный планировщик исходящих вызовов Bot API.
+
+    Каждое сообщение проходит через глобальный и поканальный token bucket,
+    затем через семафор, ограничивающий число одновременных запросов
+    к общему пулу HTTP-соединений бота. RetryAfter соблюдается, а сетевые
+    ошибки и таймауты повторяются с экспоненциальной задержкой и джиттером.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        concurrency: int = 16,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        max_chat_buckets: int = 100_000,
+    ):
+        self._bot = bot
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chat_buckets: OrderedDict[int, TokenBucket] = OrderedDict()
+        self._max_chat_buckets = max_chat_buckets
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._max_retries = max_retries
+        self._backoff = backoff
+
+        # Метрики отправки
+        self._recent_latencies: deque = deque(maxlen=1024)
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.retry_after = 0
+        self.in_flight = 0
+        self.webhook_replies = 0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+            # Вытесняем давно молчавшие чаты, чтобы словарь не рос бесконечно
+            if len(self._chat_buckets) > self._max_chat_buckets:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def _wait_for_slot(self, chat_id: int) -> None:
+        delay = max(self._chat_bucket(chat_id).reserve(), self._global.reserve())
+        if delay > 0:
+            # Только в трассу медленного обновления: гистограмме нужны и нулевые ожидания
+            record_stage("outbound_wait", delay)
+            await asyncio.sleep(delay)
+
+    async def call(self, method: str, chat_id: int, **kwargs: Any) -> Any:
+        """Вызывает метод Bot API (например, send_message) с лимитами и повторами."""
+        attempt = 0
+        while True:
+            await self._wait_for_slot(chat_id)
+            started = time.monotonic()
+            try:
+                async with self._semaphore:
+                    self.in_flight += 1
+                    try:
+                        with observe_stage("outbound_send"):
+                            result = await getattr(self._bot, method)(chat_id=chat_id, **kwargs)
+                    finally:
+                        self.in_flight -= 1
+            except RetryAfter as e:
+                if attempt >= self._max_retries:
+                    self.failed += 1
+                    raise
+                delay = float(e.retry_after)
+                self.retry_after += 1
+                # Telegram сам сказал, когда можно снова писать в этот чат
+                self._chat_bucket(chat_id).block_for(delay)
+                logging.warning(f"Bot API просит подождать {delay}с (chat_id={chat_id}).")
+            except BadRequest:
+                # Ошибка в самом запросе: повтор не поможет
+                self.failed += 1
+                raise
+            except NetworkError as e:
+                if attempt >= self._max_retries:
+                    self.failed += 1
+                    raise
+                delay = self._backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                logging.warning(f"Ошибка отправки ({e}), повтор через {delay:.2f}с (chat_id={chat_id}).")
+                await asyncio.sleep(delay)
+            except Exception:
+                self.failed += 1
+                raise
+            else:
+                self.sent += 1
+                self._recent_latencies.append(time.monotonic() - started)
+                return result
+
+            attempt += 1
+            self.retries += 1
+
+    def _try_acquire(self, chat_id: int) -> bool:
+        """Забирает токены глобального и поканального лимита, только если оба доступны сейчас."""
+        chat_bucket = self._chat_bucket(chat_id)
+        if not self._global.try_take():
+            return False
+        if not chat_bucket.try_take():
+            self._global.tokens += 1
+            return False
+        return True
+
+    def _release(self, chat_id: int) -> None:
+        """Возвращает токены, взятые _try_acquire."""
+        self._global.tokens += 1
+        self._chat_bucket(chat_id).tokens += 1
+
+    async def send_message(self, chat_id: int, text: str, **kwargs: Any) -> Any:
+        """
+        Отправляет сообщение.
+
+        Если обновление обрабатывается в запросе вебхука с включенным слотом
+        ответа, первый простой ответ откладывается в тело ответа вебхука
+        (метод возвращает None). Следующий ответ закрывает слот: отложенный
+        ответ отправляется обычным путем первым, чтобы сохранить порядок.
+        """
+        slot = webhook_reply.get()
+        if slot is not None and not slot.closed:
+            simple = all(isinstance(value, (str, int, float, bool)) for value in kwargs.values())
+            if slot.pending is None and simple and self._try_acquire(chat_id):
+                slot.pending = (chat_id, text, kwargs)
+                self.webhook_replies += 1
+                return None
+
+            slot.closed = True
+            if slot.pending is not None:
+                pending_chat_id, pending_text, pending_kwargs = slot.pending
+                slot.pending = None
+                self.webhook_replies -= 1
+                # call снова резервирует токены: взятые под слот возвращаются, иначе ответ оплачен дважды
+                self._release(pending_chat_id)
+                await self.call("send_message", pending_chat_id, text=pending_text, **pending_kwargs)
+
+        return await self.call("send_message", chat_id, text=text, **kwargs)
+
+    def stats(self) -> dict:
+        latencies = sorted(self._recent_latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "retry_after": self.retry_after,
+            "in_flight": self.in_flight,
+            "webhook_replies": self.webhook_replies,
+            "chat_buckets": len(self._chat_buckets),
+            "latency_ms_p50": percentile(0.50),
+            "latency_ms_p95": percentile(0.95),
+        }
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional, Sequence
+
+import httpx
+
+from pre_router import loads
+
+# Коды ответа getUpdates, после которых повторять запрос бессмысленно: токен отклонен
+FATAL_STATUS = (401, 404)
+
+
+class _RetryLater(Exception):
+    """getUpdates не удался временно: повторить через `retry_after` секунд (None — по своему интервалу)."""
+
+    def __init__(self, retry_after: Optional[float], description: str):
+        super().__init__(description)
+        self.retry_after = retry_after
+
+
+class UpdatePoller:
+    """
+    Прием обновлений long polling'ом (getUpdates) вместо вебхука.
+
+    Каждый запрос забирает до `limit` обновлений и ждет новых до `timeout`
+    секунд. Пачка передается в `feed` по одному обновлению (сырой dict, как тело
+    вебхука), все обновления пачки — одновременно: порядок внутри чата
+    обеспечивает UpdateDispatcher. Следующий offset сохраняется в файл,
+    только когда `feed` вернулся для всей пачки, и лишь затем уходит в Telegram
+    следующим getUpdates: подтвержденное Telegram обновление уже обработано
+    (или принято в журнал), а после рестарта обработанное не повторится.
+
+    Ответы Bot API разбираются напрямую (orjson), без объектов PTB: до
+    Update.de_json доходят только обновления, которые PreRouter не отбросил.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        feed: Callable[[dict], Awaitable[Any]],
+        offset_path: Optional[str] = None,
+        limit: int = 100,
+        timeout: int = 50,
+        allowed_updates: Optional[Sequence[str]] = None,
+        retry_interval: float = 1.0,
+        max_retry_interval: float = 30.0,
+    ):
+        self._api_url = api_url
+        self._feed = feed
+        self._offset_path = Path(offset_path) if offset_path else None
+        self._limit = limit
+        self._timeout = timeout
+        self._allowed_updates = list(allowed_updates) if allowed_updates is not None else None
+        self._retry_interval = retry_interval
+        self._max_retry_interval = max_retry_interval
+        # Long polling держит соединение до `timeout` секунд: чтение ждет чуть дольше
+        self._client = httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=timeout + 10.0))
+        self._request_task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+        self.offset: Optional[int] = self._load_offset()
+
+        # Метрики приема
+        self.requests = 0
+        self.batches = 0
+        self.updates = 0
+        self.failed = 0
+        self.errors = 0
+        self.max_batch = 0
+
+    def _load_offset(self) -> Optional[int]:
+        if not self._offset_path:
+            return None
+        try:
+            return int(self._offset_path.read_text().strip())
+        except (OSError, ValueError):
+            return None
+
+    def _store_offset(self) -> None:
+        if not self._offset_path:
+            return
+        temporary = self._offset_path.with_name(f"{self._offset_path.name}.tmp")
+        try:
+            temporary.write_text(str(self.offset))
+            os.replace(temporary, self._offset_path)
+        except OSError as e:
+            # Не фатально: Telegram помнит подтвержденный offset, рискуем лишь повтором пачки
+            logging.warning(f"Не удалось сохранить offset getUpdates в {self._offset_path}: {e}")
+
+    async def _get_updates(self) -> list[dict]:
+        params: dict[str, Any] = {"limit": self._limit, "timeout": self._timeout}
+        if self.offset is not None:
+            params["offset"] = self.offset
+        if self._allowed_updates is not None:
+            params["allowed_updates"] = self._allowed_updates
+        self.requests += 1
+        response = await self._client.post(self._api_url, json=params)
+        data = loads(response.content)
+        if data.get("ok"):
+            return data["result"]
+
+        description = data.get("description", response.reason_phrase)
+        if response.status_code in FATAL_STATUS:
+            raise RuntimeError(f"getUpdates отклонен ({response.status_code}): {description}")
+        retry_after = (data.get("parameters") or {}).get("retry_after")
+        if retry_after:
+            raise _RetryLater(float(retry_after), description)
+        # 409: установлен вебхук или getUpdates уже вызывает другой процесс
+        raise _RetryLater(None, f"{response.status_code} {description}")
+
+    async def _feed_batch(self, batch: list[dict]) -> None:
+        results = await asyncio.gather(*(self._feed(update) for update in batch), return_exceptions=True)
+        for update, result in zip(batch, results):
+            if isinstance(result, Exception):
+                self.failed += 1
+                logging.error(f"❌ Ошибка обработки update_id={update.get('update_id')}: {result}", exc_info=result)
+
+    async def run(self) -> None:
+        """Принимает обновления, пока не вызван stop."""
+        logging.info(f"Polling запущен: limit={self._limit}, timeout={self._timeout}с, offset={self.offset}.")
+        delay = self._retry_interval
+        while not self._stopping.is_set():
+            self._request_task = asyncio.create_task(self._get_updates())
+            try:
+                batch = await self._request_task
+            except asyncio.CancelledError:
+                if self._stopping.is_set():
+                    break
+                raise
+            except (_RetryLater, httpx.HTTPError, ValueError) as e:
+                self.errors += 1
+                wait = e.retry_after if isinstance(e, _RetryLater) and e.retry_after else delay
+                logging.warning(f"getUpdates не удался: {e}. Повтор через {wait:.1f}с.")
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2, self._max_retry_interval)
+                continue
+            finally:
+                self._request_task = None
+            delay = self._retry_interval
+            if not batch:
+                continue
+
+            self.batches += 1
+            self.updates += len(batch)
+            self.max_batch = max(self.max_batch, len(batch))
+            await self._feed_batch(batch)
+            self.offset = batch[-1]["update_id"] + 1
+            self._store_offset()
+        logging.info(f"Polling остановлен, offset={self.offset}.")
+
+    def stop(self) -> None:
+        """
+        Останавливает прием. Висящий long poll прерывается; пачка, которая уже
+        обрабатывается, дорабатывается, и ее offset сохраняется.
+        """
+        self._stopping.set()
+        if self._request_task:
+            self._request_task.cancel()
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "offset": self.offset,
+            "requests": self.requests,
+            "batches": self.batches,
+            "updates": self.updates,
+            "avg_batch": round(self.updates / self.batches, 1) if self.batches else 0,
+            "max_batch": self.max_batch,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
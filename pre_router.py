@@ -0,0 +1,162 @@
+import json
+from typing import Any, Callable, Optional
+
+from telegram import Update
+from telegram.ext import Application, CommandHandler, MessageHandler
+
+from flood_control import ALLOW, TEXT_KEY, WARN, WARNING_TEXT, FloodControl
+from metrics import COMMAND_ERRORS_TOTAL, COMMANDS_TOTAL, observe_stage
+from profiler import set_handler
+
+try:
+    # orjson разбирает тело вебхука в несколько раз быстрее стандартного json
+    import orjson
+
+    loads: Callable[[bytes], Any] = orjson.loads
+except ImportError:
+    loads = json.loads
+
+# Результаты PreRouter.classify
+DROP = "drop"
+COMMAND = "command"
+PROCESS = "process"
+# Превышен лимит чата (см. flood_control.py): обновление отбрасывается,
+# а FLOOD_WARNING — еще и с одним предупреждением в ответе вебхука
+LIMITED = "limited"
+FLOOD_WARNING = "flood_warning"
+
+
+def parse_command(text: str, entities: list, bot_username: Optional[str]) -> Optional[tuple[str, list[str]]]:
+    """
+    Выделяет команду и аргументы так же, как это делает CommandHandler.
+
+    `entities` — список троек (type, offset, length). Возвращает None,
+    если сообщение не начинается с команды или команда адресована другому боту.
+    """
+    if not entities:
+        return None
+    entity_type, offset, length = entities[0]
+    if entity_type != "bot_command" or offset != 0:
+        return None
+
+    command, _, username = text[1:length].partition("@")
+    if username and (not bot_username or username.lower() != bot_username.lower()):
+        return None
+    return command.lower(), text.split()[1:]
+
+
+class PreRouter:
+    """
+    Предварительная маршрутизация по сырому телу вебхука.
+
+    Смотрит на тип обновления и текст прямо в разобранном dict и отбрасывает
+    обновления, которые не обработает ни один обработчик из setup_bot, еще до
+    дорогого Update.de_json. Известные команды затем вызываются напрямую,
+    минуя перебор обработчиков в Application.process_update.
+
+    С `flood` каждое обновление, которое примет обработчик, проходит еще и
+    поканальный лимит: флуд одного чата отсекается до разбора, БД и ответов.
+    """
+
+    def __init__(
+        self,
+        application: Application,
+        update_types: tuple[str, ...],
+        bot_username: Optional[str],
+        flood: Optional[FloodControl] = None,
+    ):
+        self._application = application
+        self._update_types = update_types
+        self.bot_username = bot_username
+        self._flood = flood
+        self._commands: dict[str, Callable] = {}
+        self._has_text_handler = False
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                if isinstance(handler, CommandHandler):
+                    for command in handler.commands:
+                        self._commands.setdefault(command, handler.callback)
+                elif isinstance(handler, MessageHandler):
+                    self._has_text_handler = True
+
+        self.dropped = 0
+        self.direct = 0
+        self.fallback = 0
+
+    def classify(self, data: dict) -> str:
+        """Решает по сырому dict: DROP, COMMAND (известная команда), PROCESS, LIMITED или FLOOD_WARNING."""
+        message = None
+        for update_type in self._update_types:
+            message = data.get(update_type)
+            if message is not None:
+                break
+        text = message.get("text") if message else None
+        if not text:
+            self.dropped += 1
+            return DROP
+
+        if not text.startswith("/"):
+            if self._has_text_handler:
+                return self._admit(message, TEXT_KEY, PROCESS)
+            self.dropped += 1
+            return DROP
+
+        entities = [(e.get("type"), e.get("offset"), e.get("length")) for e in message.get("entities", ())[:1]]
+        parsed = parse_command(text, entities, self.bot_username)
+        if parsed is None or parsed[0] not in self._commands:
+            # Неизвестная или чужая команда: ни один обработчик ее не примет
+            self.dropped += 1
+            return DROP
+        return self._admit(message, parsed[0], COMMAND)
+
+    def _admit(self, message: dict, key: str, result: str) -> str:
+        chat_id = message.get("chat", {}).get("id")
+        if self._flood is None or chat_id is None:
+            return result
+        decision = self._flood.admit(chat_id, key)
+        if decision == ALLOW:
+            return result
+        return FLOOD_WARNING if decision == WARN else LIMITED
+
+    def flood_warning(self, data: dict) -> dict:
+        """Тело ответа вебхука с предупреждением о флуде для чата этого обновления."""
+        for update_type in self._update_types:
+            message = data.get(update_type)
+            if message is not None:
+                return {"method": "sendMessage", "chat_id": message["chat"]["id"], "text": WARNING_TEXT}
+        raise ValueError("в обновлении нет сообщения")
+
+    async def process(self, update: Update) -> None:
+        """Вызывает обработчик команды напрямую или передает обновление в Application."""
+        message = update.message
+        parsed = None
+        if message and message.text and message.entities:
+            entity = message.entities[0]
+            parsed = parse_command(message.text, [(entity.type, entity.offset, entity.length)], self.bot_username)
+
+        callback = self._commands.get(parsed[0]) if parsed else None
+        if callback is None:
+            self.fallback += 1
+            COMMANDS_TOTAL.labels("text").inc()
+            set_handler("application")
+            with observe_stage("handler"):
+                await self._application.process_update(update)
+            return
+
+        self.direct += 1
+        COMMANDS_TOTAL.labels(parsed[0]).inc()
+        set_handler(callback.__name__)
+        context = self._application.context_types.context.from_update(update, self._application)
+        context.args = parsed[1]
+        try:
+            with observe_stage("handler"):
+                await callback(update, context)
+        except Exception as exc:
+            COMMAND_ERRORS_TOTAL.labels(parsed[0]).inc()
+            await self._application.process_error(update=update, error=exc)
+
+    def stats(self) -> dict:
+        stats = {"dropped": self.dropped, "direct": self.direct, "fallback": self.fallback}
+        if self._flood:
+            stats["flood_control"] = self._flood.stats()
+        return stats
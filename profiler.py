@@ -0,0 +1,215 @@
+import contextvars
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+# Обновление, которое обрабатывается в текущей задаче (см. SlowUpdateLog)
+_current_trace: contextvars.ContextVar[Optional["UpdateTrace"]] = contextvars.ContextVar("update_trace", default=None)
+
+
+class ProfilerBusy(Exception):
+    """Профилировщик этого воркера уже запущен другим запросом."""
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профилировщик стеков Python для одного воркера.
+
+    Отдельный поток каждые `interval` секунд снимает стеки потоков через
+    sys._current_frames и считает одинаковые стеки. Процесс не трассируется:
+    сэмпл стоит ~70 мкс на поток event loop (~200 мкс на все потоки), то есть
+    около процента CPU при 100 Гц, и включать его можно под боевой нагрузкой.
+    Стек event loop показывает выполняемую сейчас корутину (Update.de_json,
+    обработчик, разбор ответа БД или Bot API); ожидание в select — простой цикла.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+
+    def run(self, seconds: float, interval: float = 0.01, thread_id: Optional[int] = None) -> tuple[dict[str, int], int]:
+        """
+        Сэмплирует `seconds` секунд (блокирует, запускать в отдельном потоке).
+
+        `thread_id` — только этот поток (обычно поток event loop), иначе все,
+        кроме самого профилировщика. Возвращает {свернутый стек: число сэмплов}
+        и число сэмплов. Бросает ProfilerBusy, если профилирование уже идет.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            self.runs += 1
+            return self._sample(seconds, interval, thread_id)
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def _sample(seconds: float, interval: float, thread_id: Optional[int]) -> tuple[dict[str, int], int]:
+        own = threading.get_ident()
+        labels: dict[Any, str] = {}
+        stacks: dict[str, int] = {}
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (thread_id is not None and ident != thread_id):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = f"{os.path.basename(code.co_filename)}:{code.co_qualname}".replace(" ", "_")
+                    stack.append(label)
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)).replace(" ", "_"))
+                key = ";".join(reversed(stack))
+                stacks[key] = stacks.get(key, 0) + 1
+            samples += 1
+            time.sleep(interval)
+        return stacks, samples
+
+
+def collapse(stacks: dict[str, int]) -> str:
+    """Формат flamegraph.pl / speedscope / inferno: «кадр;кадр;кадр число» на строку."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items(), key=lambda item: -item[1]))
+
+
+class UpdateTrace:
+    """Этапы одного обновления от приема до конца обработки."""
+
+    __slots__ = ("bot_id", "raw", "update", "started", "handed_off", "stages", "handler")
+
+    def __init__(self, bot_id: Optional[str], raw: Any):
+        self.bot_id = bot_id
+        self.raw = raw
+        self.update = None
+        self.started = time.perf_counter()
+        self.handed_off: Optional[float] = None
+        self.stages: dict[str, float] = {}
+        self.handler: Optional[str] = None
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Добавляет длительность этапа к обновлению текущей задачи, если оно отслеживается."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.stages[stage] = trace.stages.get(stage, 0.0) + seconds
+
+
+def set_handler(name: str) -> None:
+    """Запоминает обработчик обновления текущей задачи."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.handler = name
+
+
+class SlowUpdateLog:
+    """
+    Кольцевой буфер медленных обновлений воркера: последние `size` обновлений,
+    обработка которых заняла от `threshold` секунд.
+
+    begin открывает трассу в задаче приема (вебхук, getUpdates), этапы
+    observe_stage суммируются в нее; handoff передает трассу вместе с Update
+    в обработку — в той же задаче или в воркере UpdateQueue, — а wrap(process)
+    закрывает ее. Этап wait — ожидание очереди или блокировки чата.
+    Сохраняются сырое обновление, время этапов и имя обработчика.
+    """
+
+    def __init__(self, threshold: float = 1.0, size: int = 100, max_pending: int = 10000):
+        self._threshold = threshold
+        self._records: deque = deque(maxlen=size)
+        # id(Update) -> трасса между handoff и началом обработки
+        self._pending: dict[int, UpdateTrace] = {}
+        self._max_pending = max_pending
+        self.enabled = size > 0
+        self.observed = 0
+        self.captured = 0
+
+    def begin(self, bot_id: Optional[str], raw: Any) -> None:
+        """Начинает трассу обновления в текущей задаче; `raw` — тело (bytes или dict)."""
+        if self.enabled:
+            _current_trace.set(UpdateTrace(bot_id, raw))
+
+    def handoff(self, update: Any) -> None:
+        """Связывает трассу текущей задачи с разобранным Update, который уходит в dispatch."""
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        trace.update = update
+        trace.handed_off = time.perf_counter()
+        if len(self._pending) >= self._max_pending:
+            # Трассы, до обработки которых дело так и не дошло (ошибка приема)
+            del self._pending[next(iter(self._pending))]
+        self._pending[id(update)] = trace
+
+    def discard(self, update: Any) -> None:
+        """Обновление не будет обработано (дубль, очередь переполнена)."""
+        self._pending.pop(id(update), None)
+
+    def wrap(self, process: Callable[[Any], Awaitable[None]]) -> Callable[[Any], Awaitable[None]]:
+        """Оборачивает обработку: замеряет ее и сохраняет медленные обновления."""
+        if not self.enabled:
+            return process
+
+        async def traced(update: Any) -> None:
+            trace = self._pending.pop(id(update), None)
+            if trace is None:
+                # Повтор из журнала: прием был еще в прошлом запуске
+                trace = UpdateTrace(None, None)
+                trace.update = update
+            else:
+                trace.stages["wait"] = time.perf_counter() - trace.handed_off
+            token = _current_trace.set(trace)
+            error = None
+            try:
+                await process(update)
+            except Exception as e:
+                error = repr(e)
+                raise
+            finally:
+                _current_trace.reset(token)
+                self._finish(trace, error)
+
+        return traced
+
+    def _finish(self, trace: UpdateTrace, error: Optional[str]) -> None:
+        self.observed += 1
+        total = time.perf_counter() - trace.started
+        if total < self._threshold:
+            return
+        self.captured += 1
+        raw = trace.raw
+        if isinstance(raw, (bytes, bytearray)):
+            raw = json.loads(raw)
+        elif raw is None:
+            raw = trace.update.to_dict()
+        self._records.append({
+            "at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "bot_id": trace.bot_id,
+            "update_id": getattr(trace.update, "update_id", None),
+            "handler": trace.handler,
+            "total_ms": round(total * 1000, 2),
+            "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in trace.stages.items()},
+            "error": error,
+            "update": raw,
+        })
+
+    def records(self) -> list[dict]:
+        """Сохраненные медленные обновления, новые сначала."""
+        return list(reversed(self._records))
+
+    def stats(self) -> dict:
+        return {
+            "threshold_ms": round(self._threshold * 1000, 2),
+            "observed": self.observed,
+            "captured": self.captured,
+            "buffered": len(self._records),
+            "pending": len(self._pending),
+        }
@@ -0,0 +1,165 @@
+import fcntl
+import mmap
+import os
+import struct
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class LocalGenerations:
+    """Поколения чатов в памяти процесса: инвалидация видна только этому воркеру."""
+
+    def __init__(self):
+        self._generations: dict[int, int] = {}
+
+    async def get(self, chat_id: int) -> int:
+        return self._generations.get(chat_id, 0)
+
+    async def bump(self, chat_id: int) -> None:
+        self._generations[chat_id] = self._generations.get(chat_id, 0) + 1
+
+
+class SharedFileGenerations:
+    """
+    Локальная замена общего бэкенда: счетчики поколений в mmap-файле,
+    общем для всех gunicorn-воркеров на одном хосте.
+
+    Чат отображается на один из `slots` 8-байтовых счетчиков. Коллизия
+    лишь сбрасывает чужой кэш раньше времени, устаревших данных она не дает.
+    """
+
+    _FORMAT = "<Q"
+
+    def __init__(self, path: str, slots: int = 65536):
+        self._slots = slots
+        size = slots * 8
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    def _offset(self, chat_id: int) -> int:
+        return (chat_id % self._slots) * 8
+
+    async def get(self, chat_id: int) -> int:
+        return struct.unpack_from(self._FORMAT, self._map, self._offset(chat_id))[0]
+
+    async def bump(self, chat_id: int) -> None:
+        offset = self._offset(chat_id)
+        # Блокировка файла, чтобы одновременные /save из разных воркеров не потеряли инкремент
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 8, offset)
+        try:
+            value = struct.unpack_from(self._FORMAT, self._map, offset)[0]
+            struct.pack_into(self._FORMAT, self._map, offset, value + 1)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 8, offset)
+
+
+class RedisGenerations:
+    """Поколения чатов в Redis: инвалидация доходит до воркеров на всех хостах."""
+
+    def __init__(self, url: str, prefix: str = "fetch_cache_gen:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("Для FETCH_CACHE_BACKEND=redis установите пакет redis.")
+        self._redis = redis.from_url(url)
+        self._prefix = prefix
+
+    async def get(self, chat_id: int) -> int:
+        value = await self._redis.get(f"{self._prefix}{chat_id}")
+        return int(value or 0)
+
+    async def bump(self, chat_id: int) -> None:
+        await self._redis.incr(f"{self._prefix}{chat_id}")
+
+
+def make_generations(backend: str, shm_path: str = "", redis_url: str = ""):
+    """Создает хранилище поколений по имени бэкенда: local, shm или redis."""
+    if backend == "local":
+        return LocalGenerations()
+    if backend == "shm":
+        return SharedFileGenerations(shm_path)
+    if backend == "redis":
+        return RedisGenerations(redis_url)
+    raise ValueError(f"Неизвестный бэкенд кэша: {backend}")
+
+
+class RecordCache:
+    """
+    Read-through LRU+TTL кэш страниц /fetch, ключ — (chat_id, страница).
+
+    Каждая запись помнит поколение своего чата. /save увеличивает поколение,
+    и все закэшированные страницы чата во всех воркерах, разделяющих
+    хранилище поколений, перестают считаться актуальными.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 30.0, generations=None):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._generations = generations or LocalGenerations()
+        # (chat_id, page_key) -> (expires_at, generation, value)
+        self._entries: OrderedDict = OrderedDict()
+        self._chat_keys: dict[int, set] = {}
+
+        # Счетчики
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    async def get_or_load(self, chat_id: int, page_key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Возвращает страницу из кэша или загружает ее через `loader`."""
+        # Поколение читается до загрузки: если /save закоммитится во время
+        # запроса, запись получит старое поколение и сразу устареет.
+        generation = await self._generations.get(chat_id)
+        key = (chat_id, page_key)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, entry_generation, value = entry
+            if entry_generation == generation and expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self._remove(key)
+
+        self.misses += 1
+        value = await loader()
+        self._store(key, generation, value)
+        return value
+
+    def _store(self, key: tuple, generation: int, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self._ttl, generation, value)
+        self._entries.move_to_end(key)
+        self._chat_keys.setdefault(key[0], set()).add(key)
+        while len(self._entries) > self._max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: tuple) -> None:
+        self._entries.pop(key, None)
+        keys = self._chat_keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._chat_keys[key[0]]
+
+    async def invalidate(self, chat_id: int) -> None:
+        """Сбрасывает страницы чата локально и во всех воркерах с общим хранилищем."""
+        await self._generations.bump(chat_id)
+        for key in list(self._chat_keys.get(chat_id, ())):
+            self._remove(key)
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self._max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,123 @@
+import datetime
+from typing import Optional
+
+# Сколько записей /fetch возвращает по умолчанию и максимум за одну страницу
+FETCH_DEFAULT_LIMIT = 5
+FETCH_MAX_LIMIT = 50
+
+# Результатов /search на страницу и самое глубокое смещение: дальше ранжированный
+# поиск листать незачем, а глубокий OFFSET перестает быть дешевым
+SEARCH_PAGE_SIZE = 5
+SEARCH_MAX_OFFSET = 200
+
+# Колонки user_data, которые заполняет /save
+SAVE_COLUMNS = ("chat_id", "username", "data_text")
+
+# Запросы ниже общие для PostgreSQL и SQLite (см. storage.py)
+
+# Индекс под постраничную выборку /fetch внутри одного чата.
+# id DESC (а не ASC) позволяет обслужить ORDER BY created_at DESC, id DESC
+# одним проходом индекса без сортировки.
+CREATE_FETCH_INDEX_QUERY = """
+CREATE INDEX IF NOT EXISTS user_data_chat_created_idx
+ON user_data (chat_id, created_at DESC, id DESC);
+"""
+
+# Длинные тексты лежат в text_blobs (см. text_blobs.py): запись несет сжатый blob,
+# а текст восстанавливает record_text. У коротких текстов blob_data равен NULL.
+RECORD_BLOB_JOIN = "LEFT JOIN text_blobs AS b ON b.hash = d.blob_hash"
+
+FIRST_PAGE_QUERY = f"""
+SELECT d.id, d.data_text, d.created_at, b.codec AS blob_codec, b.data AS blob_data
+FROM user_data AS d {RECORD_BLOB_JOIN}
+WHERE d.chat_id = :chat_id
+ORDER BY d.created_at DESC, d.id DESC
+LIMIT :limit;
+"""
+
+# Keyset-пагинация: продолжаем строго после последней показанной (created_at, id)
+NEXT_PAGE_QUERY = f"""
+SELECT d.id, d.data_text, d.created_at, b.codec AS blob_codec, b.data AS blob_data
+FROM user_data AS d {RECORD_BLOB_JOIN}
+WHERE d.chat_id = :chat_id AND (d.created_at, d.id) < (:created_at, :id)
+ORDER BY d.created_at DESC, d.id DESC
+LIMIT :limit;
+"""
+
+# Выгрузка /export: все записи чата от старых к новым порциями по тому же индексу
+# (проход индекса в обратную сторону), keyset-курсор — как у /fetch
+EXPORT_FIRST_QUERY = f"""
+SELECT d.id, d.username, d.data_text, d.created_at, b.codec AS blob_codec, b.data AS blob_data
+FROM user_data AS d {RECORD_BLOB_JOIN}
+WHERE d.chat_id = :chat_id
+ORDER BY d.created_at, d.id
+LIMIT :limit;
+"""
+
+EXPORT_NEXT_QUERY = f"""
+SELECT d.id, d.username, d.data_text, d.created_at, b.codec AS blob_codec, b.data AS blob_data
+FROM user_data AS d {RECORD_BLOB_JOIN}
+WHERE d.chat_id = :chat_id AND (d.created_at, d.id) > (:created_at, :id)
+ORDER BY d.created_at, d.id
+LIMIT :limit;
+"""
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+# id в user_data — BIGINT; больший id в курсор попасть не может
+_MAX_RECORD_ID = 2**63 - 1
+
+
+def encode_cursor(created_at: datetime.datetime, record_id: int) -> str:
+    """Курсор вида <микросекунды от эпохи>_<id> для команды /fetch."""
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=datetime.timezone.utc)
+    micros = (created_at - _EPOCH) // datetime.timedelta(microseconds=1)
+    return f"{micros}_{record_id}"
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    """Разбирает курсор из encode_cursor. Бросает ValueError на мусоре."""
+    micros, _, record_id = cursor.partition("_")
+    record_id = int(record_id)
+    if not 0 < record_id <= _MAX_RECORD_ID:
+        raise ValueError("id курсора вне диапазона")
+    try:
+        created_at = _EPOCH + datetime.timedelta(microseconds=int(micros))
+    except OverflowError:
+        # timedelta/datetime не вмещают такое время — для пользователя это тот же мусор
+        raise ValueError("время курсора вне диапазона") from None
+    return created_at, record_id
+
+
+def parse_fetch_args(args: list[str]) -> tuple[int, Optional[str]]:
+    """Разбирает аргументы /fetch [n] [курсор]. Бросает ValueError на неверном вводе."""
+    limit = FETCH_DEFAULT_LIMIT
+    cursor = None
+    if args:
+        limit = int(args[0])
+        if not 1 <= limit <= FETCH_MAX_LIMIT:
+            raise ValueError(f"n должно быть от 1 до {FETCH_MAX_LIMIT}")
+    if len(args) > 1:
+        decode_cursor(args[1])
+        cursor = args[1]
+    return limit, cursor
+
+
+def parse_search_args(args: list[str]) -> tuple[int, str]:
+    """
+    Разбирает аргументы /search [+смещение] <запрос>. Бросает ValueError на неверном вводе.
+
+    Поиск ранжирует результаты, а не упорядочивает их по времени, поэтому
+    следующая страница задается смещением, а не курсором, как у /fetch.
+    """
+    offset = 0
+    if args and args[0].startswith("+") and args[0][1:].isdigit():
+        offset = int(args[0][1:])
+        args = args[1:]
+        if offset > SEARCH_MAX_OFFSET:
+            raise ValueError(f"смещение не больше {SEARCH_MAX_OFFSET}")
+    query = " ".join(args).strip()
+    if not query:
+        raise ValueError("пустой запрос")
+    return offset, query
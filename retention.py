@@ -0,0 +1,180 @@
+import asyncio
+import datetime
+import fcntl
+import gzip
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Optional
+
+from storage import Storage, add_months, month_start
+
+ARCHIVE_SUFFIX = ".jsonl.gz"
+
+
+def _write_lines(archive, rows: list[dict]) -> None:
+    for row in rows:
+        archive.write(json.dumps({**row, "created_at": row["created_at"].isoformat()}, ensure_ascii=False))
+        archive.write("\n")
+
+
+def _read_chat(path: Path, chat_id: int) -> list[dict]:
+    """Строки одного чата из архивного файла."""
+    rows = []
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        for line in archive:
+            row = json.loads(line)
+            if row["chat_id"] == chat_id:
+                row["created_at"] = datetime.datetime.fromisoformat(row["created_at"])
+                rows.append(row)
+    return rows
+
+
+class RetentionJob:
+    """
+    Фоновое обслуживание секций user_data.
+
+    Раз в `interval` секунд создает месячные секции на `months_ahead` месяцев
+    вперед и, если `retention_months` > 0, выгружает месяцы старше этого срока
+    в `directory` файлами JSONL + gzip, после чего удаляет их из базы. Файл
+    пишется под временным именем и переименовывается только целиком, а строки
+    удаляются только после этого: прерванный запуск просто повторится.
+    Воркеры одного хоста выгружают по очереди (fcntl-блокировка в каталоге).
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        directory: str,
+        retention_months: int = 0,
+        months_ahead: int = 2,
+        interval: float = 3600.0,
+        chunk_rows: int = 5000,
+    ):
+        self._storage = storage
+        self.directory = Path(directory)
+        self._retention_months = retention_months
+        self._months_ahead = months_ahead
+        self._interval = interval
+        self._chunk_rows = chunk_rows
+        self._task: Optional[asyncio.Task] = None
+
+        # Метрики
+        self.runs = 0
+        self.archived_units = 0
+        self.archived_rows = 0
+        self.restored_rows = 0
+        self.collected_blobs = 0
+        self.last_error: Optional[str] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.last_error = str(e)
+                logging.error(f"❌ Ошибка обслуживания секций user_data: {e}", exc_info=True)
+            await asyncio.sleep(self._interval)
+
+    def _try_lock(self) -> Optional[int]:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.directory / ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    async def run_once(self) -> list[str]:
+        """Один проход: секции вперед и выгрузка устаревших месяцев. Возвращает выгруженные единицы."""
+        self.runs += 1
+        created = await self._storage.ensure_partitions(self._months_ahead)
+        if created:
+            logging.info(f"Созданы секции user_data: {', '.join(created)}")
+        if self._retention_months <= 0:
+            return []
+
+        fd = await asyncio.to_thread(self._try_lock)
+        if fd is None:
+            return []  # выгрузкой уже занят другой воркер
+        try:
+            cutoff = add_months(month_start(datetime.datetime.now(datetime.timezone.utc)), -self._retention_months)
+            units = await self._storage.archive_units(cutoff)
+            for unit in units:
+                await self._archive(unit)
+            if units:
+                # Blob'ы, на которые ссылались только выгруженные записи, больше не нужны
+                self.collected_blobs += await self._storage.collect_blobs()
+            return units
+        finally:
+            os.close(fd)
+
+    async def _archive(self, unit: str) -> None:
+        await self._storage.detach_unit(unit)
+
+        stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        # Метка времени в имени: повторная выгрузка того же месяца не перезапишет прежний файл
+        path = self.directory / f"{unit}-{stamp}{ARCHIVE_SUFFIX}"
+        temporary = path.with_name(path.name + ".tmp")
+
+        archive = await asyncio.to_thread(gzip.open, temporary, "wt", encoding="utf-8")
+        rows_written = 0
+        try:
+            after_id = 0
+            while True:
+                rows = await self._storage.read_unit(unit, after_id, self._chunk_rows)
+                if not rows:
+                    break
+                await asyncio.to_thread(_write_lines, archive, rows)
+                rows_written += len(rows)
+                after_id = rows[-1]["id"]
+        finally:
+            await asyncio.to_thread(archive.close)
+
+        await asyncio.to_thread(self._publish, temporary, path)
+        await self._storage.drop_unit(unit)
+
+        self.archived_units += 1
+        self.archived_rows += rows_written
+        logging.info(f"🗄️ {unit}: {rows_written} строк выгружено в {path}")
+
+    @staticmethod
+    def _publish(temporary: Path, path: Path) -> None:
+        with open(temporary, "rb") as archive:
+            os.fsync(archive.fileno())
+        os.replace(temporary, path)
+
+    async def restore(self, chat_id: int) -> int:
+        """Возвращает в базу все архивные строки чата. Повторный вызов ничего не дублирует."""
+        restored = 0
+        for path in sorted(self.directory.glob(f"*{ARCHIVE_SUFFIX}")):
+            rows = await asyncio.to_thread(_read_chat, path, chat_id)
+            for start in range(0, len(rows), self._chunk_rows):
+                restored += await self._storage.restore_records(rows[start:start + self._chunk_rows])
+        self.restored_rows += restored
+        return restored
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "retention_months": self._retention_months,
+            "archived_units": self.archived_units,
+            "archived_rows": self.archived_rows,
+            "restored_rows": self.restored_rows,
+            "collected_blobs": self.collected_blobs,
+            "last_error": self.last_error,
+        }
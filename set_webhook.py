@@ -1,3 +1,4 @@
+import argparse
 import os
 import requests
 import json
@@ -7,73 +8,129 @@ from dotenv import load_dotenv
 # Загрузка переменных окружения из файла .env
 load_dotenv()
 
+# Токены, типы обновлений и емкость воркеров берутся из той же конфигурации, что у бота
+# (config.py, а не bot_app: импорт бота создал бы хранилище, клиент Bot API и ботов)
+import config as settings
+from bots import bot_id_of, webhook_max_connections, webhook_secret
+
 # --- КОНФИГУРАЦИЯ ИЗ ОКРУЖЕНИЯ ---
 # Используем PUBLIC_URL, который может быть ngrok, доменным именем или IP
 PUBLIC_URL = os.getenv("PUBLIC_URL")
-BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Число воркеров gunicorn (его же gunicorn читает из WEB_CONCURRENCY)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "4"))
 
 # Проверяем наличие всех необходимых переменных
-if not BOT_TOKEN or not PUBLIC_URL:
-    print("❌ Ошибка: Убедитесь, что TELEGRAM_BOT_TOKEN и PUBLIC_URL установлены в .env.")
+if not settings.BOT_TOKENS or not PUBLIC_URL:
+    print("❌ Ошибка: Убедитесь, что TELEGRAM_BOT_TOKEN (или TELEGRAM_BOT_TOKENS) и PUBLIC_URL установлены в .env.")
     sys.exit(1)
+# ---
 
-# Полный URL, который Telegram будет вызывать (ваш хост + путь в FastAPI)
-WEBHOOK_PATH = "/webhook"
-WEBHOOK_URL = f"{PUBLIC_URL}{WEBHOOK_PATH}"
 
-# API URL для Telegram
-TELEGRAM_API = f"https://api.telegram.org/bot{BOT_TOKEN}"
-# ---
+def webhook_config(token: str, max_connections: int) -> dict:
+    """Параметры setWebhook бота: у каждого свой путь /webhook/{bot_id} и свой secret_token."""
+    config = {
+        "url": f"{PUBLIC_URL}/webhook/{bot_id_of(token)}",
+        "max_connections": max_connections,
+        # Остальные типы обновлений бот все равно отбросил бы: Telegram их не пришлет
+        "allowed_updates": list(settings.HANDLED_UPDATE_TYPES),
+    }
+    secret = webhook_secret(token, settings.WEBHOOK_SECRET)
+    if secret:
+        config["secret_token"] = secret
+    return config
 
-def get_webhook_info():
-    """Проверяет текущий статус вебхука."""
-    print("✨ Проверяю текущий вебхук...")
+
+def call_api(token: str, method: str, params: dict = None):
+    """Вызов метода Bot API; None при сетевой ошибке."""
     try:
-        response = requests.get(f"{TELEGRAM_API}/getWebhookInfo")
-        response.raise_for_status()
-        info = response.json()
-        print(json.dumps(info, indent=4, ensure_ascii=False))
-        return info
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Ошибка при получении информации о вебхуке: {e}")
+        response = requests.post(f"{settings.TELEGRAM_API_BASE_URL}{token}/{method}", json=params or {})
+        return response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"❌ Ошибка запроса {method}: {e}")
         return None
 
-def set_new_webhook():
-    """Устанавливает новый вебхук."""
-    print(f"\n🚀 Устанавливаю новый вебхук на: {WEBHOOK_URL}")
-    try:
-        # Устанавливаем новый вебхук
-        response = requests.post(f"{TELEGRAM_API}/setWebhook", data={'url': WEBHOOK_URL})
-        response.raise_for_status()
-        result = response.json()
 
-        if result.get("ok"):
-            print("✅ Успех! Вебхук успешно установлен.")
-        else:
-            print(f"❌ Ошибка установки вебхука: {result.get('description')}")
-        print(json.dumps(result, indent=4, ensure_ascii=False))
+def get_webhook_info(token: str):
+    """Проверяет текущий статус вебхука."""
+    print(f"✨ Проверяю текущий вебхук бота {bot_id_of(token)}...")
+    info = call_api(token, "getWebhookInfo")
+    if info:
+        print(json.dumps(info, indent=4, ensure_ascii=False))
+    return info
+
+
+def is_current(info, config: dict) -> bool:
+    """Совпадает ли установленный вебхук с нужным (secret_token getWebhookInfo не показывает)."""
+    if not info or not info.get("ok"):
+        return False
+    current = info.get("result", {})
+    return (
+        current.get("url") == config["url"]
+        and current.get("max_connections") == config["max_connections"]
+        # Пустой allowed_updates в ответе означает «все типы»
+        and sorted(current.get("allowed_updates") or []) == sorted(config["allowed_updates"])
+    )
+
+
+def set_new_webhook(token: str, config: dict, drop_pending_updates: bool) -> bool:
+    """Устанавливает новый вебхук."""
+    print(f"\n🚀 Устанавливаю новый вебхук на: {config['url']} (max_connections={config['max_connections']})")
+    result = call_api(token, "setWebhook", {**config, "drop_pending_updates": drop_pending_updates})
+    if not result:
+        return False
+    if result.get("ok"):
+        print("✅ Успех! Вебхук успешно установлен.")
+    else:
+        print(f"❌ Ошибка установки вебхука: {result.get('description')}")
+    print(json.dumps(result, indent=4, ensure_ascii=False))
+    return bool(result.get("ok"))
 
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Критическая ошибка при установке вебхука: {e}")
 
 def main():
-    """Основная функция, управляющая процессом установки вебхука."""
+    """Основная функция, управляющая установкой вебхуков всех ботов."""
+    parser = argparse.ArgumentParser(description="Установка вебхуков ботов")
+    parser.add_argument("--info", action="store_true", help="только показать текущие вебхуки")
+    parser.add_argument("--delete", action="store_true", help="удалить вебхуки (для перехода на polling)")
+    parser.add_argument("--drop-pending-updates", action="store_true", help="отбросить накопившиеся обновления")
+    parser.add_argument("--force", action="store_true", help="переустановить, даже если вебхук актуален")
+    parser.add_argument("--max-connections", type=int, help="вместо значения, рассчитанного по емкости воркеров")
+    args = parser.parse_args()
+
+    max_connections = args.max_connections or webhook_max_connections(
+        WEB_CONCURRENCY,
+        settings.UPDATE_MODE,
+        settings.UPDATE_WORKERS,
+        settings.DB_POOL_MAX_SIZE,
+        bots=len(settings.BOT_TOKENS),
+    )
 
-    info = get_webhook_info()
+    failed = False
+    for token in settings.BOT_TOKENS:
+        info = get_webhook_info(token)
+        if args.info:
+            continue
+        if args.delete:
+            result = call_api(token, "deleteWebhook", {"drop_pending_updates": args.drop_pending_updates})
+            print(json.dumps(result, indent=4, ensure_ascii=False))
+            failed |= not (result and result.get("ok"))
+            continue
 
-    if info and info.get("ok"):
-        current_url = info.get("result", {}).get("url")
-        if current_url == WEBHOOK_URL:
+        config = webhook_config(token, max_connections)
+        if is_current(info, config) and not args.force and not args.drop_pending_updates:
             print("\n✅ Вебхук уже установлен и актуален!")
             # Проверяем, есть ли ожидающие обновления
             pending_count = info.get("result", {}).get("pending_update_count", 0)
             if pending_count > 0:
                 print(f"❗ **ВНИМАНИЕ:** Имеется {pending_count} ожидающих обновлений.")
                 print("Запустите или проверьте ваш сервер (Gunicorn), чтобы обработать их.")
-            return
+            continue
+
+        # Если вебхук не установлен, или параметры изменились, устанавливаем новый
+        failed |= not set_new_webhook(token, config, args.drop_pending_updates)
+
+    if failed:
+        sys.exit(1)
 
-    # Если вебхук не установлен, или URL изменился, устанавливаем новый
-    set_new_webhook()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,959 @@
+import asyncio
+import datetime
+import logging
+import math
+import os
+import queue
+import re
+import sqlite3
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from databases import Database, DatabaseURL
+
+from migrations import CREATE_MIGRATIONS_TABLE, MIGRATIONS
+from records import (
+    EXPORT_FIRST_QUERY, EXPORT_NEXT_QUERY, FIRST_PAGE_QUERY, NEXT_PAGE_QUERY, RECORD_BLOB_JOIN, SAVE_COLUMNS, decode_cursor, encode_cursor,
+)
+from text_blobs import decompress_text, pack_rows, record_text
+
+# Ключ pg_advisory_xact_lock: воркеры gunicorn применяют миграции по очереди
+MIGRATION_LOCK_KEY = 7_316_001
+
+INSERT_QUERY = "INSERT INTO user_data (chat_id, username, data_text) VALUES (:chat_id, :username, :data_text)"
+SQLITE_INSERT_QUERY = (
+    "INSERT INTO user_data (chat_id, username, data_text, created_at) "
+    "VALUES (:chat_id, :username, :data_text, :created_at)"
+)
+
+# Длинные тексты (text_blobs.pack_rows): строка ссылается на blob, а сам blob
+# вставляется один раз на хеш. Его tsvector в PostgreSQL строится здесь же
+BLOB_SAVE_COLUMNS = SAVE_COLUMNS + ("blob_hash",)
+SQLITE_BLOB_ROW_INSERT_QUERY = (
+    "INSERT INTO user_data (chat_id, username, data_text, blob_hash, created_at) "
+    "VALUES (:chat_id, :username, :data_text, :blob_hash, :created_at)"
+)
+PG_BLOB_INSERT_QUERY = """
+INSERT INTO text_blobs (hash, codec, size, data, search_vector)
+VALUES (:hash, :codec, :size, :data, to_tsvector('simple', :text))
+ON CONFLICT (hash) DO NOTHING;
+"""
+SQLITE_BLOB_INSERT_QUERY = "INSERT OR IGNORE INTO text_blobs (hash, codec, size, data) VALUES (:hash, :codec, :size, :data)"
+
+# websearch_to_tsquery понимает любой пользовательский ввод ("фразы", or, -исключения)
+# и не падает на синтаксисе, а btree_gin-индекс (chat_id, search_vector) сужает поиск до чата.
+# Тексты из text_blobs ищутся по tsvector blob'а и сужаются до чата индексом user_data_blob_idx
+PG_SEARCH_QUERY = """
+SELECT d.id, d.data_text, d.created_at, NULL::smallint AS blob_codec, NULL::bytea AS blob_data,
+       ts_rank(d.search_vector, query) AS rank
+FROM user_data AS d, websearch_to_tsquery('simple', :query) AS query
+WHERE d.chat_id = :chat_id AND d.search_vector @@ query
+UNION ALL
+SELECT d.id, d.data_text, d.created_at, b.codec, b.data, ts_rank(b.search_vector, query)
+FROM text_blobs AS b JOIN user_data AS d ON d.blob_hash = b.hash, websearch_to_tsquery('simple', :query) AS query
+WHERE d.chat_id = :chat_id AND b.search_vector @@ query
+ORDER BY rank DESC, id DESC
+LIMIT :limit OFFSET :offset;
+"""
+
+# Встроенный bm25() FTS5 на каждый запрос считает частоту слова по всей таблице:
+# для частого слова это ~100 мс на миллионе строк. Поэтому FTS5 только находит
+# самые новые совпадения в чате (пересечение индексов в порядке rowid), не больше
+# `search_candidates` из каждого индекса, а ранжирует их search_rank по статистике
+# самих кандидатов — одной на записи из user_data_fts и из text_blobs_fts.
+SQLITE_SEARCH_QUERY = """
+SELECT d.id, d.data_text, d.created_at, NULL AS blob_codec, NULL AS blob_data
+FROM user_data_fts JOIN user_data AS d ON d.id = user_data_fts.rowid
+WHERE user_data_fts MATCH :match
+ORDER BY user_data_fts.rowid DESC
+LIMIT :candidates;
+"""
+
+# Тексты из text_blobs: один индекс на все копии blob'а, чат проверяется по user_data_blob_idx
+SQLITE_BLOB_SEARCH_QUERY = """
+SELECT d.id, d.data_text, d.created_at, b.codec AS blob_codec, b.data AS blob_data
+FROM text_blobs_fts JOIN text_blobs AS b ON b.rowid = text_blobs_fts.rowid
+JOIN user_data AS d ON d.blob_hash = b.hash
+WHERE text_blobs_fts MATCH :match AND d.chat_id = :chat_id
+ORDER BY d.id DESC
+LIMIT :candidates;
+"""
+# Кандидатов поиска по умолчанию: с запасом больше, чем нужно, чтобы пролистать
+# до SEARCH_MAX_OFFSET, но ранжирование остается дешевым (см. bench_search)
+SEARCH_CANDIDATES = 500
+
+_WORD = re.compile(r"\w+")
+
+# --- Месячные секции и архив ---
+# Единица архивирования — месяц: секция user_data_pYYYY_MM в PostgreSQL или строки
+# этого месяца в SQLite. user_data_legacy — бывшая несекционированная таблица.
+ARCHIVE_COLUMNS = ("id", "chat_id", "username", "data_text", "created_at")
+_UNIT_NAME = re.compile(r"^user_data_(p\d{4}_\d{2}|legacy)$")
+
+# Верхние границы секций берутся из текста FOR VALUES ... TO ('...'); у DEFAULT ее нет
+PARTITION_BOUNDS_QUERY = r"""
+SELECT c.relname AS name,
+       substring(pg_get_expr(c.relpartbound, c.oid) FROM 'TO \(''([^'']+)''\)')::timestamptz AS upper_bound
+FROM pg_inherits AS i JOIN pg_class AS c ON c.oid = i.inhrelid
+WHERE i.inhparent = 'user_data'::regclass;
+"""
+
+# Отсоединенные, но еще не выгруженные секции (прошлый запуск прервался)
+DETACHED_PARTITIONS_QUERY = r"""
+SELECT c.relname AS name FROM pg_class AS c
+WHERE c.relkind = 'r' AND pg_table_is_visible(c.oid)
+  AND c.relname ~ '^user_data_(p\d{4}_\d{2}|legacy)$'
+  AND NOT EXISTS (SELECT 1 FROM pg_inherits AS i WHERE i.inhrelid = c.oid)
+ORDER BY c.relname;
+"""
+
+RESTORE_COLUMNS = ", ".join(ARCHIVE_COLUMNS)
+# Выгрузка в архив читает тексты из text_blobs: восстановленные строки хранят их в data_text
+READ_UNIT_COLUMNS = ", ".join(f"d.{column}" for column in ARCHIVE_COLUMNS) + ", b.codec AS blob_codec, b.data AS blob_data"
+# Поля записей export_page
+EXPORT_COLUMNS = ("id", "username", "data_text", "created_at")
+
+# Восстановленные строки остаются в рабочем наборе: в PostgreSQL они лежат в
+# user_data_default, которую архив не трогает, в SQLite помечены в user_data_restored
+SQLITE_NOT_RESTORED = "id NOT IN (SELECT id FROM user_data_restored)"
+
+
+def month_start(value: datetime.datetime) -> datetime.datetime:
+    """Начало месяца в UTC."""
+    value = value.astimezone(datetime.timezone.utc)
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(value: datetime.datetime, months: int) -> datetime.datetime:
+    """Сдвигает начало месяца на `months` месяцев."""
+    index = value.year * 12 + value.month - 1 + months
+    return value.replace(year=index // 12, month=index % 12 + 1)
+
+
+def unit_name(month: datetime.datetime) -> str:
+    return f"user_data_p{month:%Y_%m}"
+
+
+def _unit_month(unit: str) -> datetime.datetime:
+    year, month = unit.removeprefix("user_data_p").split("_")
+    return datetime.datetime(int(year), int(month), 1, tzinfo=datetime.timezone.utc)
+
+
+def _check_unit(unit: str) -> str:
+    """Имя секции подставляется в SQL как идентификатор: пропускаем только известный формат."""
+    if not _UNIT_NAME.match(unit):
+        raise ValueError(f"Неизвестная единица архива: {unit}")
+    return unit
+
+
+def build_multirow_insert(rows: list[dict], columns: tuple = SAVE_COLUMNS) -> tuple[str, dict]:
+    """Собирает один INSERT ... VALUES (...), (...) для пачки строк."""
+    placeholders = []
+    values = {}
+    for i, row in enumerate(rows):
+        placeholders.append("(" + ", ".join(f":{column}_{i}" for column in columns) + ")")
+        for column in columns:
+            values[f"{column}_{i}"] = row[column]
+
+    query = f"INSERT INTO user_data ({', '.join(columns)}) VALUES " + ", ".join(placeholders)
+    return query, values
+
+
+def fts5_match(chat_id: int, query: str) -> Optional[str]:
+    """
+    Строит выражение MATCH для user_data_fts: токен чата И все слова запроса.
+
+    Слова берутся в кавычки, поэтому операторы FTS5 во вводе пользователя
+    не интерпретируются. None, если в запросе нет ни одного слова.
+    """
+    words = fts5_words(query)
+    if words is None:
+        return None
+    chat_token = "c" + str(chat_id).replace("-", "n")
+    return f'chat : "{chat_token}" AND {words}'
+
+
+def fts5_words(query: str) -> Optional[str]:
+    """Все слова запроса в колонке data_text (для text_blobs_fts, где чата нет)."""
+    words = _WORD.findall(query)
+    if not words:
+        return None
+    return "data_text : (" + " ".join(f'"{word}"' for word in words) + ")"
+
+
+def _search_tokens(text: str) -> list[str]:
+    """Слова в нормализации токенизатора unicode61 remove_diacritics: без регистра и диакритики."""
+    folded = text.casefold()
+    decomposed = unicodedata.normalize("NFKD", folded)
+    if len(decomposed) != len(folded):
+        # Есть составные символы (й, ё, é...): отбрасываем диакритику как unicode61
+        folded = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _WORD.findall(folded)
+
+
+def search_rank(records: list, query: str, k1: float = 1.2, b: float = 0.75) -> list:
+    """
+    Сортирует найденные записи по BM25, лучшие сначала (при равенстве — новые).
+
+    Частоты слов и средняя длина считаются по самим кандидатам, то есть по
+    совпадениям внутри чата, а не по всей таблице.
+    """
+    terms = set(_search_tokens(query))
+    docs = [_search_tokens(record["data_text"]) for record in records]
+    if not docs:
+        return records
+    avg_length = sum(len(doc) for doc in docs) / len(docs) or 1.0
+    # Частоты только слов запроса: остальные слова кандидата на оценку не влияют
+    counts = [{term: doc.count(term) for term in terms if term in doc} for doc in docs]
+    idf = {}
+    for term in terms:
+        frequency = sum(1 for doc_counts in counts if term in doc_counts)
+        idf[term] = math.log((len(docs) - frequency + 0.5) / (frequency + 0.5) + 1)
+
+    def score(doc: list[str], doc_counts: dict) -> float:
+        norm = k1 * (1 - b + b * len(doc) / avg_length)
+        return sum(idf[term] * tf * (k1 + 1) / (tf + norm) for term, tf in doc_counts.items())
+
+    scores = [score(doc, doc_counts) for doc, doc_counts in zip(docs, counts)]
+    order = sorted(range(len(records)), key=lambda i: (scores[i], records[i]["id"]), reverse=True)
+    return [records[i] for i in order]
+
+
+def _page(records: list[dict], limit: int) -> tuple[list, Optional[str]]:
+    """Отрезает лишнюю (limit + 1)-ю запись и строит по ней курсор следующей страницы."""
+    if len(records) <= limit:
+        return records, None
+    records = records[:limit]
+    last = records[-1]
+    return records, encode_cursor(last["created_at"], last["id"])
+
+
+def _search_page(records: list[dict], limit: int, offset: int) -> tuple[list, Optional[int]]:
+    """Как _page, но следующая страница поиска задается смещением."""
+    if len(records) <= limit:
+        return records, None
+    return records[:limit], offset + limit
+
+
+class Storage:
+    """
+    Асинхронное хранилище записей /save и /fetch.
+
+    Обработчики работают только с этим интерфейсом; реализации — PostgresStorage
+    и SQLiteStorage — разделяют схему и миграции из migrations.py.
+
+    `blob_min_bytes` > 0 включает хранение текстов от этого размера в text_blobs
+    (text_blobs.py). Чтение восстанавливает их прозрачно, в каком бы режиме
+    запись ни была сохранена.
+    """
+
+    dialect: str = ""
+    blob_min_bytes: int = 0
+    # Методы, которые обращаются к БД: их оборачивают метрики и нагрузочный тест
+    QUERY_METHODS = ("save_records", "fetch_page", "search", "export_page", "ping")
+
+    @property
+    def is_connected(self) -> bool:
+        raise NotImplementedError
+
+    async def connect(self) -> None:
+        raise NotImplementedError
+
+    async def disconnect(self) -> None:
+        raise NotImplementedError
+
+    async def ping(self) -> None:
+        """Самый дешевый запрос к БД (SELECT 1): проверка, что она отвечает."""
+        raise NotImplementedError
+
+    async def migrate(self) -> list[int]:
+        """Применяет недостающие миграции и возвращает их версии."""
+        applied = []
+        for version, name, statements in MIGRATIONS:
+            if await self._apply_migration(version, name, statements[self.dialect]):
+                logging.info(f"Применена миграция {version}: {name}")
+                applied.append(version)
+        return applied
+
+    async def _apply_migration(self, version: int, name: str, statements: list[str]) -> bool:
+        raise NotImplementedError
+
+    async def save_record(self, row: dict) -> None:
+        """Сохраняет одну запись /save."""
+        await self.save_records([row])
+
+    async def save_records(self, rows: list[dict]) -> None:
+        """Сохраняет пачку записей одной транзакцией."""
+        raise NotImplementedError
+
+    async def fetch_page(self, chat_id: int, limit: int, cursor: Optional[str] = None) -> tuple[list, Optional[str]]:
+        """
+        Возвращает страницу записей чата (новые сначала) и курсор следующей страницы.
+
+        Курсор равен None, если записей дальше нет.
+        """
+        raise NotImplementedError
+
+    async def search(self, chat_id: int, query: str, limit: int, offset: int = 0) -> tuple[list, Optional[int]]:
+        """
+        Полнотекстовый поиск по записям чата, лучшие совпадения сначала.
+
+        Возвращает страницу записей и смещение следующей страницы (None, если дальше пусто).
+        """
+        raise NotImplementedError
+
+    async def export_page(self, chat_id: int, limit: int, cursor: Optional[str] = None) -> tuple[list, Optional[str]]:
+        """
+        Порция выгрузки /export: записи чата с username, от старых к новым.
+
+        Курсор устроен как у fetch_page и равен None после последней порции.
+        """
+        raise NotImplementedError
+
+    async def ensure_partitions(self, months_ahead: int) -> list[str]:
+        """Создает месячные секции от текущего месяца на `months_ahead` вперед. Возвращает новые."""
+        return []
+
+    async def archive_units(self, before: datetime.datetime) -> list[str]:
+        """Единицы архива (месяцы), целиком лежащие раньше `before`, от старых к новым."""
+        raise NotImplementedError
+
+    async def detach_unit(self, unit: str) -> None:
+        """Выводит единицу из рабочего набора, не удаляя строки."""
+
+    async def read_unit(self, unit: str, after_id: int, limit: int) -> list[dict]:
+        """Очередная порция строк единицы по возрастанию id, начиная после `after_id`."""
+        raise NotImplementedError
+
+    async def drop_unit(self, unit: str) -> None:
+        """Удаляет строки единицы после того, как они записаны в архив."""
+        raise NotImplementedError
+
+    async def restore_records(self, rows: list[dict]) -> int:
+        """
+        Возвращает архивные строки с исходными id; уже существующие пропускаются.
+
+        Восстановленные строки больше не архивируются. Возвращает число вставленных.
+        """
+        raise NotImplementedError
+
+    async def collect_blobs(self) -> int:
+        """Удаляет blob'ы, на которые не ссылается ни одна запись (после drop_unit). Возвращает их число."""
+        raise NotImplementedError
+
+    def pool_stats(self) -> Optional[dict]:
+        """Состояние пула соединений для метрик или None, если пула нет."""
+        return None
+
+    def stats(self) -> dict:
+        return {"backend": self.dialect, "connected": self.is_connected}
+
+
+class PostgresStorage(Storage):
+    """
+    PostgreSQL через databases/asyncpg.
+
+    `copy=True` пишет пачки из нескольких строк через COPY вместо многострочного INSERT.
+    """
+
+    dialect = "postgresql"
+
+    def __init__(self, database: Database, copy: bool = False, blob_min_bytes: int = 0):
+        self._database = database
+        self._copy = copy
+        self.blob_min_bytes = blob_min_bytes
+
+    @property
+    def is_connected(self) -> bool:
+        return self._database.is_connected
+
+    async def connect(self) -> None:
+        await self._database.connect()
+        await self._database.execute(CREATE_MIGRATIONS_TABLE[self.dialect])
+
+    async def disconnect(self) -> None:
+        if self._database.is_connected:
+            await self._database.disconnect()
+
+    async def ping(self) -> None:
+        await self._database.fetch_val("SELECT 1")
+
+    async def _apply_migration(self, version: int, name: str, statements: list[str]) -> bool:
+        async with self._database.transaction():
+            await self._database.execute("SELECT pg_advisory_xact_lock(:key)", values={"key": MIGRATION_LOCK_KEY})
+            done = await self._database.fetch_val(
+                "SELECT 1 FROM schema_migrations WHERE version = :version", values={"version": version}
+            )
+            if done:
+                return False
+            for statement in statements:
+                await self._database.execute(statement)
+            await self._database.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (:version, :name)",
+                values={"version": version, "name": name},
+            )
+        return True
+
+    async def save_records(self, rows: list[dict]) -> None:
+        rows, blobs = pack_rows(rows, self.blob_min_bytes)
+        if not blobs:
+            await self._insert_rows(rows, SAVE_COLUMNS)
+            return
+        # Blob и ссылающиеся на него строки появляются вместе: collect_blobs не увидит blob без ссылок
+        async with self._database.transaction():
+            await self._database.execute_many(query=PG_BLOB_INSERT_QUERY, values=blobs)
+            await self._insert_rows(rows, BLOB_SAVE_COLUMNS)
+
+    async def _insert_rows(self, rows: list[dict], columns: tuple) -> None:
+        if len(rows) == 1 and columns == SAVE_COLUMNS:
+            await self._database.execute(query=INSERT_QUERY, values={c: rows[0][c] for c in SAVE_COLUMNS})
+        elif self._copy and len(rows) > 1:
+            # COPY доступен только для asyncpg: берем сырое соединение из пула
+            async with self._database.connection() as connection:
+                await connection.raw_connection.copy_records_to_table(
+                    "user_data",
+                    records=[tuple(row[column] for column in columns) for row in rows],
+                    columns=list(columns),
+                )
+        elif rows:
+            query, values = build_multirow_insert(rows, columns)
+            await self._database.execute(query=query, values=values)
+
+    async def fetch_page(self, chat_id: int, limit: int, cursor: Optional[str] = None) -> tuple[list, Optional[str]]:
+        values = {"chat_id": chat_id, "limit": limit + 1}
+        if cursor:
+            values["created_at"], values["id"] = decode_cursor(cursor)
+            rows = await self._database.fetch_all(query=NEXT_PAGE_QUERY, values=values)
+        else:
+            rows = await self._database.fetch_all(query=FIRST_PAGE_QUERY, values=values)
+
+        records = [{"id": row["id"], "data_text": record_text(row), "created_at": row["created_at"]} for row in rows]
+        return _page(records, limit)
+
+    async def search(self, chat_id: int, query: str, limit: int, offset: int = 0) -> tuple[list, Optional[int]]:
+        rows = await self._database.fetch_all(
+            query=PG_SEARCH_QUERY,
+            values={"chat_id": chat_id, "query": query, "limit": limit + 1, "offset": offset},
+        )
+        records = [{"id": row["id"], "data_text": record_text(row), "created_at": row["created_at"]} for row in rows]
+        return _search_page(records, limit, offset)
+
+    async def export_page(self, chat_id: int, limit: int, cursor: Optional[str] = None) -> tuple[list, Optional[str]]:
+        values = {"chat_id": chat_id, "limit": limit + 1}
+        if cursor:
+            values["created_at"], values["id"] = decode_cursor(cursor)
+            rows = await self._database.fetch_all(query=EXPORT_NEXT_QUERY, values=values)
+        else:
+            rows = await self._database.fetch_all(query=EXPORT_FIRST_QUERY, values=values)
+
+        return _page([{**{column: row[column] for column in EXPORT_COLUMNS}, "data_text": record_text(row)} for row in rows], limit)
+
+    async def ensure_partitions(self, months_ahead: int) -> list[str]:
+        current = month_start(datetime.datetime.now(datetime.timezone.utc))
+        created = []
+        async with self._database.transaction():
+            # Воркеры создают секции по очереди, иначе CREATE TABLE столкнутся
+            await self._database.execute("SELECT pg_advisory_xact_lock(:key)", values={"key": MIGRATION_LOCK_KEY})
+            bounds = [row["upper_bound"] for row in await self._database.fetch_all(PARTITION_BOUNDS_QUERY)]
+            covered = max((bound for bound in bounds if bound is not None), default=None)
+            start = max(covered, current) if covered else current
+            while start < add_months(current, months_ahead + 1):
+                stop = add_months(start, 1)
+                name = unit_name(start)
+                await self._database.execute(
+                    f"CREATE TABLE {name} PARTITION OF user_data "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{stop.isoformat()}')"
+                )
+                created.append(name)
+                start = stop
+        return created
+
+    async def archive_units(self, before: datetime.datetime) -> list[str]:
+        detached = [row["name"] for row in await self._database.fetch_all(DETACHED_PARTITIONS_QUERY)]
+        attached = sorted(
+            (row["upper_bound"], row["name"])
+            for row in await self._database.fetch_all(PARTITION_BOUNDS_QUERY)
+            if row["upper_bound"] is not None and row["upper_bound"] <= before
+        )
+        return detached + [name for _, name in attached]
+
+    async def detach_unit(self, unit: str) -> None:
+        _check_unit(unit)
+        attached = await self._database.fetch_val(
+            "SELECT 1 FROM pg_inherits WHERE inhrelid = CAST(:unit AS regclass)", values={"unit": unit}
+        )
+        if attached:
+            await self._database.execute(f"ALTER TABLE user_data DETACH PARTITION {unit}")
+
+    async def read_unit(self, unit: str, after_id: int, limit: int) -> list[dict]:
+        rows = await self._database.fetch_all(
+            f"SELECT {READ_UNIT_COLUMNS} FROM {_check_unit(unit)} AS d {RECORD_BLOB_JOIN} "
+            "WHERE d.id > :after_id ORDER BY d.id LIMIT :limit",
+            values={"after_id": after_id, "limit": limit},
+        )
+        return [{**{column: row[column] for column in ARCHIVE_COLUMNS}, "data_text": record_text(row)} for row in rows]
+
+    async def drop_unit(self, unit: str) -> None:
+        await self._database.execute(f"DROP TABLE IF EXISTS {_check_unit(unit)}")
+
+    async def restore_records(self, rows: list[dict]) -> int:
+        if not rows:
+            return 0
+        placeholders = []
+        values = {}
+        for i, row in enumerate(rows):
+            placeholders.append("(" + ", ".join(f":{column}_{i}" for column in ARCHIVE_COLUMNS) + ")")
+            for column in ARCHIVE_COLUMNS:
+                values[f"{column}_{i}"] = row[column]
+        # Старые месяцы уже без секций: такие строки ложатся в user_data_default
+        inserted = await self._database.fetch_all(
+            f"INSERT INTO user_data ({RESTORE_COLUMNS}) VALUES " + ", ".join(placeholders)
+            + " ON CONFLICT DO NOTHING RETURNING id",
+            values=values,
+        )
+        return len(inserted)
+
+    async def collect_blobs(self) -> int:
+        async with self._database.transaction():
+            # Ждет транзакции save_records, уже вставившие blob, и не пускает новые до коммита:
+            # DELETE увидит все ссылки, а новая ссылка не появится на удаляемый blob
+            await self._database.execute("LOCK TABLE text_blobs IN SHARE ROW EXCLUSIVE MODE")
+            deleted = await self._database.fetch_all(
+                "DELETE FROM text_blobs AS b WHERE NOT EXISTS "
+                "(SELECT 1 FROM user_data AS d WHERE d.blob_hash = b.hash) RETURNING b.hash"
+            )
+        return len(deleted)
+
+    def pool_stats(self) -> Optional[dict]:
+        """Состояние пула asyncpg этого воркера."""
+        pool = getattr(getattr(self._database, "_backend", None), "_pool", None)
+        if pool is None or not hasattr(pool, "get_size"):
+            return None
+        size = pool.get_size()
+        idle = pool.get_idle_size()
+        return {"size": size, "idle": idle, "busy": size - idle, "max": pool.get_max_size()}
+
+
+def _sqlite_timestamp(value: datetime.datetime) -> str:
+    """Время в формате колонки created_at SQLite: UTC с микросекундами."""
+    return value.astimezone(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def _sqlite_datetime(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc)
+
+
+def _sqlite_record(row: sqlite3.Row) -> dict:
+    return {"id": row["id"], "data_text": record_text(row), "created_at": _sqlite_datetime(row["created_at"])}
+
+
+def _settle(future: asyncio.Future, result: Any, error: Optional[BaseException]) -> None:
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class SQLiteStorage(Storage):
+    """
+    Однонодовый SQLite в режиме WAL.
+
+    Все записи идут через один поток-писатель: он забирает из очереди все
+    накопившиеся задания (до `batch_max`) и выполняет их одной транзакцией
+    с одним fsync на коммит. Каждое задание обернуто в SAVEPOINT, так что
+    ошибка одного не откатывает соседей по пачке. Чтения выполняет пул из
+    `readers` потоков со своими соединениями: WAL не блокирует их записью.
+    Запросы — постоянные строки с параметрами, поэтому sqlite3 готовит
+    каждый один раз на соединение и дальше берет из кэша выражений.
+    """
+
+    dialect = "sqlite"
+
+    def __init__(
+        self,
+        path: str,
+        readers: int = 4,
+        batch_max: int = 256,
+        busy_timeout: float = 5.0,
+        blob_min_bytes: int = 0,
+        search_candidates: int = SEARCH_CANDIDATES,
+    ):
+        self.path = path
+        self.blob_min_bytes = blob_min_bytes
+        self.search_candidates = search_candidates
+        self._readers = readers
+        self._batch_max = batch_max
+        self._busy_timeout = busy_timeout
+        self._writes: queue.SimpleQueue = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._local = threading.local()
+        self._reader_connections: list[sqlite3.Connection] = []
+        self._reader_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # Метрики писателя
+        self.commits = 0
+        self.jobs = 0
+        self.failed_jobs = 0
+        self.max_batch = 0
+
+    @property
+    def is_connected(self) -> bool:
+        return self._writer is not None and self._writer.is_alive()
+
+    def _open(self, readonly: bool = False) -> sqlite3.Connection:
+        # isolation_level=None: транзакциями управляет сам писатель (BEGIN IMMEDIATE ... COMMIT)
+        connection = sqlite3.connect(
+            self.path,
+            timeout=self._busy_timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        # В WAL synchronous=NORMAL не теряет согласованность, а fsync остается только на чекпоинтах
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA temp_store=MEMORY")
+        connection.execute("PRAGMA cache_size=-32768")
+        if readonly:
+            connection.execute("PRAGMA query_only=1")
+        return connection
+
+    async def connect(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        # Первое соединение создает файл и включает WAL до старта потоков
+        await asyncio.to_thread(lambda: self._open().close())
+        self._writer = threading.Thread(target=self._writer_loop, name="sqlite-writer", daemon=True)
+        self._writer.start()
+        self._executor = ThreadPoolExecutor(max_workers=self._readers, thread_name_prefix="sqlite-reader")
+        await self._write(lambda connection: connection.execute(CREATE_MIGRATIONS_TABLE[self.dialect]).close())
+
+    async def disconnect(self) -> None:
+        if self._writer is None:
+            return
+        self._writes.put(None)
+        await asyncio.to_thread(self._writer.join)
+        self._writer = None
+        self._executor.shutdown(wait=True)
+        with self._reader_lock:
+            for connection in self._reader_connections:
+                connection.close()
+            self._reader_connections.clear()
+        self._local = threading.local()
+
+    async def ping(self) -> None:
+        await self._read("SELECT 1", {})
+
+    # --- Поток-писатель ---
+
+    async def _write(self, job: Callable[[sqlite3.Connection], Any]) -> Any:
+        """
+        Ставит задание в очередь писателя и ждет коммита его пачки.
+
+        Задание не должно возвращать курсор: его финализация в потоке event loop
+        гоняется с писателем за одно и то же подготовленное выражение.
+        """
+        if not self.is_connected:
+            raise ConnectionError("SQLite хранилище не подключено")
+        future = self._loop.create_future()
+        self._writes.put((job, future))
+        return await future
+
+    def _writer_loop(self) -> None:
+        connection = self._open()
+        try:
+            while True:
+                item = self._writes.get()
+                if item is None:
+                    return
+                batch = [item]
+                stop = False
+                while len(batch) < self._batch_max:
+                    try:
+                        item = self._writes.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+
+                for future, result, error in self._commit(connection, batch):
+                    self._loop.call_soon_threadsafe(_settle, future, result, error)
+                if stop:
+                    return
+        finally:
+            connection.close()
+
+    def _commit(self, connection: sqlite3.Connection, batch: list) -> list[tuple]:
+        """Выполняет пачку заданий одной транзакцией, каждое — в своем SAVEPOINT."""
+        outcomes = []
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            for job, future in batch:
+                connection.execute("SAVEPOINT job")
+                try:
+                    result = job(connection)
+                except Exception as e:
+                    connection.execute("ROLLBACK TO job")
+                    outcomes.append((future, None, e))
+                else:
+                    outcomes.append((future, result, None))
+                connection.execute("RELEASE job")
+            connection.execute("COMMIT")
+        except Exception as e:
+            logging.error(f"❌ Ошибка коммита пачки SQLite из {len(batch)} заданий: {e}", exc_info=True)
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            self.failed_jobs += len(batch)
+            return [(future, None, e) for _, future in batch]
+
+        self.commits += 1
+        self.jobs += len(batch)
+        self.failed_jobs += sum(1 for _, _, error in outcomes if error is not None)
+        self.max_batch = max(self.max_batch, len(batch))
+        return outcomes
+
+    # --- Чтение ---
+
+    def _reader(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._open(readonly=True)
+            self._local.connection = connection
+            with self._reader_lock:
+                self._reader_connections.append(connection)
+        return connection
+
+    async def _read(self, query: str, values: dict, transform: Callable[[list], Any] = list) -> Any:
+        """Выполняет запрос в потоке-читателе; `transform` обрабатывает строки там же, не занимая event loop."""
+        return await self._run_reader(lambda connection: transform(connection.execute(query, values).fetchall()))
+
+    async def _run_reader(self, job: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Выполняет `job` с соединением потока-читателя."""
+        if not self.is_connected:
+            raise ConnectionError("SQLite хранилище не подключено")
+        return await self._loop.run_in_executor(self._executor, lambda: job(self._reader()))
+
+    # --- Интерфейс Storage ---
+
+    async def _apply_migration(self, version: int, name: str, statements: list[str]) -> bool:
+        def job(connection: sqlite3.Connection) -> bool:
+            done = connection.execute("SELECT 1 FROM schema_migrations WHERE version = ?", (version,)).fetchone()
+            if done:
+                return False
+            for statement in statements:
+                connection.execute(statement)
+            connection.execute("INSERT INTO schema_migrations (version, name) VALUES (?, ?)", (version, name))
+            return True
+
+        return await self._write(job)
+
+    async def save_records(self, rows: list[dict]) -> None:
+        created_at = _sqlite_timestamp(datetime.datetime.now(datetime.timezone.utc))
+        rows, blobs = pack_rows(rows, self.blob_min_bytes)
+        if not blobs:
+            params = [{**{c: row[c] for c in SAVE_COLUMNS}, "created_at": created_at} for row in rows]
+            await self._write(lambda connection: connection.executemany(SQLITE_INSERT_QUERY, params).close())
+            return
+
+        params = [{**{c: row[c] for c in BLOB_SAVE_COLUMNS}, "created_at": created_at} for row in rows]
+
+        def job(connection: sqlite3.Connection) -> None:
+            for blob in blobs:
+                cursor = connection.execute(SQLITE_BLOB_INSERT_QUERY, blob)
+                if cursor.rowcount:
+                    # Новый blob: индексируем его текст один раз на все копии
+                    connection.execute(
+                        "INSERT INTO text_blobs_fts (rowid, data_text) VALUES (?, ?)", (cursor.lastrowid, blob["text"])
+                    ).close()
+                cursor.close()
+            connection.executemany(SQLITE_BLOB_ROW_INSERT_QUERY, params).close()
+
+        await self._write(job)
+
+    async def fetch_page(self, chat_id: int, limit: int, cursor: Optional[str] = None) -> tuple[list, Optional[str]]:
+        values = {"chat_id": chat_id, "limit": limit + 1}
+        if cursor:
+            created_at, values["id"] = decode_cursor(cursor)
+            values["created_at"] = _sqlite_timestamp(created_at)
+            rows = await self._read(NEXT_PAGE_QUERY, values)
+        else:
+            rows = await self._read(FIRST_PAGE_QUERY, values)
+
+        return _page([_sqlite_record(row) for row in rows], limit)
+
+    async def search(self, chat_id: int, query: str, limit: int, offset: int = 0) -> tuple[list, Optional[int]]:
+        match = fts5_match(chat_id, query)
+        if match is None:
+            return [], None
+
+        def job(connection: sqlite3.Connection) -> list:
+            candidates = self.search_candidates
+            rows = connection.execute(SQLITE_SEARCH_QUERY, {"match": match, "candidates": candidates}).fetchall()
+            rows += connection.execute(
+                SQLITE_BLOB_SEARCH_QUERY, {"match": fts5_words(query), "chat_id": chat_id, "candidates": candidates}
+            ).fetchall()
+            records = [{"id": row["id"], "data_text": record_text(row), "created_at": row["created_at"]} for row in rows]
+            # Время разбираем только у показываемой страницы, а не у всех кандидатов
+            return [
+                {**record, "created_at": _sqlite_datetime(record["created_at"])}
+                for record in search_rank(records, query)[offset:offset + limit + 1]
+            ]
+
+        return _search_page(await self._run_reader(job), limit, offset)
+
+    async def export_page(self, chat_id: int, limit: int, cursor: Optional[str] = None) -> tuple[list, Optional[str]]:
+        values = {"chat_id": chat_id, "limit": limit + 1}
+        query = EXPORT_FIRST_QUERY
+        if cursor:
+            created_at, values["id"] = decode_cursor(cursor)
+            values["created_at"] = _sqlite_timestamp(created_at)
+            query = EXPORT_NEXT_QUERY
+        records = await self._read(
+            query, values, lambda rows: [{**_sqlite_record(row), "username": row["username"]} for row in rows]
+        )
+        return _page(records, limit)
+
+    async def archive_units(self, before: datetime.datetime) -> list[str]:
+        rows = await self._read(
+            "SELECT DISTINCT substr(created_at, 1, 7) AS month FROM user_data WHERE created_at < :before "
+            f"AND {SQLITE_NOT_RESTORED} ORDER BY month",
+            {"before": _sqlite_timestamp(month_start(before))},
+        )
+        return [f"user_data_p{row['month'].replace('-', '_')}" for row in rows]
+
+    def _unit_range(self, unit: str) -> dict:
+        month = _unit_month(_check_unit(unit))
+        return {"start": _sqlite_timestamp(month), "stop": _sqlite_timestamp(add_months(month, 1))}
+
+    async def read_unit(self, unit: str, after_id: int, limit: int) -> list[dict]:
+        rows = await self._read(
+            f"SELECT {READ_UNIT_COLUMNS} FROM user_data AS d {RECORD_BLOB_JOIN} "
+            f"WHERE d.created_at >= :start AND d.created_at < :stop AND {SQLITE_NOT_RESTORED} "
+            "AND d.id > :after_id ORDER BY d.id LIMIT :limit",
+            {**self._unit_range(unit), "after_id": after_id, "limit": limit},
+        )
+        return [{**_sqlite_record(row), "chat_id": row["chat_id"], "username": row["username"]} for row in rows]
+
+    async def drop_unit(self, unit: str, chunk_rows: int = 5000) -> None:
+        values = {**self._unit_range(unit), "limit": chunk_rows}
+
+        def job(connection: sqlite3.Connection) -> int:
+            return connection.execute(
+                "DELETE FROM user_data WHERE id IN (SELECT id FROM user_data "
+                f"WHERE created_at >= :start AND created_at < :stop AND {SQLITE_NOT_RESTORED} LIMIT :limit)",
+                values,
+            ).rowcount
+
+        # Порциями, чтобы не держать блокировку записи на весь месяц строк
+        while await self._write(job) == chunk_rows:
+            pass
+
+    async def restore_records(self, rows: list[dict]) -> int:
+        params = [
+            {**{c: row[c] for c in ARCHIVE_COLUMNS}, "created_at": _sqlite_timestamp(row["created_at"])}
+            for row in rows
+        ]
+
+        def job(connection: sqlite3.Connection) -> int:
+            inserted = connection.executemany(
+                f"INSERT OR IGNORE INTO user_data ({RESTORE_COLUMNS}) VALUES "
+                "(:id, :chat_id, :username, :data_text, :created_at)",
+                params,
+            ).rowcount
+            connection.executemany("INSERT OR IGNORE INTO user_data_restored (id) VALUES (:id)", params).close()
+            return inserted
+
+        return await self._write(job)
+
+    async def collect_blobs(self) -> int:
+        def job(connection: sqlite3.Connection) -> int:
+            # Записи пишет только этот поток: между проверкой и удалением ссылка не появится
+            orphans = connection.execute(
+                "SELECT b.rowid AS blob_id, b.codec, b.data FROM text_blobs AS b "
+                "WHERE NOT EXISTS (SELECT 1 FROM user_data AS d WHERE d.blob_hash = b.hash)"
+            ).fetchall()
+            for blob in orphans:
+                # Бесконтентный FTS5 удаляет строку по ее исходному тексту
+                connection.execute(
+                    "INSERT INTO text_blobs_fts (text_blobs_fts, rowid, data_text) VALUES ('delete', ?, ?)",
+                    (blob["blob_id"], decompress_text(blob["codec"], blob["data"])),
+                ).close()
+            connection.executemany("DELETE FROM text_blobs WHERE rowid = ?", [(blob["blob_id"],) for blob in orphans]).close()
+            return len(orphans)
+
+        return await self._write(job)
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "write_queue": self._writes.qsize(),
+            "commits": self.commits,
+            "jobs": self.jobs,
+            "failed_jobs": self.failed_jobs,
+            "max_batch": self.max_batch,
+            "avg_batch": round(self.jobs / self.commits, 1) if self.commits else None,
+        }
+
+
+def database_url_from_env() -> str:
+    """DATABASE_URL из окружения, иначе PostgreSQL сервиса db из docker-compose по POSTGRES_*."""
+    url = os.getenv("DATABASE_URL")
+    if url:
+        return url
+    user = os.getenv("POSTGRES_USER", "user")
+    password = os.getenv("POSTGRES_PASSWORD", "password")
+    name = os.getenv("POSTGRES_DB", "mydb")
+    # Используем имя сервиса 'db' из docker-compose для хоста
+    url = f"postgresql://{user}:{password}@db:5432/{name}"
+    logging.info(f"Используется DATABASE_URL по умолчанию: {url}")
+    return url
+
+
+def create_storage(
+    url: str,
+    save_method: str = "values",
+    sqlite_readers: int = 4,
+    sqlite_search_candidates: int = SEARCH_CANDIDATES,
+    blob_min_bytes: int = 0,
+    pool_min_size: int = 2,
+    pool_max_size: int = 10,
+    statement_cache_size: int = 100,
+    command_timeout: Optional[float] = None,
+) -> Storage:
+    """
+    Создает хранилище по DATABASE_URL: sqlite:///путь — SQLiteStorage, иначе PostgresStorage.
+
+    `save_method` — values (многострочный INSERT) или copy (COPY, только PostgreSQL).
+    `blob_min_bytes` — с какого размера текст хранится сжатым в text_blobs (0 — никогда).
+    `sqlite_search_candidates` — сколько самых новых совпадений каждого индекса FTS5
+    ранжирует /search в SQLite.
+    Параметры пула относятся к PostgreSQL и задаются на воркер: `statement_cache_size`
+    — кэш подготовленных выражений на соединение (0 — для pgbouncer в режиме
+    transaction), `command_timeout` — таймаут asyncpg на одну команду.
+    """
+    if save_method not in ("values", "copy"):
+        raise ValueError(f"Неизвестный метод записи пачки: {save_method}")
+    parsed = DatabaseURL(url)
+    if parsed.dialect == "sqlite":
+        return SQLiteStorage(
+            parsed.database,
+            readers=sqlite_readers,
+            blob_min_bytes=blob_min_bytes,
+            search_candidates=sqlite_search_candidates,
+        )
+    database = Database(
+        url,
+        min_size=pool_min_size,
+        max_size=pool_max_size,
+        statement_cache_size=statement_cache_size,
+        command_timeout=command_timeout,
+    )
+    return PostgresStorage(database, copy=save_method == "copy", blob_min_bytes=blob_min_bytes)
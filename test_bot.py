@@ -1,6 +1,10 @@
+import datetime
 import pytest
 from databases import Database
 
+from records import FETCH_DEFAULT_LIMIT, decode_cursor, encode_cursor, parse_fetch_args
+from storage import PostgresStorage
+
 # Убедитесь, что фикстуры из conftest.py доступны
 
 @pytest.mark.asyncio
@@ -67,3 +71,45 @@ async def test_fetch_limit_and_order(db_connection: Database):
     assert len(records) == 5
     assert records[0]['data_text'] == "Entry_6" # Ең соңғы жазба
     assert records[-1]['data_text'] == "Entry_2" # Соңынан бесінші жазба
+
+
+def test_fetch_cursor_roundtrip():
+    """Проверяет кодирование курсора /fetch и разбор аргументов."""
+    created_at = datetime.datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc)
+    cursor = encode_cursor(created_at, 42)
+
+    assert decode_cursor(cursor) == (created_at, 42)
+    assert parse_fetch_args([]) == (FETCH_DEFAULT_LIMIT, None)
+    assert parse_fetch_args(["3", cursor]) == (3, cursor)
+    with pytest.raises(ValueError):
+        parse_fetch_args(["0"])
+    with pytest.raises(ValueError):
+        parse_fetch_args(["5", "мусор"])
+    with pytest.raises(ValueError):
+        parse_fetch_args(["5", "99999999999999999999_1"])
+    with pytest.raises(ValueError):
+        parse_fetch_args(["5", f"1_{2**63}"])
+
+
+@pytest.mark.asyncio
+async def test_fetch_page_is_per_chat_and_keyset_paginated(db_connection: Database):
+    """
+    Проверяет, что /fetch видит только записи своего чата и листает их без пропусков.
+    """
+    storage = PostgresStorage(db_connection)
+    for i in range(1, 8):
+        await db_connection.execute(
+            "INSERT INTO user_data (chat_id, username, data_text) VALUES (7777, 'page_test', :text)",
+            values={"text": f"Entry_{i}"}
+        )
+    await db_connection.execute(
+        "INSERT INTO user_data (chat_id, username, data_text) VALUES (8888, 'other_chat', 'Чужая запись')"
+    )
+
+    first, cursor = await storage.fetch_page(7777, 3)
+    second, cursor = await storage.fetch_page(7777, 3, cursor)
+    third, cursor = await storage.fetch_page(7777, 3, cursor)
+
+    texts = [r['data_text'] for r in first + second + third]
+    assert texts == [f"Entry_{i}" for i in range(7, 0, -1)]
+    assert cursor is None
@@ -0,0 +1,30 @@
+import pytest
+
+from benchmarks.fake_bot_api import BOT_USER, FakeBotAPI
+from bot_identity import CachedIdentityBot
+
+
+@pytest.mark.asyncio
+async def test_identity_is_cached_per_token(tmp_path):
+    """Второй старт берет профиль бота из кэша; другой токен кэш не использует."""
+    api = FakeBotAPI()
+    base_url = await api.start(port=8098)
+    cache = str(tmp_path / "identity.json")
+
+    async def boot(token):
+        bot = CachedIdentityBot(token, base_url=base_url, identity_cache=cache)
+        await bot.initialize()
+        await bot.shutdown()
+        return bot
+
+    try:
+        first = await boot("1:first")
+        second = await boot("1:first")
+        other = await boot("2:other")
+    finally:
+        await api.stop()
+
+    assert not first.identity_from_cache
+    assert second.identity_from_cache and second.bot.username == BOT_USER["username"]
+    assert not other.identity_from_cache
+    assert api.calls["getMe"] == 2
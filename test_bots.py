@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+from bots import BotRuntime, load_tokens, per_bot_path, webhook_max_connections, webhook_secret
+
+
+def test_load_tokens_merges_and_dedups_by_bot_id(monkeypatch):
+    monkeypatch.setenv("TELEGRAM_BOT_TOKEN", "111:main")
+    monkeypatch.setenv("TELEGRAM_BOT_TOKENS", " 222:second, 111:main-revoked,,333:third")
+    assert load_tokens() == ["111:main", "222:second", "333:third"]
+
+    monkeypatch.delenv("TELEGRAM_BOT_TOKEN")
+    assert load_tokens() == ["222:second", "111:main-revoked", "333:third"]
+
+
+def test_per_bot_path():
+    assert per_bot_path("/tmp/identity.json", "42:abc") == "/tmp/identity.42.json"
+    assert per_bot_path("./polling_offset", "42:abc") == "polling_offset.42"
+
+
+def test_webhook_secret_is_per_bot_and_opt_in():
+    assert webhook_secret("1:a", "") is None
+    first, second = webhook_secret("1:a", "s3cret"), webhook_secret("2:b", "s3cret")
+    assert first != second
+    # Токен бота можно перевыпустить: секрет зависит только от id
+    assert webhook_secret("1:rotated", "s3cret") == first
+
+
+def test_webhook_max_connections():
+    # inline: ограничено соединениями БД всех воркеров
+    assert webhook_max_connections(4, "inline", 8, 10) == 40
+    # queue: ограничено задачами, разбирающими очередь, и делится между ботами
+    assert webhook_max_connections(4, "queue", 8, 10, bots=2) == 16
+    assert webhook_max_connections(16, "inline", 8, 20) == 100
+    assert webhook_max_connections(1, "queue", 1, 10, bots=4) == 1
+
+
+def test_verify_secret():
+    application = SimpleNamespace(bot=SimpleNamespace(token="7:abc"))
+    assert BotRuntime(application).verify_secret(None)
+    runtime = BotRuntime(application, secret_token="expected")
+    assert runtime.bot_id == "7"
+    assert runtime.verify_secret("expected")
+    assert not runtime.verify_secret("wrong")
+    assert not runtime.verify_secret(None)
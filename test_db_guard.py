@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from db_guard import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, DatabaseUnavailable, guard_storage, probe_while_open
+from write_buffer import SaveRetryQueue
+
+
+class FlakyStorage:
+    """Подмена Storage: пока down=True, запись висит дольше дедлайна или падает по сети."""
+
+    QUERY_METHODS = ("save_records", "ping")
+
+    def __init__(self):
+        self.down = False
+        self.hang = False
+        self.saved = []
+        self.pings = 0
+
+    async def save_records(self, rows):
+        if self.hang:
+            await asyncio.sleep(1)
+        if self.down:
+            raise ConnectionRefusedError("connection refused")
+        if any(row["data_text"] is None for row in rows):
+            raise ValueError("NOT NULL")
+        self.saved.extend(rows)
+
+    async def ping(self):
+        self.pings += 1
+        if self.down:
+            raise ConnectionRefusedError("connection refused")
+
+
+def row(text):
+    return {"chat_id": 1, "username": "u", "data_text": text}
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_fails_fast_and_recovers_through_probe():
+    storage = FlakyStorage()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    guard_storage(storage, breaker, timeout=0.02)
+
+    storage.hang = True
+    with pytest.raises(DatabaseUnavailable) as timeout:
+        await storage.save_records([row("a")])
+    assert timeout.value.maybe_applied
+    storage.hang, storage.down = False, True
+    with pytest.raises(DatabaseUnavailable) as refused:
+        await storage.save_records([row("b")])
+    assert not refused.value.maybe_applied
+    assert breaker.state == OPEN
+
+    # Разомкнутый автомат отвечает сразу, не обращаясь к БД
+    storage.down = False
+    with pytest.raises(DatabaseUnavailable):
+        await storage.save_records([row("c")])
+    assert storage.saved == [] and breaker.rejected == 1
+
+    # Ошибка данных — ответ БД, а не недоступность
+    await asyncio.sleep(0.06)
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    assert not breaker.allow()  # пока идет пробный запрос, остальные отклоняются
+    breaker.release_probe()
+    with pytest.raises(ValueError):
+        await storage.save_records([row(None)])
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_retry_queue_writes_saves_after_database_recovers():
+    storage = FlakyStorage()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    guard_storage(storage, breaker, timeout=0.5)
+    saved_batches = []
+
+    async def on_saved(rows):
+        saved_batches.append(rows)
+
+    retry = SaveRetryQueue(storage, breaker, max_rows=3, batch_rows=2, on_saved=on_saved)
+    retry.start()
+    storage.down = True
+    assert all(retry.add(row(f"r{i}")) for i in range(3))
+    assert not retry.add(row("лишняя"))
+
+    await asyncio.sleep(0.15)
+    assert storage.saved == [] and breaker.state == OPEN
+    storage.down = False
+    for _ in range(50):
+        if not retry.stats()["pending"]:
+            break
+        await asyncio.sleep(0.02)
+    await retry.close()
+
+    assert [r["data_text"] for r in storage.saved] == ["r0", "r1", "r2"]
+    assert sum(map(len, saved_batches)) == 3
+    assert retry.stats()["pending"] == 0 and retry.stats()["dropped"] == 1
+
+
+@pytest.mark.asyncio
+async def test_probe_closes_breaker_without_user_traffic():
+    """Разомкнутый автомат замыкается пробой, даже если запросов пользователей нет."""
+    storage = FlakyStorage()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    guard_storage(storage, breaker, timeout=0.5)
+    storage.down = True
+    with pytest.raises(DatabaseUnavailable):
+        await storage.save_records([row("a")])
+
+    probe = asyncio.create_task(probe_while_open(storage, breaker, interval=0.01))
+    try:
+        await asyncio.sleep(0.08)
+        assert breaker.state == OPEN and storage.pings >= 1  # проба была, БД еще лежит
+        storage.down = False
+        for _ in range(50):
+            if breaker.state == CLOSED:
+                break
+            await asyncio.sleep(0.01)
+        assert breaker.state == CLOSED
+        pings = storage.pings
+        await asyncio.sleep(0.05)
+        assert storage.pings == pings  # замкнутый автомат не пробуется
+    finally:
+        probe.cancel()
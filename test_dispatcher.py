@@ -0,0 +1,115 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from dispatcher import SharedUpdateIdWindow, UpdateIdWindow, UpdateDispatcher, DUPLICATE, PROCESSED, ACCEPTED, REJECTED
+from update_queue import UpdateQueue
+
+
+def make_update(update_id, chat_id=1):
+    return SimpleNamespace(update_id=update_id, effective_chat=SimpleNamespace(id=chat_id))
+
+
+def test_update_id_window_detects_duplicates():
+    """Проверяет окно недавних update_id."""
+    window = UpdateIdWindow(size=64)
+    assert not window.seen(100)
+    assert not window.seen(101)
+    assert window.seen(100)
+    # Идентификатор, пришедший не по порядку, но внутри окна
+    assert not window.seen(99)
+    assert window.seen(99)
+    # Сдвиг окна далеко вперед: старые id считаются виденными
+    assert not window.seen(1000)
+    assert window.seen(101)
+    assert not window.seen(999)
+
+    window.forget(1000)
+    assert not window.seen(1000)
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_drops_redelivered_updates():
+    """Повторная доставка одного update_id не обрабатывается дважды."""
+    processed = []
+
+    async def process(update):
+        processed.append(update.update_id)
+
+    dispatcher = UpdateDispatcher(process)
+    assert await dispatcher.dispatch(make_update(1)) == PROCESSED
+    assert await dispatcher.dispatch(make_update(1)) == DUPLICATE
+    assert processed == [1]
+
+
+@pytest.mark.asyncio
+async def test_rejected_update_is_not_marked_as_seen():
+    """Обновление, не принятое очередью, при повторной доставке обрабатывается."""
+    async def process(update):
+        pass
+
+    queue = UpdateQueue(process, maxsize=0, workers=1)
+    dispatcher = UpdateDispatcher(process, queue=queue)
+    assert await dispatcher.dispatch(make_update(5)) == REJECTED
+
+    queue._maxsize = 10
+    queue.start()
+    assert await dispatcher.dispatch(make_update(5)) == ACCEPTED
+    await queue.drain(timeout=5)
+
+
+@pytest.mark.asyncio
+async def test_inline_dispatch_serializes_one_chat():
+    """Без очереди обновления одного чата обрабатываются строго по порядку."""
+    order = []
+
+    async def process(update):
+        order.append(("start", update.update_id))
+        await asyncio.sleep(0.01)
+        order.append(("end", update.update_id))
+
+    dispatcher = UpdateDispatcher(process)
+    await asyncio.gather(*(dispatcher.dispatch(make_update(i)) for i in range(3)))
+
+    assert order == [(step, i) for i in range(3) for step in ("start", "end")]
+    assert dispatcher.stats()["active_chats"] == 0
+
+
+@pytest.mark.asyncio
+async def test_shared_window_drops_redelivery_to_another_worker(tmp_path):
+    """Повторная доставка, пришедшая в другой воркер, тоже дубль; повтор из журнала — нет."""
+    path = str(tmp_path / "updates.seen")
+    processed = []
+
+    async def process(update):
+        processed.append(update.update_id)
+
+    # Два воркера: у каждого свой диспетчер и свое отображение файла
+    first = UpdateDispatcher(process, window=SharedUpdateIdWindow(path, size=64))
+    second = UpdateDispatcher(process, window=SharedUpdateIdWindow(path, size=64))
+    assert await first.dispatch(make_update(10)) == PROCESSED
+    assert await second.dispatch(make_update(10)) == DUPLICATE
+    assert await second.dispatch(make_update(11)) == PROCESSED
+    assert await first.dispatch(make_update(11)) == DUPLICATE
+    assert await second.dispatch(make_update(10), replayed=True) == PROCESSED
+    assert processed == [10, 11, 10]
+
+    # Окно после долгого простоя очищается: update_id мог начаться заново
+    idle = SharedUpdateIdWindow(path, size=64, idle_reset=0)
+    assert not idle.seen(3)
+
+
+@pytest.mark.asyncio
+async def test_is_duplicate_checks_without_marking():
+    """Проверка до ограничения флуда не отмечает update_id: его отметит dispatch."""
+    async def process(update):
+        pass
+
+    dispatcher = UpdateDispatcher(process)
+    assert not dispatcher.is_duplicate(7)
+    assert not dispatcher.is_duplicate(None)
+    assert await dispatcher.dispatch(make_update(7)) == PROCESSED
+    assert dispatcher.is_duplicate(7)
+    assert not dispatcher.is_duplicate(8)
+    assert dispatcher.stats()["duplicates"] == 1
@@ -0,0 +1,57 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+from exporter import ChatExporter, parse_export_args
+
+
+def test_parse_export_args():
+    assert parse_export_args([]) == "csv"
+    assert parse_export_args(["JSONL"]) == "jsonl"
+    with pytest.raises(ValueError):
+        parse_export_args(["xml"])
+
+
+@pytest.mark.asyncio
+async def test_export_streams_all_rows_in_chunks_one_job_per_chat(sqlite_storage, tmp_path):
+    """Выгрузка читает чат порциями, пишет gzip по порядку и не запускается дважды для одного чата."""
+    await sqlite_storage.save_records(
+        [{"chat_id": 5, "username": "u", "data_text": f"строка {i}, с \"кавычками\"\nи переводом"} for i in range(25)]
+    )
+    await sqlite_storage.save_record({"chat_id": 6, "username": "u", "data_text": "чужая"})
+
+    exporter = ChatExporter(sqlite_storage, chunk_rows=10, directory=str(tmp_path))
+    delivered = asyncio.get_running_loop().create_future()
+
+    async def deliver(path, rows):
+        with gzip.open(path, "rt", encoding="utf-8", newline="") as export:
+            delivered.set_result((rows, export.read()))
+
+    async def on_error(error):
+        delivered.set_exception(error)
+
+    # Другой воркер с тем же каталогом
+    other = ChatExporter(sqlite_storage, chunk_rows=10, directory=str(tmp_path))
+
+    assert exporter.start(5, "csv", deliver, on_error)
+    assert not exporter.start(5, "jsonl", deliver, on_error)
+    assert not other.start(5, "jsonl", deliver, on_error)
+    rows, content = await delivered
+    while exporter.busy(5):
+        await asyncio.sleep(0.01)
+    assert other.start(5, "jsonl", deliver, on_error)
+    await other.stop()
+
+    records = list(csv.DictReader(io.StringIO(content)))
+    assert rows == 25
+    assert [r["data_text"] for r in records] == [f"строка {i}, с \"кавычками\"\nи переводом" for i in range(25)]
+    assert list(tmp_path.glob("export-*")) == []  # временный файл удален после отправки
+
+    path = tmp_path / "chat6.jsonl.gz"
+    assert await exporter.export(6, "jsonl", path) == 1
+    with gzip.open(path, "rt", encoding="utf-8") as export:
+        assert json.loads(export.readline())["data_text"] == "чужая"
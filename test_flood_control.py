@@ -0,0 +1,115 @@
+import pytest
+from telegram.ext import Application, CommandHandler, MessageHandler, filters
+
+from flood_control import ALLOW, LIMIT, TEXT_KEY, WARN, FloodControl, SharedFloodBuckets, parse_costs
+from pre_router import FLOOD_WARNING, LIMITED, PROCESS, PreRouter
+from test_pre_router import make_message
+
+
+def test_parse_costs():
+    assert parse_costs("fetch=3, /Search=2.5,,") == {"fetch": 3.0, "search": 2.5}
+    with pytest.raises(ValueError):
+        parse_costs("fetch=много")
+
+
+def test_burst_then_single_warning():
+    flood = FloodControl(rate=0.001, burst=3)
+
+    assert [flood.admit(1, TEXT_KEY) for _ in range(3)] == [ALLOW] * 3
+    assert [flood.admit(1, TEXT_KEY) for _ in range(3)] == [WARN, LIMIT, LIMIT]
+    # Соседний чат не страдает от чужого флуда
+    assert flood.admit(2, TEXT_KEY) == ALLOW
+
+    stats = flood.stats()
+    assert (stats["allowed"], stats["warned"], stats["limited"]) == (4, 1, 2)
+    assert stats["hits"] == {TEXT_KEY: 3}
+
+
+def test_costs_per_key():
+    flood = FloodControl(rate=0.001, burst=5, costs={"fetch": 3})
+
+    assert flood.admit(1, "fetch") == ALLOW
+    assert flood.admit(1, "fetch") == WARN
+    # Дешевые обновления проходят на остатке ведра
+    assert flood.admit(1, TEXT_KEY) == ALLOW
+    assert flood.admit(1, TEXT_KEY) == ALLOW
+
+    with pytest.raises(ValueError):
+        FloodControl(burst=2, costs={"export": 5})
+
+
+def test_warning_again_only_after_bucket_refills(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("flood_control.time.monotonic", lambda: now[0])
+    monkeypatch.setattr("outbound.time.monotonic", lambda: now[0])
+    flood = FloodControl(rate=1, burst=3)
+
+    assert [flood.admit(1, TEXT_KEY) for _ in range(4)] == [ALLOW, ALLOW, ALLOW, WARN]
+    # Один пополненный токен не открывает новый эпизод: без повторного предупреждения
+    now[0] += 1
+    assert [flood.admit(1, TEXT_KEY) for _ in range(2)] == [ALLOW, LIMIT]
+    now[0] += 10
+    assert [flood.admit(1, TEXT_KEY) for _ in range(4)] == [ALLOW, ALLOW, ALLOW, WARN]
+
+
+def test_idle_chats_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("flood_control.time.monotonic", lambda: now[0])
+    monkeypatch.setattr("outbound.time.monotonic", lambda: now[0])
+    flood = FloodControl(rate=1, burst=10, idle_ttl=60, max_chats=2)
+
+    flood.admit(1, TEXT_KEY)
+    flood.admit(2, TEXT_KEY)
+    flood.admit(3, TEXT_KEY)
+    assert flood.stats()["chats"] == 2
+    now[0] += 61
+    flood.admit(4, TEXT_KEY)
+    assert flood.stats() | {"hits": None} == {
+        "chats": 1, "allowed": 4, "warned": 0, "limited": 0, "expired": 3, "hits": None,
+    }
+
+
+def test_shared_buckets_limit_chat_across_workers(tmp_path, monkeypatch):
+    """Два воркера с общим файлом вместе пропускают один лимит чата, а не по лимиту каждый."""
+    now = [1000.0]
+    monkeypatch.setattr("flood_control.time.monotonic", lambda: now[0])
+    monkeypatch.setattr("outbound.time.monotonic", lambda: now[0])
+    path = str(tmp_path / "flood")
+    first = FloodControl(rate=1, burst=4, shared=SharedFloodBuckets(path, slots=8))
+    second = FloodControl(rate=1, burst=4, shared=SharedFloodBuckets(path, slots=8))
+
+    assert [flood.admit(1, TEXT_KEY) for flood in (first, second, first, second)] == [ALLOW] * 4
+    # Предупреждение одно на чат, в каком бы воркере ни случилось превышение
+    assert [second.admit(1, TEXT_KEY), first.admit(1, TEXT_KEY)] == [WARN, LIMIT]
+    assert first.admit(9, TEXT_KEY) == ALLOW
+    now[0] += 1
+    assert [second.admit(1, TEXT_KEY), first.admit(1, TEXT_KEY)] == [ALLOW, LIMIT]
+
+    # Чаты, делящие ячейки, вытесняют самый давний, а не чужое свежее ведро
+    narrow = FloodControl(rate=1, burst=4, shared=SharedFloodBuckets(str(tmp_path / "narrow"), slots=2))
+    for chat_id in (1, 2, 3):
+        now[0] += 1
+        narrow.admit(chat_id, TEXT_KEY)
+    assert narrow.stats()["expired"] == 1
+    assert [narrow.admit(3, TEXT_KEY) for _ in range(4)] == [ALLOW, ALLOW, ALLOW, WARN]
+
+
+def test_pre_router_limits_before_dispatch():
+    async def noop(update, context):
+        pass
+
+    application = Application.builder().token("1:test").updater(None).build()
+    application.add_handler(CommandHandler("save", noop, filters=filters.UpdateType.MESSAGE))
+    application.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.TEXT & ~filters.COMMAND, noop))
+    flood = FloodControl(rate=0.001, burst=2, costs={"save": 2})
+    router = PreRouter(application, ("message",), "test_bot", flood=flood)
+
+    assert router.classify(make_message("привет")) == PROCESS
+    assert router.classify(make_message("/save a", 5)) == FLOOD_WARNING
+    assert router.classify(make_message("привет")) == PROCESS
+    assert router.classify(make_message("/save a", 5)) == LIMITED
+    assert router.classify(make_message("еще")) == LIMITED
+
+    reply = router.flood_warning(make_message("еще"))
+    assert reply["method"] == "sendMessage" and reply["chat_id"] == 10
+    assert router.stats()["flood_control"]["warned"] == 1
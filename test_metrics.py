@@ -0,0 +1,40 @@
+import pytest
+
+import metrics
+
+
+def test_summary_aggregates_stages_and_commands():
+    """Сводка /status отражает счетчики команд и длительность этапов."""
+    before = metrics.summary()
+
+    metrics.COMMANDS_TOTAL.labels("save").inc()
+    metrics.COMMAND_ERRORS_TOTAL.labels("save").inc()
+    with metrics.observe_stage("db_query"):
+        pass
+
+    after = metrics.summary()
+    assert after["commands"]["save"] == before["commands"].get("save", 0) + 1
+    assert after["errors"]["save"] == before["errors"].get("save", 0) + 1
+    assert after["stages"]["db_query"]["count"] == before["stages"].get("db_query", {}).get("count", 0) + 1
+
+
+@pytest.mark.asyncio
+async def test_instrument_storage_times_queries():
+    """Каждое обращение к хранилищу попадает в этап db_query."""
+    class FakeStorage:
+        QUERY_METHODS = ("save_records", "fetch_page")
+
+        async def save_records(self, rows):
+            return len(rows)
+
+        async def fetch_page(self, chat_id, limit, cursor=None):
+            return [], None
+
+    storage = FakeStorage()
+    metrics.instrument_storage(storage)
+    before = metrics.summary()["stages"].get("db_query", {}).get("count", 0)
+
+    assert await storage.save_records([{}]) == 1
+    await storage.fetch_page(1, 5)
+
+    assert metrics.summary()["stages"]["db_query"]["count"] == before + 2
@@ -0,0 +1,87 @@
+import pytest
+from telegram.error import BadRequest, RetryAfter, TimedOut
+
+from outbound import OutboundSender, TokenBucket, WebhookReply, webhook_reply
+
+
+class FakeBot:
+    """Подмена Bot: отдает ошибки из списка, затем отвечает успешно."""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls.append((chat_id, text))
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_token_bucket_reserve_delays_past_capacity():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert not bucket.try_take()
+
+
+@pytest.mark.asyncio
+async def test_sender_retries_retry_after_and_timeouts():
+    """RetryAfter и TimedOut повторяются, сообщение в итоге доставляется."""
+    bot = FakeBot([RetryAfter(0), TimedOut()])
+    sender = OutboundSender(bot, global_rate=1000, chat_rate=1000, chat_burst=10, backoff=0.001)
+
+    assert await sender.send_message(1, "привет") == "ok"
+    assert len(bot.calls) == 3
+
+    stats = sender.stats()
+    assert (stats["sent"], stats["retries"], stats["retry_after"], stats["failed"]) == (1, 2, 1, 0)
+
+
+@pytest.mark.asyncio
+async def test_sender_does_not_retry_bad_request():
+    bot = FakeBot([BadRequest("chat not found")])
+    sender = OutboundSender(bot, backoff=0.001)
+
+    with pytest.raises(BadRequest):
+        await sender.send_message(1, "привет")
+    assert len(bot.calls) == 1
+    assert sender.stats()["failed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_single_reply_goes_into_webhook_response():
+    """Единственный ответ откладывается в тело ответа вебхука без исходящего запроса."""
+    bot = FakeBot()
+    sender = OutboundSender(bot)
+    slot = WebhookReply()
+    token = webhook_reply.set(slot)
+    try:
+        assert await sender.send_message(5, "Вы сказали: hi", parse_mode="Markdown") is None
+    finally:
+        webhook_reply.reset(token)
+
+    assert bot.calls == []
+    assert slot.payload() == {"method": "sendMessage", "chat_id": 5, "text": "Вы сказали: hi", "parse_mode": "Markdown"}
+
+
+@pytest.mark.asyncio
+async def test_second_reply_flushes_deferred_one_in_order():
+    """Второй ответ закрывает слот, и оба уходят обычным путем по порядку."""
+    bot = FakeBot()
+    sender = OutboundSender(bot, global_rate=30, chat_rate=1, chat_burst=3)
+    slot = WebhookReply()
+    token = webhook_reply.set(slot)
+    try:
+        await sender.send_message(5, "первый")
+        await sender.send_message(5, "второй")
+    finally:
+        webhook_reply.reset(token)
+
+    assert bot.calls == [(5, "первый"), (5, "второй")]
+    assert slot.payload() is None
+    assert sender.stats()["webhook_replies"] == 0
+    # Каждый ответ оплачен одним токеном: отложенный не списывается второй раз при отправке
+    assert sender._chat_bucket(5).tokens == pytest.approx(1, abs=0.01)
+    assert sender._global.tokens == pytest.approx(28, abs=0.5)
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from benchmarks.fake_bot_api import FakeBotAPI
+from poller import UpdatePoller
+
+
+def message(text):
+    return {"message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": text}}
+
+
+@pytest.mark.asyncio
+async def test_batches_are_fed_concurrently_and_offset_persists(tmp_path):
+    api = FakeBotAPI()
+    base_url = await api.start(port=8096)
+    offset_file = str(tmp_path / "offset")
+    for i in range(5):
+        api.push_update(message(f"m{i}"))
+
+    fed = []
+    in_flight = 0
+    max_in_flight = 0
+
+    async def feed(update):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        fed.append(update["update_id"])
+        if len(fed) == 5:
+            poller.stop()
+
+    try:
+        poller = UpdatePoller(f"{base_url}1:test/getUpdates", feed, offset_path=offset_file, timeout=1)
+        await asyncio.wait_for(poller.run(), 5)
+        assert sorted(fed) == [1, 2, 3, 4, 5]
+        assert max_in_flight == 5
+        assert poller.stats()["batches"] == 1
+        await poller.close()
+
+        # После рестарта обработанное не повторяется, новое приходит
+        api.push_update(message("после рестарта"))
+        fed.clear()
+        poller = UpdatePoller(f"{base_url}1:test/getUpdates", feed, offset_path=offset_file, timeout=1)
+        assert poller.offset == 6
+        run = asyncio.create_task(poller.run())
+        while not fed:
+            await asyncio.sleep(0.01)
+        poller.stop()
+        await asyncio.wait_for(run, 5)
+        await poller.close()
+    finally:
+        await api.stop()
+
+    assert fed == [6]
+    assert (tmp_path / "offset").read_text() == "7"
+
+
+@pytest.mark.asyncio
+async def test_stop_interrupts_long_poll():
+    api = FakeBotAPI()
+    base_url = await api.start(port=8096)
+    poller = UpdatePoller(f"{base_url}1:test/getUpdates", lambda update: None, timeout=2)
+    try:
+        run = asyncio.create_task(poller.run())
+        await asyncio.sleep(0.2)
+        poller.stop()
+        await asyncio.wait_for(run, 2)
+        await poller.close()
+    finally:
+        await api.stop()
+    assert poller.stats()["requests"] == 1
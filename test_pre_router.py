@@ -0,0 +1,61 @@
+import pytest
+from telegram import Update
+from telegram.ext import Application, CommandHandler, MessageHandler, filters
+
+from pre_router import COMMAND, DROP, PROCESS, PreRouter
+
+
+def make_message(text, entity_length=None, update_id=1):
+    message = {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 10, "type": "private"},
+        "from": {"id": 10, "is_bot": False, "first_name": "Test"},
+        "text": text,
+    }
+    if entity_length:
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": entity_length}]
+    return {"update_id": update_id, "message": message}
+
+
+@pytest.fixture
+def router_and_calls():
+    calls = []
+
+    async def save(update, context):
+        calls.append(("save", context.args))
+
+    async def echo(update, context):
+        calls.append(("echo", update.message.text))
+
+    application = Application.builder().token("1:test").updater(None).build()
+    application.add_handler(CommandHandler("save", save, filters=filters.UpdateType.MESSAGE))
+    application.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.TEXT & ~filters.COMMAND, echo))
+    return PreRouter(application, ("message",), "test_bot"), calls, application
+
+
+def test_classify_drops_unhandled_updates(router_and_calls):
+    router, _, _ = router_and_calls
+
+    assert router.classify(make_message("/save a b", 5)) == COMMAND
+    assert router.classify(make_message("/save@test_bot a", 14)) == COMMAND
+    assert router.classify(make_message("привет")) == PROCESS
+    assert router.classify(make_message("/save@other_bot a", 15)) == DROP
+    assert router.classify(make_message("/unknown", 8)) == DROP
+    assert router.classify({"update_id": 2, "edited_message": make_message("x")["message"]}) == DROP
+    assert router.classify({"update_id": 3, "message_reaction": {}}) == DROP
+    assert router.stats()["dropped"] == 4
+
+
+@pytest.mark.asyncio
+async def test_process_calls_command_directly(router_and_calls):
+    router, calls, application = router_and_calls
+    application._initialized = True  # без сетевого getMe
+
+    bot = application.bot
+    await router.process(Update.de_json(make_message("/save раз два", 5), bot))
+    await router.process(Update.de_json(make_message("привет", update_id=2), bot))
+
+    assert calls == [("save", ["раз", "два"]), ("echo", "привет")]
+    assert router.stats()["direct"] == 1
+    assert router.stats()["fallback"] == 1
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from metrics import observe_stage
+from profiler import ProfilerBusy, SamplingProfiler, SlowUpdateLog, collapse, set_handler
+
+
+def spin(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_profiler_samples_busy_thread_in_collapsed_format():
+    stop = threading.Event()
+    worker = threading.Thread(target=spin, args=(stop,), name="busy worker")
+    worker.start()
+    profiler = SamplingProfiler()
+    try:
+        stacks, samples = profiler.run(0.2, interval=0.005)
+        # Только выбранный поток
+        only_worker, _ = profiler.run(0.05, interval=0.005, thread_id=worker.ident)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert samples > 5
+    assert any(stack.startswith("busy_worker;") and "test_profiler.py:spin" in stack for stack in stacks)
+    assert all(stack.startswith("busy_worker;") for stack in only_worker)
+    line = collapse(stacks).splitlines()[0]
+    stack, count = line.rsplit(" ", 1)
+    assert stacks[stack] == int(count) == max(stacks.values())
+
+
+def test_profiler_runs_one_profile_at_a_time():
+    profiler = SamplingProfiler()
+    runner = threading.Thread(target=profiler.run, args=(0.2,))
+    runner.start()
+    time.sleep(0.05)
+    with pytest.raises(ProfilerBusy):
+        profiler.run(0.01)
+    runner.join()
+
+
+@pytest.mark.asyncio
+async def test_slow_updates_keep_raw_update_stages_and_handler():
+    log = SlowUpdateLog(threshold=0.05, size=2)
+
+    async def process(update):
+        set_handler("save_command")
+        with observe_stage("db_query"):
+            await asyncio.sleep(update.delay)
+
+    traced = log.wrap(process)
+
+    async def receive(update_id, delay):
+        # Прием в своей задаче (как запрос вебхука), обработка — в другой (как воркер очереди)
+        log.begin("42", f'{{"update_id": {update_id}}}'.encode())
+        with observe_stage("deserialize"):
+            update = SimpleNamespace(update_id=update_id, delay=delay)
+        log.handoff(update)
+        return update
+
+    for update_id, delay in ((1, 0.06), (2, 0.0), (3, 0.06), (4, 0.06)):
+        update = await asyncio.create_task(receive(update_id, delay))
+        await traced(update)
+
+    records = log.records()
+    assert [r["update_id"] for r in records] == [4, 3]
+    assert records[0]["update"] == {"update_id": 4}
+    assert records[0]["handler"] == "save_command"
+    assert records[0]["bot_id"] == "42"
+    assert set(records[0]["stages_ms"]) == {"deserialize", "wait", "db_query"}
+    assert records[0]["stages_ms"]["db_query"] >= 50
+    assert log.stats() == {"threshold_ms": 50.0, "observed": 4, "captured": 3, "buffered": 2, "pending": 0}
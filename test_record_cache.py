@@ -0,0 +1,57 @@
+import pytest
+
+from record_cache import RecordCache, SharedFileGenerations
+
+
+@pytest.mark.asyncio
+async def test_cache_hits_and_invalidates_on_save():
+    """Повторный /fetch берется из кэша, /save сбрасывает страницы чата."""
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        return len(loads)
+
+    cache = RecordCache(max_entries=10, ttl=60)
+    assert await cache.get_or_load(1, (5, None), loader) == 1
+    assert await cache.get_or_load(1, (5, None), loader) == 1
+    await cache.invalidate(1)
+    assert await cache.get_or_load(1, (5, None), loader) == 2
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["invalidations"]) == (1, 2, 1)
+
+
+@pytest.mark.asyncio
+async def test_cache_evicts_least_recently_used():
+    """Кэш не превышает max_entries и вытесняет давно не использованные страницы."""
+    async def loader():
+        return "page"
+
+    cache = RecordCache(max_entries=2, ttl=60)
+    await cache.get_or_load(1, "a", loader)
+    await cache.get_or_load(2, "a", loader)
+    await cache.get_or_load(1, "a", loader)
+    await cache.get_or_load(3, "a", loader)
+
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["evictions"] == 1
+    # Чат 2 вытеснен, чат 1 остался
+    await cache.get_or_load(1, "a", loader)
+    assert cache.stats()["hits"] == 2
+
+
+@pytest.mark.asyncio
+async def test_shared_generations_reach_other_workers(tmp_path):
+    """Инвалидация через mmap-файл видна кэшу другого воркера."""
+    path = str(tmp_path / "gen")
+    worker_a = RecordCache(generations=SharedFileGenerations(path, slots=128))
+    worker_b = RecordCache(generations=SharedFileGenerations(path, slots=128))
+    values = iter(["old", "new"])
+
+    async def loader():
+        return next(values)
+
+    assert await worker_b.get_or_load(7, "p", loader) == "old"
+    await worker_a.invalidate(7)
+    assert await worker_b.get_or_load(7, "p", loader) == "new"
@@ -0,0 +1,84 @@
+import datetime
+import sqlite3
+
+import pytest
+
+from retention import ARCHIVE_SUFFIX, RetentionJob
+from storage import add_months, create_storage, month_start
+
+UTC = datetime.timezone.utc
+
+
+def insert_old_rows(path, rows):
+    """Вставляет строки с заданным временем создания в обход Storage."""
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.executemany(
+            "INSERT INTO user_data (id, chat_id, username, data_text, created_at) VALUES (?, ?, 'u', ?, ?)",
+            [(i, chat_id, f"старая {i}", created_at.strftime("%Y-%m-%d %H:%M:%S.%f")) for i, chat_id, created_at in rows],
+        )
+    connection.close()
+
+
+def test_add_months_crosses_year_boundary():
+    january = datetime.datetime(2025, 1, 1, tzinfo=UTC)
+    assert add_months(january, -1) == datetime.datetime(2024, 12, 1, tzinfo=UTC)
+    assert add_months(january, 13) == datetime.datetime(2026, 2, 1, tzinfo=UTC)
+    assert month_start(datetime.datetime(2025, 3, 17, 12, 5, tzinfo=UTC)) == datetime.datetime(2025, 3, 1, tzinfo=UTC)
+
+
+@pytest.mark.asyncio
+async def test_retention_archives_old_months_and_restores_one_chat(sqlite_storage, tmp_path):
+    """Старые месяцы уходят в архив, /restore возвращает строки одного чата ровно один раз."""
+    long_ago = datetime.datetime(2020, 1, 15, tzinfo=UTC)
+    insert_old_rows(sqlite_storage.path, [
+        (1, 10, long_ago),
+        (2, 20, long_ago),
+        (3, 10, long_ago + datetime.timedelta(days=31)),
+    ])
+    await sqlite_storage.save_record({"chat_id": 10, "username": "u", "data_text": "свежая"})
+
+    job = RetentionJob(sqlite_storage, str(tmp_path / "archive"), retention_months=3)
+    units = await job.run_once()
+
+    assert units == ["user_data_p2020_01", "user_data_p2020_02"]
+    assert len(list((tmp_path / "archive").glob(f"*{ARCHIVE_SUFFIX}"))) == 2
+    records, _ = await sqlite_storage.fetch_page(10, 10)
+    assert [r["data_text"] for r in records] == ["свежая"]
+
+    assert await job.restore(10) == 2
+    assert await job.restore(10) == 0
+    records, _ = await sqlite_storage.fetch_page(10, 10)
+    assert [r["id"] for r in records][1:] == [3, 1]
+    assert records[-1]["created_at"] == long_ago
+    assert (await sqlite_storage.fetch_page(20, 10))[0] == []
+
+    # Восстановленные строки не выгружаются повторно
+    assert await job.run_once() == []
+    assert job.stats()["archived_rows"] == 3
+
+
+@pytest.mark.asyncio
+async def test_archived_blob_texts_are_exported_and_collected(tmp_path):
+    """Выгрузка пишет в архив полный текст из text_blobs, а ненужный blob затем удаляется."""
+    storage = create_storage(f"sqlite:///{tmp_path / 'bot.db'}", blob_min_bytes=32)
+    await storage.connect()
+    try:
+        await storage.migrate()
+        post = "длинный пересланный пост " * 10
+        await storage.save_records([{"chat_id": 10, "username": "u", "data_text": post}] * 2)
+        connection = sqlite3.connect(storage.path)
+        with connection:
+            connection.execute("UPDATE user_data SET created_at = '2020-01-15 00:00:00.000000'")
+        connection.close()
+
+        job = RetentionJob(storage, str(tmp_path / "archive"), retention_months=3)
+        assert await job.run_once() == ["user_data_p2020_01"]
+        assert job.stats()["collected_blobs"] == 1
+        assert await storage.search(10, "пост", 5) == ([], None)
+
+        assert await job.restore(10) == 2
+        records, _ = await storage.fetch_page(10, 10)
+        assert [r["data_text"] for r in records] == [post, post]
+    finally:
+        await storage.disconnect()
@@ -0,0 +1,150 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from migrations import MIGRATIONS
+from records import parse_search_args
+from storage import SQLiteStorage, create_storage
+
+
+def row(chat_id, text):
+    return {"chat_id": chat_id, "username": "tester", "data_text": text}
+
+
+@pytest.mark.asyncio
+async def test_migrations_are_applied_once(tmp_path):
+    """Повторный запуск миграций (рестарт воркера) ничего не применяет."""
+    storage = create_storage(f"sqlite:///{tmp_path / 'bot.db'}")
+    assert isinstance(storage, SQLiteStorage)
+    await storage.connect()
+    try:
+        assert await storage.migrate() == [version for version, _, _ in MIGRATIONS]
+        assert await storage.migrate() == []
+    finally:
+        await storage.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_fetch_page_is_per_chat_and_keyset_paginated(sqlite_storage):
+    """SQLite листает записи чата так же, как PostgreSQL: новые сначала, без пропусков."""
+    for i in range(1, 8):
+        await sqlite_storage.save_record(row(7777, f"Entry_{i}"))
+    await sqlite_storage.save_record(row(8888, "Чужая запись"))
+
+    first, cursor = await sqlite_storage.fetch_page(7777, 3)
+    second, cursor = await sqlite_storage.fetch_page(7777, 3, cursor)
+    third, cursor = await sqlite_storage.fetch_page(7777, 3, cursor)
+
+    texts = [r["data_text"] for r in first + second + third]
+    assert texts == [f"Entry_{i}" for i in range(7, 0, -1)]
+    assert cursor is None
+    assert first[0]["created_at"].tzinfo is not None
+
+
+@pytest.mark.asyncio
+async def test_sqlite_writer_batches_commits_and_isolates_failures(sqlite_storage):
+    """Одновременные записи уходят общими коммитами, а ошибочная не откатывает соседей."""
+    rows = [row(1, f"text {i}") for i in range(50)]
+    rows[10] = row(1, None)  # нарушает NOT NULL
+
+    results = await asyncio.gather(*(sqlite_storage.save_record(r) for r in rows), return_exceptions=True)
+
+    assert sum(isinstance(r, Exception) for r in results) == 1
+    records, _ = await sqlite_storage.fetch_page(1, 50)
+    assert len(records) == 49
+    stats = sqlite_storage.stats()
+    assert stats["commits"] < stats["jobs"]
+    assert stats["failed_jobs"] == 1
+
+
+@pytest.mark.asyncio
+async def test_sqlite_search_is_ranked_per_chat_and_paginated(sqlite_storage):
+    """/search находит только записи своего чата, лучшие совпадения сначала, и листается смещением."""
+    await sqlite_storage.save_record(row(-100, "купить молоко"))
+    await sqlite_storage.save_record(row(-100, "молоко молоко молоко и хлеб"))
+    await sqlite_storage.save_record(row(-100, "позвонить маме"))
+    await sqlite_storage.save_record(row(-200, "Молоко в чужом чате"))
+    for i in range(4):
+        await sqlite_storage.save_record(row(-100, f"заметка {i} про МОЛОКО"))
+
+    records, next_offset = await sqlite_storage.search(-100, "молоко", 5)
+    assert records[0]["data_text"] == "молоко молоко молоко и хлеб"
+    assert next_offset == 5
+    rest, next_offset = await sqlite_storage.search(-100, "молоко", 5, next_offset)
+    assert next_offset is None
+    assert len(records) + len(rest) == 6
+    assert all("чужом" not in r["data_text"] for r in records + rest)
+
+    assert (await sqlite_storage.search(-100, "купить молоко", 5))[0][0]["data_text"] == "купить молоко"
+    # Ранжируются все кандидаты (SEARCH_CANDIDATES самых новых совпадений), а не только первая страница
+    await sqlite_storage.save_records([row(-100, f"заметка {i} про молоко и много других слов") for i in range(300)])
+    assert (await sqlite_storage.search(-100, "молоко", 5))[0][0]["data_text"] == "молоко молоко молоко и хлеб"
+    # Операторы FTS5 во вводе пользователя не ломают запрос
+    assert await sqlite_storage.search(-100, 'молоко" OR chat:*', 5) == ([], None)
+    assert await sqlite_storage.search(-100, "!!!", 5) == ([], None)
+
+
+@pytest.mark.asyncio
+async def test_sqlite_search_ranks_capped_candidates(tmp_path):
+    """Ранжирование стоит не больше search_candidates совпадений: более старые не видны."""
+    storage = create_storage(f"sqlite:///{tmp_path / 'bot.db'}", sqlite_search_candidates=10)
+    await storage.connect()
+    try:
+        await storage.migrate()
+        await storage.save_record(row(1, "молоко молоко молоко"))
+        await storage.save_records([row(1, f"заметка {i} про молоко и хлеб") for i in range(10)])
+
+        records, next_offset = await storage.search(1, "молоко", 5)
+        assert records[0]["data_text"] != "молоко молоко молоко"
+        assert next_offset == 5
+        rest, next_offset = await storage.search(1, "молоко", 5, 5)
+        assert len(rest) == 5 and next_offset is None
+    finally:
+        await storage.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_large_texts_are_stored_once_compressed(tmp_path):
+    """Длинный текст хранится одним сжатым blob'ом на все копии и читается прозрачно."""
+    storage = create_storage(f"sqlite:///{tmp_path / 'bot.db'}", blob_min_bytes=64)
+    await storage.connect()
+    try:
+        await storage.migrate()
+        post = "Пересланный пост про кошек и собак. " * 20
+        await storage.save_records([row(1, post), row(1, "коротко"), row(2, post)])
+        await storage.save_record(row(1, post))
+
+        connection = sqlite3.connect(storage.path)
+        blobs = connection.execute("SELECT size, length(data) FROM text_blobs").fetchall()
+        inline = connection.execute("SELECT data_text FROM user_data WHERE blob_hash IS NULL").fetchall()
+        connection.close()
+        assert len(blobs) == 1 and blobs[0][1] < blobs[0][0] == len(post.encode())
+        assert inline == [("коротко",)]
+
+        records, _ = await storage.fetch_page(1, 10)
+        assert [r["data_text"] for r in records] == [post, "коротко", post]
+        exported, _ = await storage.export_page(2, 10)
+        assert exported[0]["data_text"] == post
+
+        # Текст blob'а ищется, но только в чатах, где он сохранен
+        found, _ = await storage.search(1, "собак", 5)
+        assert [r["data_text"] for r in found] == [post, post]
+        # Записи из обоих индексов FTS5 ранжируются одной статистикой: короткая запись
+        # из user_data_fts встает между blob'ами из text_blobs_fts
+        mention = "Пересланный пост про кошек. " * 20 + "И про собак."
+        await storage.save_records([row(1, "собак собак"), row(1, mention)])
+        found, _ = await storage.search(1, "собак", 5)
+        assert [r["data_text"] for r in found] == [post, post, "собак собак", mention]
+        assert await storage.search(3, "собак", 5) == ([], None)
+    finally:
+        await storage.disconnect()
+
+
+def test_parse_search_args():
+    assert parse_search_args(["кошка", "рыжая"]) == (0, "кошка рыжая")
+    assert parse_search_args(["+10", "кошка"]) == (10, "кошка")
+    with pytest.raises(ValueError):
+        parse_search_args(["+5"])
+    with pytest.raises(ValueError):
+        parse_search_args(["+100000", "кошка"])
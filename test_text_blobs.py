@@ -0,0 +1,33 @@
+import pytest
+
+from text_blobs import CODEC_RAW, CODEC_ZLIB, compress_text, decompress_text, pack_rows, record_text
+
+
+def row(text):
+    return {"chat_id": 1, "username": "u", "data_text": text}
+
+
+def test_pack_rows_keeps_short_texts_inline_and_dedups_long_ones():
+    long_text = "повтор " * 50
+    rows, blobs = pack_rows([row("коротко"), row(long_text), row(long_text), row(None)], min_bytes=100)
+
+    assert len(blobs) == 1
+    assert [r["data_text"] for r in rows] == ["коротко", "", "", None]
+    assert rows[1]["blob_hash"] == rows[2]["blob_hash"] == blobs[0]["hash"]
+    assert rows[0]["blob_hash"] is None
+    assert record_text({"data_text": "", "blob_codec": blobs[0]["codec"], "blob_data": blobs[0]["data"]}) == long_text
+
+    # Без длинных текстов (и с выключенным режимом) строки не меняются
+    short = [row("коротко")]
+    assert pack_rows(short, min_bytes=100) == (short, [])
+    assert pack_rows([row(long_text)], min_bytes=0)[1] == []
+
+
+def test_incompressible_text_is_stored_raw():
+    # На коротком тексте заголовок zlib длиннее выигрыша
+    codec, data = compress_text("кот")
+    assert codec == CODEC_RAW
+    assert decompress_text(codec, data) == "кот"
+    assert compress_text("а" * 300)[0] == CODEC_ZLIB
+    with pytest.raises(ValueError):
+        decompress_text(99, b"")
@@ -0,0 +1,114 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from update_journal import UpdateJournal, read_segment
+
+
+def body(update_id):
+    return f'{{"update_id": {update_id}}}'.encode()
+
+
+@pytest.mark.asyncio
+async def test_unfinished_updates_survive_restart(tmp_path):
+    journal = UpdateJournal(str(tmp_path))
+    assert journal.open() == {}
+
+    for update_id in (1, 2, 3):
+        assert await journal.append(update_id, body(update_id))
+    # Повторная доставка еще не обработанного обновления второй раз не пишется
+    assert not await journal.append(2, body(2))
+    journal.complete(2)
+    await journal.close()
+
+    restarted = UpdateJournal(str(tmp_path))
+    assert restarted.open() == {1: body(1), 3: body(3)}
+    assert restarted.pending == 2
+    await restarted.close()
+
+
+@pytest.mark.asyncio
+async def test_torn_tail_is_ignored(tmp_path):
+    journal = UpdateJournal(str(tmp_path))
+    journal.open()
+    await journal.append(1, body(1))
+    await journal.append(2, body(2))
+    await journal.close()
+
+    segment = next((tmp_path / "slot-0").glob("segment-*.log"))
+    data = segment.read_bytes()
+    segment.write_bytes(data[:-3])  # процесс упал посреди записи второго обновления
+    assert [record[1] for record in read_segment(segment)] == [1]
+
+    restarted = UpdateJournal(str(tmp_path))
+    assert list(restarted.open()) == [1]
+    await restarted.close()
+
+
+@pytest.mark.asyncio
+async def test_processed_segments_are_compacted(tmp_path):
+    journal = UpdateJournal(str(tmp_path), segment_bytes=200)
+    journal.open()
+    for update_id in range(1, 21):
+        await journal.append(update_id, body(update_id))
+    assert journal.stats()["segments"] > 3
+
+    for update_id in range(1, 20):
+        journal.complete(update_id)
+    # Остались активный сегмент и сегмент с необработанным update_id=20
+    assert journal.stats()["segments"] <= 2
+    segments = list((tmp_path / "slot-0").glob("segment-*.log"))
+    assert len(segments) == journal.stats()["segments"]
+    await journal.close()
+
+    restarted = UpdateJournal(str(tmp_path))
+    assert list(restarted.open()) == [20]
+    await restarted.close()
+
+
+@pytest.mark.asyncio
+async def test_orphaned_slot_is_adopted(tmp_path):
+    first = UpdateJournal(str(tmp_path))
+    first.open()
+    second = UpdateJournal(str(tmp_path))
+    second.open()
+    await second.append(7, body(7))
+    # Воркер со слотом 1 упал; воркер со слотом 0 остановлен штатно
+    await first.close()
+    await second.close()
+
+    survivor = UpdateJournal(str(tmp_path))
+    assert survivor.open() == {7: body(7)}
+    assert survivor.stats()["adopted_slots"] == 1
+    assert not list((tmp_path / "slot-1").glob("segment-*.log"))
+    await survivor.close()
+
+
+@pytest.mark.asyncio
+async def test_wrap_completes_unless_cancelled(tmp_path):
+    journal = UpdateJournal(str(tmp_path), fsync=False)
+    journal.open()
+
+    async def process(update):
+        if update.update_id == 2:
+            raise RuntimeError("handler failed")
+        if update.update_id == 3:
+            await asyncio.sleep(10)
+
+    wrapped = journal.wrap(process)
+    for update_id in (1, 2, 3):
+        await journal.append(update_id, body(update_id))
+
+    await wrapped(SimpleNamespace(update_id=1))
+    with pytest.raises(RuntimeError):
+        await wrapped(SimpleNamespace(update_id=2))
+    task = asyncio.create_task(wrapped(SimpleNamespace(update_id=3)))
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    # Прерванное остановкой воркера будет повторено
+    assert journal.pending == 1
+    await journal.close()
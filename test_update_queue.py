@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+
+from update_queue import UpdateQueue
+
+
+@pytest.mark.asyncio
+async def test_queue_processes_and_drains():
+    """Проверяет, что drain дожидается обработки всех принятых обновлений."""
+    processed = []
+
+    async def process(update):
+        await asyncio.sleep(0.01)
+        processed.append(update)
+
+    queue = UpdateQueue(process, maxsize=100, workers=4)
+    queue.start()
+    for i in range(20):
+        assert await queue.put(i)
+
+    left = await queue.drain(timeout=5)
+
+    assert left == 0
+    assert sorted(processed) == list(range(20))
+    assert queue.stats()["processed"] == 20
+    # После drain новые обновления не принимаются
+    assert not await queue.put(99)
+
+
+@pytest.mark.asyncio
+async def test_queue_rejects_when_full():
+    """Проверяет backpressure: заполненная очередь отклоняет обновления."""
+    release = asyncio.Event()
+
+    async def process(update):
+        await release.wait()
+
+    queue = UpdateQueue(process, maxsize=2, workers=1)
+    queue.start()
+    assert await queue.put(1)
+    await asyncio.sleep(0)  # воркер забирает первое обновление
+    # Обновление в обработке тоже занимает место в очереди
+    assert await queue.put(2)
+    assert not await queue.put(3, timeout=0.01)
+    assert queue.stats()["rejected"] == 1
+
+    release.set()
+    assert await queue.drain(timeout=5) == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_keeps_chat_order_and_runs_chats_in_parallel():
+    """Обновления одного ключа идут по порядку, разные ключи — параллельно."""
+    running = set()
+    overlap = []
+    order = {1: [], 2: []}
+
+    async def process(update):
+        chat, n = update
+        assert chat not in running
+        running.add(chat)
+        if len(running) > 1:
+            overlap.append(n)
+        await asyncio.sleep(0.005)
+        order[chat].append(n)
+        running.discard(chat)
+
+    queue = UpdateQueue(process, maxsize=100, workers=4)
+    queue.start()
+    for n in range(10):
+        await queue.put((1, n), key=1)
+        await queue.put((2, n), key=2)
+
+    assert await queue.drain(timeout=5) == 0
+    assert order[1] == list(range(10))
+    assert order[2] == list(range(10))
+    assert overlap
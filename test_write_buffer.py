@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from storage import build_multirow_insert
+from write_buffer import SaveBuffer
+
+
+class FakeStorage:
+    """Минимальная подмена Storage: запоминает записанные пачки."""
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.batches = []
+
+    async def save_records(self, rows):
+        await asyncio.sleep(0)
+        if self.fail:
+            raise RuntimeError("db is down")
+        self.batches.append(rows)
+
+
+def row(i):
+    return {"chat_id": i, "username": "u", "data_text": f"text {i}"}
+
+
+def test_build_multirow_insert():
+    query, values = build_multirow_insert([row(1), row(2)])
+    assert query.endswith("VALUES (:chat_id_0, :username_0, :data_text_0), (:chat_id_1, :username_1, :data_text_1)")
+    assert values["data_text_1"] == "text 2"
+
+
+@pytest.mark.asyncio
+async def test_buffer_flushes_by_size_and_by_time():
+    """Пачка уходит при наборе max_rows строк, остаток — по таймеру."""
+    storage = FakeStorage()
+    buffer = SaveBuffer(storage, max_rows=3, max_delay=0.01)
+
+    await asyncio.gather(*(buffer.add(row(i)) for i in range(5)))
+
+    assert [len(batch) for batch in storage.batches] == [3, 2]
+    assert buffer.stats()["rows_written"] == 5
+
+
+@pytest.mark.asyncio
+async def test_buffer_reports_failure_to_every_sender():
+    """Ошибка записи пачки доходит до каждого отправителя."""
+    buffer = SaveBuffer(FakeStorage(fail=True), max_rows=2, max_delay=0.01)
+
+    results = await asyncio.gather(buffer.add(row(1)), buffer.add(row(2)), return_exceptions=True)
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert buffer.stats()["failed_flushes"] == 1
@@ -0,0 +1,70 @@
+import hashlib
+import zlib
+from typing import Any, Optional
+
+# Кодек text_blobs.data: номер хранится в колонке codec, чтобы старые blob'ы
+# читались и после смены сжатия
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+
+ZLIB_LEVEL = 6
+
+
+def text_hash(text: str) -> bytes:
+    """Ключ blob'а: SHA-256 текста в UTF-8."""
+    return hashlib.sha256(text.encode()).digest()
+
+
+def compress_text(text: str) -> tuple[int, bytes]:
+    """(кодек, данные). Несжимаемый текст хранится как есть: zlib лишь добавил бы байты."""
+    raw = text.encode()
+    packed = zlib.compress(raw, ZLIB_LEVEL)
+    if len(packed) < len(raw):
+        return CODEC_ZLIB, packed
+    return CODEC_RAW, raw
+
+
+def decompress_text(codec: int, data: bytes) -> str:
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data).decode()
+    if codec == CODEC_RAW:
+        return bytes(data).decode()
+    raise ValueError(f"Неизвестный кодек blob'а: {codec}")
+
+
+def pack_rows(rows: list[dict], min_bytes: int) -> tuple[list[dict], list[dict]]:
+    """
+    Выносит длинные тексты записей /save в text_blobs.
+
+    Текст от `min_bytes` байт (UTF-8) сжимается и сохраняется один раз по хешу:
+    в строке user_data остаются пустой data_text и blob_hash. Короткие тексты
+    остаются в data_text: для них ссылка и лишнее чтение дороже самого текста.
+    Возвращает строки для user_data и новые для пачки blob'ы (hash, codec, size,
+    data, text). Если выносить нечего, строки возвращаются без изменений.
+    """
+    if min_bytes <= 0:
+        return rows, []
+    blobs: dict[bytes, dict] = {}
+    packed = []
+    for row in rows:
+        text = row["data_text"]
+        size = len(text.encode()) if isinstance(text, str) else 0
+        if size < min_bytes:
+            packed.append({**row, "blob_hash": None})
+            continue
+        digest = text_hash(text)
+        if digest not in blobs:
+            codec, data = compress_text(text)
+            blobs[digest] = {"hash": digest, "codec": codec, "size": size, "data": data, "text": text}
+        packed.append({**row, "data_text": "", "blob_hash": digest})
+    if not blobs:
+        return rows, []
+    return packed, list(blobs.values())
+
+
+def record_text(row: Any) -> Optional[str]:
+    """data_text записи, прочитанной с LEFT JOIN text_blobs: из blob'а, если он есть."""
+    data = row["blob_data"]
+    if data is None:
+        return row["data_text"]
+    return decompress_text(row["blob_codec"], data)
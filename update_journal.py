@@ -0,0 +1,361 @@
+import asyncio
+import fcntl
+import logging
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+
+from metrics import JOURNAL_PENDING, JOURNAL_REPLAYED_TOTAL
+
+# Типы записей журнала
+ENTRY = 1  # принятое обновление: update_id и сырое тело вебхука
+DONE = 2   # контрольная точка: обновление обработано
+
+# crc32, длина тела, тип записи, update_id; crc считается по всему, что после него
+_HEADER = struct.Struct("<IIBq")
+_SEGMENT_PREFIX = "segment-"
+_SEGMENT_SUFFIX = ".log"
+
+
+def _segment_name(seq: int) -> str:
+    return f"{_SEGMENT_PREFIX}{seq:012d}{_SEGMENT_SUFFIX}"
+
+
+def _segments(directory: Path) -> list[tuple[int, Path]]:
+    found = []
+    for path in directory.glob(f"{_SEGMENT_PREFIX}*{_SEGMENT_SUFFIX}"):
+        try:
+            found.append((int(path.name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)]), path))
+        except ValueError:
+            continue
+    return sorted(found)
+
+
+def _encode(kind: int, update_id: int, payload: bytes = b"") -> bytes:
+    rest = _HEADER.pack(0, len(payload), kind, update_id)[4:] + payload
+    return struct.pack("<I", zlib.crc32(rest)) + rest
+
+
+def read_segment(path: Path) -> list[tuple[int, int, bytes]]:
+    """
+    Записи сегмента (тип, update_id, тело) по порядку.
+
+    Чтение останавливается на первой неполной или поврежденной записи: это хвост,
+    который процесс не успел дописать до падения, и подтверждения по нему не было.
+    """
+    data = path.read_bytes()
+    records = []
+    offset = 0
+    while offset + _HEADER.size <= len(data):
+        crc, length, kind, update_id = _HEADER.unpack_from(data, offset)
+        end = offset + _HEADER.size + length
+        if end > len(data) or zlib.crc32(data[offset + 4:end]) != crc:
+            logging.warning(f"Журнал {path.name}: оборванная запись на смещении {offset}, хвост отброшен.")
+            break
+        records.append((kind, update_id, data[offset + _HEADER.size:end]))
+        offset = end
+    return records
+
+
+def pending_entries(paths: list[Path]) -> dict[int, bytes]:
+    """Необработанные обновления из сегментов: update_id -> тело, в порядке приема."""
+    entries: dict[int, bytes] = {}
+    done: set[int] = set()
+    for path in paths:
+        for kind, update_id, payload in read_segment(path):
+            if kind == ENTRY:
+                entries[update_id] = payload
+            elif kind == DONE:
+                done.add(update_id)
+    return {update_id: payload for update_id, payload in entries.items() if update_id not in done}
+
+
+def _fsync_directory(directory: Path) -> None:
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+_fdatasync = getattr(os, "fdatasync", os.fsync)
+
+
+class UpdateJournal:
+    """
+    Локальный журнал принятых обновлений: вебхук отвечает 200 только после того,
+    как тело обновления записано в журнал и сброшено на диск.
+
+    Журнал — последовательность сегментов-файлов только на дозапись. Каждый воркер
+    занимает свой слот (подкаталог slot-N под flock), поэтому воркеры gunicorn
+    пишут без общих блокировок. Записи ENTRY (обновление) и DONE (контрольная
+    точка: обновление обработано) идут в активный сегмент; по достижении
+    `segment_bytes` открывается следующий.
+
+    fsync групповой: пока идет один fdatasync в потоке, новые записи копятся
+    и ждут следующего, так что на пачку одновременных вебхуков приходится один
+    сброс на диск. DONE не ждут fsync: потерянная контрольная точка означает
+    лишь повторную обработку после падения.
+
+    Сегмент удаляется (компактация), когда обработаны все его обновления и все
+    обновления более старых сегментов: DONE-записи лежат не раньше своих ENTRY,
+    поэтому удаление по порядку не воскрешает уже обработанное.
+
+    При открытии журнал собирает необработанное из своего слота и из слотов
+    упавших воркеров (flock свободен), переписывает его в новый сегмент
+    и отдает на повторную обработку.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 4 * 1024 * 1024, fsync: bool = True):
+        self._root = Path(directory)
+        self._segment_bytes = segment_bytes
+        self._fsync = fsync
+        self._dir: Optional[Path] = None
+        self._lock_fd: Optional[int] = None
+
+        self._fd: Optional[int] = None
+        self._seq = 0
+        self._size = 0
+        # update_id -> номер сегмента, где лежит его ENTRY
+        self._pending: dict[int, int] = {}
+        # номер сегмента -> число необработанных обновлений в нем (по возрастанию номеров)
+        self._segment_pending: dict[int, int] = {}
+        # Сегменты, закрытые для записи, но еще не сброшенные на диск
+        self._retired: list[int] = []
+        self._new_segment = False
+
+        # Групповой fsync: записано байт всего / из них гарантированно на диске
+        self._written = 0
+        self._synced = 0
+        self._sync_task: Optional[asyncio.Task] = None
+
+        # Метрики журнала
+        self.appended = 0
+        self.completed = 0
+        self.replayed = 0
+        self.fsyncs = 0
+        self.compacted = 0
+        self.adopted_slots = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def open(self) -> dict[int, bytes]:
+        """
+        Занимает слот и восстанавливает необработанные обновления.
+
+        Возвращает update_id -> сырое тело для повторной обработки. Эти обновления
+        уже записаны в новый сегмент: их обработку нужно завершать через complete.
+        """
+        self._root.mkdir(parents=True, exist_ok=True)
+        slot = 0
+        while self._lock_fd is None:
+            self._lock_fd = self._try_lock(self._root / f"slot-{slot}")
+            if self._lock_fd is None:
+                slot += 1
+        self._dir = self._root / f"slot-{slot}"
+
+        # Свой слот (от прошлого процесса этого воркера) и слоты упавших воркеров
+        recovered_dirs = [self._dir]
+        adopted_locks = []
+        for other in sorted(self._root.glob("slot-*")):
+            if other == self._dir or not _segments(other):
+                continue
+            lock_fd = self._try_lock(other)
+            if lock_fd is not None:
+                adopted_locks.append(lock_fd)
+                recovered_dirs.append(other)
+                self.adopted_slots += 1
+
+        try:
+            recovered_paths = []
+            pending = {}
+            for directory in recovered_dirs:
+                # Слоты независимы: DONE одного слота не относится к ENTRY другого
+                paths = [path for _, path in _segments(directory)]
+                recovered_paths.extend(paths)
+                pending.update(pending_entries(paths))
+
+            existing = _segments(self._dir)
+            self._seq = existing[-1][0] if existing else 0
+            self._open_segment()
+            for update_id, payload in pending.items():
+                self._write(_encode(ENTRY, update_id, payload))
+                self._track(update_id)
+            self._sync_files([*self._retired, self._fd], True)
+            for fd in self._retired:
+                os.close(fd)
+            self._retired = []
+            self._synced = self._written
+            self._new_segment = False
+            # Необработанное уже в новом сегменте: старые больше не нужны
+            for path in recovered_paths:
+                path.unlink(missing_ok=True)
+        finally:
+            for lock_fd in adopted_locks:
+                os.close(lock_fd)
+
+        JOURNAL_PENDING.set(len(self._pending))
+        if pending:
+            logging.warning(
+                f"Журнал {self._dir}: {len(pending)} принятых, но не обработанных обновлений "
+                f"(подобрано слотов упавших воркеров: {self.adopted_slots}), будут обработаны повторно."
+            )
+        return pending
+
+    @staticmethod
+    def _try_lock(directory: Path) -> Optional[int]:
+        directory.mkdir(parents=True, exist_ok=True)
+        fd = os.open(directory / "lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def _open_segment(self) -> None:
+        self._seq += 1
+        self._fd = os.open(self._dir / _segment_name(self._seq), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._size = 0
+        self._segment_pending[self._seq] = 0
+        self._new_segment = True
+
+    def _write(self, record: bytes) -> None:
+        os.write(self._fd, record)
+        self._size += len(record)
+        self._written += len(record)
+        if self._size >= self._segment_bytes:
+            self._rotate()
+
+    def _rotate(self) -> None:
+        if self._fsync:
+            # Закроется после fsync: его может сейчас сбрасывать поток
+            self._retired.append(self._fd)
+        else:
+            os.close(self._fd)
+        self._open_segment()
+        self._compact()
+
+    def _track(self, update_id: int) -> None:
+        self._pending[update_id] = self._seq
+        self._segment_pending[self._seq] += 1
+
+    async def append(self, update_id: int, payload: bytes) -> bool:
+        """
+        Записывает обновление и ждет, пока запись окажется на диске.
+
+        Возвращает False, если обновление с этим update_id уже в журнале и еще
+        не обработано (повторная доставка): вторая запись не нужна.
+        """
+        if update_id in self._pending:
+            return False
+        self._write(_encode(ENTRY, update_id, payload))
+        self._track(update_id)
+        self.appended += 1
+        JOURNAL_PENDING.inc()
+        if self._fsync:
+            await self._sync(self._written)
+        return True
+
+    async def _sync(self, target: int) -> None:
+        while self._synced < target:
+            if self._sync_task is None:
+                self._sync_task = asyncio.create_task(self._sync_once())
+            await asyncio.shield(self._sync_task)
+
+    async def _sync_once(self) -> None:
+        target = self._written
+        retired, self._retired = self._retired, []
+        new_segment, self._new_segment = self._new_segment, False
+        try:
+            await asyncio.to_thread(self._sync_files, [*retired, self._fd], new_segment)
+        finally:
+            for fd in retired:
+                os.close(fd)
+            self._sync_task = None
+        self._synced = max(self._synced, target)
+        self.fsyncs += 1
+
+    def _sync_files(self, fds: list[int], new_segment: bool) -> None:
+        for fd in fds:
+            _fdatasync(fd)
+        if new_segment:
+            # Имя нового сегмента тоже должно пережить падение
+            _fsync_directory(self._dir)
+
+    def complete(self, update_id: int) -> None:
+        """Контрольная точка: обновление обработано и при перезапуске не повторится."""
+        seq = self._pending.pop(update_id, None)
+        if seq is None or self._fd is None:
+            return
+        self._write(_encode(DONE, update_id))
+        self._segment_pending[seq] -= 1
+        self.completed += 1
+        JOURNAL_PENDING.dec()
+        self._compact()
+
+    def _compact(self) -> None:
+        """Удаляет обработанные сегменты, начиная с самого старого."""
+        while len(self._segment_pending) > 1:
+            seq, count = next(iter(self._segment_pending.items()))
+            if count or seq == self._seq:
+                break
+            del self._segment_pending[seq]
+            (self._dir / _segment_name(seq)).unlink(missing_ok=True)
+            self.compacted += 1
+
+    def wrap(self, process: Callable[[Any], Awaitable[None]]) -> Callable[[Any], Awaitable[None]]:
+        """
+        Обертка обработчика: после обработки ставит контрольную точку.
+
+        Ошибка обработчика тоже завершает обновление (повтор упал бы так же), а отмена
+        (остановка воркера посреди обработки) — нет: такое обновление будет повторено.
+        """
+
+        async def process_and_complete(update: Any) -> None:
+            try:
+                await process(update)
+            except asyncio.CancelledError:
+                raise
+            except BaseException:
+                self.complete(update.update_id)
+                raise
+            self.complete(update.update_id)
+
+        return process_and_complete
+
+    def mark_replayed(self, count: int = 1) -> None:
+        self.replayed += count
+        JOURNAL_REPLAYED_TOTAL.inc(count)
+
+    async def close(self) -> None:
+        """Сбрасывает журнал на диск и освобождает слот. Необработанное останется до следующего старта."""
+        if self._fd is None:
+            return
+        if self._sync_task:
+            await asyncio.shield(self._sync_task)
+        for fd in [*self._retired, self._fd]:
+            _fdatasync(fd)
+            os.close(fd)
+        self._retired = []
+        self._fd = None
+        JOURNAL_PENDING.dec(len(self._pending))
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "segments": len(self._segment_pending),
+            "appended": self.appended,
+            "completed": self.completed,
+            "replayed": self.replayed,
+            "fsyncs": self.fsyncs,
+            "compacted": self.compacted,
+            "adopted_slots": self.adopted_slots,
+        }
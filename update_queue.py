@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+
+class UpdateQueue:
+    """
+    Ограниченная очередь обновлений с пулом асинхронных воркеров.
+
+    Вебхук кладет обновление в очередь и сразу отвечает Telegram,
+    а воркеры в фоне вызывают `process` для каждого обновления.
+
+    Обновления с одинаковым ключом (обычно chat_id) образуют "полосу":
+    они обрабатываются строго по одному и в порядке поступления,
+    а разные полосы разбираются воркерами параллельно.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[Any], Awaitable[None]],
+        maxsize: int = 1000,
+        workers: int = 8,
+    ):
+        self._process = process
+        self._maxsize = maxsize
+        self._worker_count = workers
+        self._workers: list[asyncio.Task] = []
+        self._closing = False
+
+        # key -> очередь (update, enqueued_at). Ключ присутствует, пока полоса
+        # ждет в _ready или обрабатывается воркером.
+        self._lanes: dict[Hashable, deque] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._size = 0
+        self._changed = asyncio.Condition()
+
+        # Метрики очереди
+        self._recent_waits: deque = deque(maxlen=1024)
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self.max_wait = 0.0
+
+    @property
+    def maxsize(self) -> int:
+        return self._maxsize
+
+    @property
+    def depth(self) -> int:
+        return self._size
+
+    def start(self) -> None:
+        """Запускает воркеров. Вызывается внутри работающего event loop."""
+        for i in range(self._worker_count):
+            self._workers.append(asyncio.create_task(self._worker(), name=f"update-worker-{i}"))
+        logging.info(f"Очередь обновлений запущена: {self._worker_count} воркеров, размер {self.maxsize}.")
+
+    async def put(self, update: Any, timeout: float = 0.0, key: Optional[Hashable] = None) -> bool:
+        """
+        Ставит обновление в очередь.
+
+        Если очередь заполнена, ждет освобождения места не дольше `timeout` секунд.
+        `key` задает полосу; без ключа обновление не упорядочивается с другими.
+        Возвращает False, если обновление не принято (очередь полна или закрывается).
+        """
+        if self._closing:
+            self.rejected += 1
+            return False
+
+        if self._size >= self._maxsize:
+            if timeout <= 0 or not await self._wait_for_space(timeout):
+                self.rejected += 1
+                return False
+
+        if key is None:
+            key = object()
+
+        item = (update, time.monotonic())
+        lane = self._lanes.get(key)
+        if lane is None:
+            self._lanes[key] = deque([item])
+            self._ready.put_nowait(key)
+        else:
+            lane.append(item)
+
+        self._size += 1
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._size)
+        return True
+
+    async def _wait_for_space(self, timeout: float) -> bool:
+        async with self._changed:
+            try:
+                await asyncio.wait_for(
+                    self._changed.wait_for(lambda: self._size < self._maxsize), timeout
+                )
+            except asyncio.TimeoutError:
+                return False
+        return not self._closing
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            lane = self._lanes[key]
+            update, enqueued_at = lane.popleft()
+            wait = time.monotonic() - enqueued_at
+            self._recent_waits.append(wait)
+            self.max_wait = max(self.max_wait, wait)
+            try:
+                await self._process(update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logging.error(f"❌ Ошибка обработки обновления в воркере: {e}", exc_info=True)
+            finally:
+                # Полоса возвращается в конец очереди готовых, чтобы
+                # один активный чат не занимал воркера монопольно.
+                if lane:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._lanes[key]
+                self._size -= 1
+                async with self._changed:
+                    self._changed.notify_all()
+
+    async def drain(self, timeout: float) -> int:
+        """
+        Прекращает прием новых обновлений и дожидается обработки уже принятых.
+
+        Возвращает количество обновлений, которые не успели обработаться за `timeout`.
+        """
+        self._closing = True
+        try:
+            async with self._changed:
+                await asyncio.wait_for(self._changed.wait_for(lambda: self._size == 0), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Очередь не опустела за {timeout}с, осталось {self.depth} обновлений.")
+
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        return self.depth
+
+    def stats(self) -> dict:
+        """Снимок метрик очереди для /status и health check."""
+        waits = sorted(self._recent_waits)
+
+        def percentile(p: float) -> Optional[float]:
+            if not waits:
+                return None
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))] * 1000, 2)
+
+        return {
+            "depth": self.depth,
+            "maxsize": self.maxsize,
+            "max_depth": self.max_depth,
+            "lanes": len(self._lanes),
+            "workers": len(self._workers),
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "wait_ms_p50": percentile(0.50),
+            "wait_ms_p95": percentile(0.95),
+            "wait_ms_max": round(self.max_wait * 1000, 2),
+        }
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from db_guard import CircuitBreaker, DatabaseUnavailable
+from storage import Storage
+
+
+class SaveBuffer:
+    """
+    Write-behind буфер для /save.
+
+    Копит строки и записывает их одной пачкой (Storage.save_records), когда
+    набралось `max_rows` строк или прошло `max_delay` секунд с первой строки в буфере.
+    `add` завершается только после коммита пачки, в которую попала строка,
+    и пробрасывает ошибку записи каждому отправителю этой пачки.
+    """
+
+    def __init__(self, storage: Storage, max_rows: int = 100, max_delay: float = 0.02):
+        self._storage = storage
+        self._max_rows = max_rows
+        self._max_delay = max_delay
+        self._pending: list[tuple[dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: set[asyncio.Task] = set()
+
+        # Метрики буфера
+        self.flushes = 0
+        self.rows_written = 0
+        self.failed_flushes = 0
+        self.max_batch = 0
+
+    async def add(self, row: dict) -> None:
+        """Добавляет строку в буфер и ждет коммита ее пачки."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((row, future))
+
+        if len(self._pending) >= self._max_rows:
+            self._flush_pending()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._max_delay, self._flush_pending)
+
+        await future
+
+    def _flush_pending(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: list[tuple[dict, asyncio.Future]]) -> None:
+        rows = [row for row, _ in batch]
+        try:
+            await self._storage.save_records(rows)
+        except Exception as e:
+            self.failed_flushes += 1
+            logging.error(f"❌ Ошибка записи пачки из {len(rows)} строк: {e}", exc_info=True)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.flushes += 1
+        self.rows_written += len(rows)
+        self.max_batch = max(self.max_batch, len(rows))
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    async def close(self) -> None:
+        """Записывает остаток буфера и дожидается всех начатых записей."""
+        self._flush_pending()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "failed_flushes": self.failed_flushes,
+            "max_batch": self.max_batch,
+            "avg_batch": round(self.rows_written / self.flushes, 1) if self.flushes else None,
+        }
+
+
+class SaveRetryQueue:
+    """
+    Очередь /save, не записанных из-за недоступности БД.
+
+    Фоновая задача повторяет запись пачками по `batch_rows`, как только
+    `breaker` снова пропускает запросы; `on_saved(rows)` вызывается после
+    каждой записанной пачки. Очередь живет в памяти воркера и ограничена
+    `max_rows` строками: при переполнении `add` возвращает False.
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        breaker: CircuitBreaker,
+        max_rows: int = 10000,
+        batch_rows: int = 100,
+        on_saved: Optional[Callable[[list[dict]], Awaitable[None]]] = None,
+    ):
+        self._storage = storage
+        self._breaker = breaker
+        self._max_rows = max_rows
+        self._batch_rows = batch_rows
+        self._on_saved = on_saved
+        self._rows: deque[dict] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        # Метрики
+        self.queued = 0
+        self.retried_rows = 0
+        self.dropped = 0
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop())
+
+    def add(self, row: dict) -> bool:
+        """Ставит строку в очередь повтора. False — очередь заполнена, строка не принята."""
+        if len(self._rows) >= self._max_rows:
+            self.dropped += 1
+            return False
+        self._rows.append(row)
+        self.queued += 1
+        self._wakeup.set()
+        return True
+
+    async def _loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            if not self._rows:
+                self._wakeup.clear()
+                continue
+            # Пока автомат разомкнут, запросы все равно отклонятся: ждем пробного окна
+            await asyncio.sleep(max(self._breaker.retry_in(), 0.1))
+            await self._retry_batch()
+
+    async def _retry_batch(self) -> bool:
+        batch = [self._rows.popleft() for _ in range(min(self._batch_rows, len(self._rows)))]
+        try:
+            await self._storage.save_records(batch)
+        except DatabaseUnavailable as e:
+            # Порядок сохраняется: пачка возвращается в начало очереди
+            self._rows.extendleft(reversed(batch))
+            logging.warning(f"Повтор записи {len(batch)} строк /save не удался: {e}")
+            return False
+        except Exception as e:
+            # БД ответила ошибкой самих данных: повтор не поможет
+            self.dropped += len(batch)
+            logging.error(f"❌ Строки /save из очереди повтора отклонены БД и потеряны: {e}", exc_info=True)
+            return True
+        self.retried_rows += len(batch)
+        logging.info(f"💾 Повторно записано {len(batch)} строк /save, в очереди {len(self._rows)}")
+        if self._on_saved:
+            await self._on_saved(batch)
+        return True
+
+    async def close(self) -> None:
+        """Останавливает повторы и делает последнюю попытку записать остаток."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._rows and await self._retry_batch():
+            pass
+        if self._rows:
+            logging.error(f"❌ При остановке не записано {len(self._rows)} строк /save из очереди повтора.")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._rows),
+            "queued": self.queued,
+            "retried_rows": self.retried_rows,
+            "dropped": self.dropped,
+        }